@@ -0,0 +1,210 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Archive module
+"""
+import re
+import gzip
+import shlex
+import tarfile
+from fnmatch import fnmatch
+from StringIO import StringIO
+from pipes import quote
+
+
+class GitArchive(object):
+    """
+    GitArchive class
+
+    Builds a source archive straight from a revision in the git object store, without a checkout
+    The contents are described by the same 'source_contents' tar arguments as used in the code settings, eg:
+    --transform 's,^,<package name>-<version>/,' --exclude=*.pyc ovs config *.txt
+    Supported are a prefix transformation, exclusions and (top-level globbed) paths
+    """
+
+    TRANSFORM_REGEX = re.compile(r'^s(?P<separator>.)\^(?P=separator)(?P<prefix>[^\\]*?)(?P=separator)$')
+
+    def __init__(self, prefix, paths, excludes):
+        """
+        Initializes a git archive
+        :param prefix: Prefix to give all entries within the archive
+        :type prefix: str
+        :param paths: Paths to include. Can contain globs
+        :type paths: list[str]
+        :param excludes: Patterns of the entries to exclude
+        :type excludes: list[str]
+        """
+        self.prefix = prefix
+        self.paths = paths
+        self.excludes = excludes
+
+    @staticmethod
+    def from_source_contents(source_contents):
+        """
+        Parses the tar arguments of the source contents
+        :param source_contents: The tar arguments
+        :type source_contents: str
+        :return: The git archive or None when the arguments contain options which cannot be mimicked
+        :rtype: GitArchive
+        """
+        prefix = ''
+        paths = []
+        excludes = []
+        tokens = shlex.split(source_contents)
+        while len(tokens) > 0:
+            token = tokens.pop(0)
+            if token.startswith('--transform') or token.startswith('--xform'):
+                expression = token.split('=', 1)[1] if '=' in token else tokens.pop(0)
+                match = GitArchive.TRANSFORM_REGEX.match(expression)
+                if not match:
+                    return None
+                prefix = match.group('prefix')
+            elif token.startswith('--exclude'):
+                excludes.append(token.split('=', 1)[1] if '=' in token else tokens.pop(0))
+            elif token.startswith('-'):
+                return None
+            else:
+                paths.append(token)
+        return GitArchive(prefix=prefix, paths=paths, excludes=excludes)
+
+    def _is_excluded(self, name):
+        # Like tar, the patterns are matched against the full name and against every trailing part of it. Tar does not
+        # descend into excluded directories, so an entry is also excluded when any of its parent directories is
+        parts = name.split('/')
+        for end in xrange(1, len(parts) + 1):
+            for start in xrange(end):
+                sub_name = '/'.join(parts[start:end])
+                if any(fnmatch(sub_name, pattern) for pattern in self.excludes):
+                    return True
+        return False
+
+    def _resolve_paths(self, repository_path, revision, virtual_files, timeout=None, retries=0):
+        """
+        Resolves the (globbed) paths against the top-level entries of the revision, like the shell would
+        :return: The git paths and the virtual files which match
+        :rtype: tuple(list[str], list[str])
+        """
+        from packaging.sourcecollector import SourceCollector
+        entries = SourceCollector.run(command='git ls-tree --name-only {0}'.format(quote(revision)),
+                                      working_directory=repository_path,
+                                      timeout=timeout,
+                                      retries=retries).splitlines()
+        git_paths = []
+        virtual_names = []
+        for path in self.paths:
+            if '/' in path or not any(character in path for character in '*?['):
+                if path in virtual_files:
+                    virtual_names.append(path)
+                else:
+                    git_paths.append(path)
+                continue
+            for entry in entries + sorted(virtual_files):
+                if entry.startswith('.') and not path.startswith('.'):
+                    continue
+                if fnmatch(entry, path):
+                    if entry in virtual_files:
+                        virtual_names.append(entry)
+                    elif entry not in git_paths:
+                        git_paths.append(entry)
+        return git_paths, sorted(set(virtual_names))
+
+    def build(self, repository_path, revision, archive_path, virtual_files=None, mtime=None, timeout=None, retries=0):
+        """
+        Writes the gzipped tar archive of the given revision
+        :param repository_path: Path of the repository (or worktree)
+        :type repository_path: str
+        :param revision: Revision to archive
+        :type revision: str
+        :param archive_path: Path of the archive to write
+        :type archive_path: str
+        :param virtual_files: Files which are not in the repository to add (name -> contents). Added when they match the paths
+        :type virtual_files: dict
+        :param mtime: Modification time to give the virtual files
+        :type mtime: float
+        :param timeout: Seconds after which a git command gets killed
+        :type timeout: float
+        :param retries: Amount of times to retry listing the revision. The archive itself is streamed, so it is not retried
+        :type retries: int
+        :return: The amount of entries in the archive
+        :rtype: int
+        """
+        from packaging.sourcecollector import SourceCollector
+        virtual_files = virtual_files or {}
+        git_paths, virtual_names = self._resolve_paths(repository_path, revision, virtual_files, timeout=timeout, retries=retries)
+        count = 0
+        with open(archive_path, 'wb') as archive_file:
+            gzip_file = gzip.GzipFile(filename='', mode='wb', fileobj=archive_file, compresslevel=6)
+            output = tarfile.open(fileobj=gzip_file, mode='w|', format=tarfile.GNU_FORMAT)
+            if len(git_paths) > 0:
+                stream = SourceCollector.stream(command='git archive --format=tar {0} -- {1}'.format(quote(revision), ' '.join(quote(path) for path in git_paths)),
+                                                working_directory=repository_path,
+                                                timeout=timeout,
+                                                chunk_size=65536)
+                try:
+                    source = tarfile.open(fileobj=_StreamReader(stream), mode='r|')
+                    for member in source:
+                        if member.type == tarfile.XGLTYPE:
+                            continue  # Global header holding the commit id
+                        if self._is_excluded(member.name.rstrip('/')):
+                            continue
+                        member.name = self.prefix + member.name
+                        output.addfile(member, source.extractfile(member) if member.isreg() else None)
+                        count += 1
+                    source.close()
+                    for _ in stream:
+                        pass  # Drains the padding after the last member, which also checks the exit status
+                finally:
+                    stream.close()
+            for name in virtual_names:
+                contents = virtual_files[name]
+                info = tarfile.TarInfo(self.prefix + name)
+                info.size = len(contents)
+                info.mode = 0644
+                if mtime is not None:
+                    info.mtime = mtime
+                output.addfile(info, StringIO(contents))
+                count += 1
+            output.close()
+            gzip_file.close()
+        return count
+
+
+class _StreamReader(object):
+    """
+    File-like reader over the chunked output of a streamed command (see SourceCollector.stream), as tarfile reads with read(size)
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.chunk = ''
+        self.offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.offset >= len(self.chunk):
+                try:
+                    self.chunk = next(self.stream)
+                except StopIteration:
+                    break
+                self.offset = 0
+            end = len(self.chunk) if size < 0 else min(len(self.chunk), self.offset + size)
+            parts.append(self.chunk[self.offset:end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return ''.join(parts)
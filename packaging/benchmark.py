@@ -0,0 +1,510 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Benchmark module
+Measures the packaging performance offline: against synthetic product repositories and local stand-ins of the build
+tools and package servers. Usage:
+python -m packaging.benchmark [-s small,medium] [-n <repeat>] [-o results.json]
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import getpass
+import platform
+import traceback
+from optparse import OptionParser
+from subprocess import Popen, PIPE
+from packaging.helpers import format_duration, redirect_output
+
+SCALES = {'small': {'commits': 50, 'tags': 5, 'files': 50, 'file_size': 1024, 'payload_size': 64 * 1024, 'rpm_packages': 1},
+          'medium': {'commits': 500, 'tags': 50, 'files': 500, 'file_size': 4096, 'payload_size': 1024 ** 2, 'rpm_packages': 4},
+          'large': {'commits': 5000, 'tags': 500, 'files': 5000, 'file_size': 16384, 'payload_size': 16 * 1024 ** 2, 'rpm_packages': 10}}
+
+# Stand-ins for the build tools and the tools on the package servers. They mimic just enough to let the packaging flow run
+FAKE_TOOLS = {
+    'dpkg-buildpackage': r'''
+# Writes a .deb of FWK_BENCHMARK_PAYLOAD_SIZE bytes for every binary package in debian/control
+# Like real rebuilds, the builds of a package only differ in a small part (the first 4 KiB)
+import binascii, os, random, re
+with open('debian/changelog') as changelog_file:
+    version = re.match(r'^\S+ \((\S+)\)', changelog_file.readline()).group(1)
+with open('debian/control') as control_file:
+    names = re.findall(r'^Package: *(\S+)', control_file.read(), re.M)
+for name in names:
+    with open('../{0}_{1}_amd64.deb'.format(name, version), 'wb') as deb_file:
+        size = int(os.environ.get('FWK_BENCHMARK_PAYLOAD_SIZE', 65536))
+        deb_file.write(os.urandom(min(size, 4096)))
+        remaining = max(0, size - 4096)
+        if remaining > 0:
+            deb_file.write(binascii.unhexlify('{0:0{1}x}'.format(random.Random(name).getrandbits(remaining * 8), remaining * 2)))
+''',
+    'fpm': r'''
+# Writes an .rpm of FWK_BENCHMARK_PAYLOAD_SIZE bytes for the -n and -v arguments. Builds only differ in the first 4 KiB
+import binascii, os, random, sys
+arguments = sys.argv[1:]
+name = arguments[arguments.index('-n') + 1]
+version = arguments[arguments.index('-v') + 1]
+with open('{0}-{1}-1.noarch.rpm'.format(name, version), 'wb') as rpm_file:
+    size = int(os.environ.get('FWK_BENCHMARK_PAYLOAD_SIZE', 65536))
+    rpm_file.write(os.urandom(min(size, 4096)))
+    remaining = max(0, size - 4096)
+    if remaining > 0:
+        rpm_file.write(binascii.unhexlify('{0:0{1}x}'.format(random.Random(name).getrandbits(remaining * 8), remaining * 2)))
+''',
+    'createrepo': r'''
+''',
+    'ssh': r'''
+# Executes the command locally. Connection options and control commands are ignored
+import subprocess, sys
+arguments = sys.argv[1:]
+while len(arguments) > 0 and arguments[0].startswith('-'):
+    option = arguments.pop(0)
+    if option == '-O':
+        sys.exit(0)  # Control command of the multiplexed connection
+    if option in ['-o', '-p', '-i', '-l']:
+        arguments.pop(0)
+sys.exit(subprocess.call(' '.join(arguments[1:]), shell=True))
+''',
+    'rsync': r'''
+# Copies locally and reports --stats like rsync does. The destination, or a similarly named file in its folder (--fuzzy),
+# is the basis: only the 4 KiB blocks which differ from it count as literal data
+import os, shutil, sys
+arguments = sys.argv[1:]
+positional = []
+while len(arguments) > 0:
+    argument = arguments.pop(0)
+    if argument == '-e':
+        arguments.pop(0)
+    elif not argument.startswith('-'):
+        positional.append(argument)
+source, destination = positional[0], positional[1].split(':', 1)[-1]
+basis = destination if os.path.exists(destination) else None
+if basis is None and os.path.isdir(os.path.dirname(destination)):
+    candidates = sorted((len(os.path.commonprefix([name, os.path.basename(destination)])), name) for name in os.listdir(os.path.dirname(destination)))
+    basis = os.path.join(os.path.dirname(destination), candidates[-1][1]) if len(candidates) > 0 else None
+literal = matched = 0
+with open(source, 'rb') as source_file:
+    basis_file = open(basis, 'rb') if basis is not None else None
+    while True:
+        block = source_file.read(4096)
+        if block == '':
+            break
+        if basis_file is not None and basis_file.read(4096) == block:
+            matched += len(block)
+        else:
+            literal += len(block)
+    if basis_file is not None:
+        basis_file.close()
+shutil.copy(source, destination)
+size = os.path.getsize(source)
+print('Number of files: 1\nTotal file size: {0:,} bytes\nLiteral data: {1:,} bytes\nMatched data: {2:,} bytes\nTotal bytes sent: {3:,}'.format(
+    size, literal, matched, literal + matched // 4096 * 20 + 100))
+''',
+    'scp': r'''
+# Copies locally. Connection options are ignored
+import shutil, sys
+arguments = sys.argv[1:]
+while len(arguments) > 0 and arguments[0].startswith('-'):
+    if arguments.pop(0) in ['-o', '-P', '-i']:
+        arguments.pop(0)
+source, destination = arguments
+shutil.copy(source, destination.split(':', 1)[1] if ':' in destination else destination)
+''',
+    'reprepro': r'''
+# Keeps the packages of every distribution in db/<distribution>.json and exports dists/<distribution> like reprepro does
+import gzip, hashlib, json, os, re, shutil, sys
+arguments = sys.argv[1:]
+base = '.'
+positional = []
+while len(arguments) > 0:
+    argument = arguments.pop(0)
+    if re.match(r'^-[a-zA-Z]*b$', argument):
+        base = arguments.pop(0)
+    elif not argument.startswith('-'):
+        positional.append(argument)
+command, distribution = positional[0], positional[1]
+
+def db_path(name):
+    return os.path.join(base, 'db', '{0}.json'.format(name))
+
+def load(name):
+    if not os.path.exists(db_path(name)):
+        return {}
+    with open(db_path(name)) as db_file:
+        return json.load(db_file)
+
+def save(name, packages):
+    if not os.path.isdir(os.path.join(base, 'db')):
+        os.makedirs(os.path.join(base, 'db'))
+    with open(db_path(name), 'w') as db_file:
+        json.dump(packages, db_file)
+
+def export(name):
+    packages = load(name)
+    index_path = os.path.join(base, 'dists', name, 'main', 'binary-amd64')
+    if not os.path.isdir(index_path):
+        os.makedirs(index_path)
+    stanzas = []
+    for package_name in sorted(packages):
+        package = packages[package_name]
+        stanzas.append('Package: {0}\nVersion: {1}\nArchitecture: amd64\nFilename: {2}\nSize: {3}\nSHA256: {4}\n'.format(
+            package_name, package['version'], package['filename'], package['size'], package['sha256']))
+    gzip_file = gzip.open(os.path.join(index_path, 'Packages.gz'), 'wb')
+    gzip_file.write('\n'.join(stanzas).encode('utf-8'))
+    gzip_file.close()
+    with open(os.path.join(index_path, 'Packages.gz'), 'rb') as index_file:
+        contents = index_file.read()
+    with open(os.path.join(base, 'dists', name, 'Release'), 'w') as release_file:
+        release_file.write('Codename: {0}\nComponents: main\nArchitectures: amd64\nSHA256:\n {1} {2} main/binary-amd64/Packages.gz\n'.format(
+            name, hashlib.sha256(contents).hexdigest(), len(contents)))
+
+if command == 'list':
+    for package_name, package in sorted(load(distribution).items()):
+        print('{0}|main|amd64: {1} {2}'.format(distribution, package_name, package['version']))
+elif command == 'includedeb':
+    deb_path = positional[2]
+    package_name, version = os.path.basename(deb_path).split('_')[:2]
+    filename = 'pool/main/{0}/{1}/{2}'.format(package_name[0], package_name, os.path.basename(deb_path))
+    if not os.path.isdir(os.path.dirname(os.path.join(base, filename))):
+        os.makedirs(os.path.dirname(os.path.join(base, filename)))
+    shutil.copy(deb_path, os.path.join(base, filename))
+    with open(deb_path, 'rb') as deb_file:
+        sha256 = hashlib.sha256(deb_file.read()).hexdigest()
+    packages = load(distribution)
+    packages[package_name] = {'version': version, 'filename': filename, 'size': os.path.getsize(deb_path), 'sha256': sha256}
+    save(distribution, packages)
+    if '--export=never' not in sys.argv:
+        export(distribution)
+elif command == 'copy':
+    source = load(positional[2])
+    packages = load(distribution)
+    for package_name in positional[3:]:
+        if package_name in source:
+            packages[package_name] = source[package_name]
+    save(distribution, packages)
+    if '--export=never' not in sys.argv:
+        export(distribution)
+elif command == 'export':
+    export(distribution)
+else:
+    sys.stderr.write('Unsupported command {0}\n'.format(command))
+    sys.exit(1)
+'''
+}
+
+
+class Benchmark(object):
+    """
+    Benchmark class
+
+    Times the packaging flow of a synthetic product at a given scale:
+    * A product repository is generated with the configured amount of commits, version tags and files
+    * dpkg-buildpackage, fpm, reprepro, createrepo, ssh and scp are replaced by local stand-ins (see FAKE_TOOLS)
+    * The package destinations are local directories, reached through the configured transport
+    Timed are SourceCollector.collect(), package() and upload() of every packager, the artifact export and repo-maintenance.py
+    When pipelined, package_and_upload() of every packager is timed instead of package() and upload()
+    """
+
+    STEPS = ['collect', 'package_debian', 'upload_debian', 'package_upload_debian', 'package_redhat', 'upload_redhat', 'package_upload_redhat',
+             'artifact', 'repo_maintenance']
+    PROMOTION_RELEASE = 'benchmark'  # Release which repo-maintenance.py promotes the packaged release to
+
+    def __init__(self, name, parameters, work_directory, release='master', transport='local', pipeline=False, transfer=None):
+        """
+        Initializes a benchmark
+        :param name: Name of the scale (used to name the product)
+        :type name: str
+        :param parameters: Parameters of the scale. See SCALES
+        :type parameters: dict
+        :param work_directory: Directory to generate the repository, tools, builds and package servers in
+        :type work_directory: str
+        :param release: Release to package
+        :type release: str
+        :param transport: Transport to reach the package servers with ('local' or 'ssh', using the ssh/scp stand-ins)
+        :type transport: str
+        :param pipeline: Upload every package as soon as it is built. See Packager.package_and_upload
+        :type pipeline: bool
+        :param transfer: How the transport copies files (eg: 'rsync', using the rsync stand-in). None for the default of the transport
+        :type transfer: str
+        """
+        self.name = name
+        self.parameters = parameters
+        self.work_directory = os.path.join(work_directory, name)
+        self.release = release
+        self.transport = transport
+        self.pipeline = pipeline
+        self.transfer = transfer
+        self.product = 'benchmark-{0}'.format(name)
+
+        self.path_origin = os.path.join(self.work_directory, 'origin.git')
+        self.path_tools = os.path.join(self.work_directory, 'bin')
+        self.path_remote = os.path.join(self.work_directory, 'remote')
+        self.path_workspace = os.path.join(self.work_directory, 'workspace')
+        self.path_settings = os.path.join(self.work_directory, 'settings.json')
+        self.path_log = os.path.join(self.work_directory, 'benchmark.log')
+
+    @staticmethod
+    def _run(command, working_directory, stdin=None):
+        process = Popen(command, shell=True, cwd=working_directory, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        output, error = process.communicate(stdin)
+        if process.returncode != 0:
+            raise RuntimeError('Command \'{0}\' returned non-zero exit status {1}: {2}'.format(command, process.returncode, error))
+        return output
+
+    def setup(self):
+        """
+        Generates the repository, the tool stand-ins, the package servers and the settings
+        :return: None
+        :rtype: NoneType
+        """
+        if os.path.exists(self.work_directory):
+            self._run('rm -rf {0}'.format(self.work_directory), '/')
+        for directory in [self.path_tools, self.path_workspace,
+                          os.path.join(self.path_remote, 'debian', 'pool', 'main'),
+                          os.path.join(self.path_remote, 'pool')]:
+            os.makedirs(directory)
+        for tool, source in FAKE_TOOLS.iteritems():
+            tool_path = os.path.join(self.path_tools, tool)
+            with open(tool_path, 'w') as tool_file:
+                tool_file.write('#!{0}\n{1}'.format(sys.executable, source))
+            os.chmod(tool_path, 0755)
+        cleanup_path = os.path.join(self.path_remote, 'cleanup_repo.py')
+        with open(cleanup_path, 'w') as cleanup_file:
+            cleanup_file.write('#!/bin/sh\necho "Nothing to clean up in $1"\n')
+        os.chmod(cleanup_path, 0755)
+        self._create_repository()
+        self._write_settings()
+
+    def _create_repository(self):
+        """
+        Generates the product repository with git fast-import
+        * The first commit adds all files, every next commit changes one of them
+        * The version tags are spread evenly over the history. The last commit is not tagged
+        * master and develop both point to the last commit
+        """
+        package_name = self.product
+        commits = max(1, self.parameters['commits'])
+        files = max(1, self.parameters['files'])
+        file_size = self.parameters['file_size']
+        tags = min(self.parameters['tags'], commits - 1)
+        rpm_packages = max(1, self.parameters['rpm_packages'])
+        tag_interval = (commits - 1) / tags if tags > 0 else None
+
+        def _data(contents):
+            return 'data {0}\n{1}\n'.format(len(contents), contents)
+
+        def _file(path, contents, mode='100644'):
+            return 'M {0} inline {1}\n{2}'.format(mode, path, _data(contents))
+
+        code_settings = {'version': {'major': 1, 'minor': 0},
+                         'package_name': package_name,
+                         'product_name': 'Benchmark {0}'.format(self.name),
+                         'source_contents': "--transform 's,^,{0}-{1}/,' --exclude=*.pyc src packaging *.txt",
+                         'tags': ['community']}
+        control = 'Source: {0}\nMaintainer: Benchmark <benchmark@localhost>\n\nPackage: {0}\nArchitecture: amd64\nDescription: Benchmark\n'.format(package_name)
+        stream = []
+        timestamp = int(time.time()) - commits * 60
+        for index in xrange(commits):
+            stream.append('commit refs/heads/master\nmark :{0}\n'.format(index + 1))
+            stream.append('committer Benchmark <benchmark@localhost> {0} +0000\n'.format(timestamp + index * 60))
+            stream.append(_data('Change {0}'.format(index)))
+            if index == 0:
+                stream.append(_file('packaging/settings.json', json.dumps(code_settings, indent=4)))
+                stream.append(_file('packaging/debian/debian/control', control))
+                stream.append(_file('packaging/debian/debian/compat', '9\n'))
+                stream.append(_file('packaging/debian/debian/rules', '#!/usr/bin/make -f\n%:\n\tdh $@\n', mode='100755'))
+                stream.append(_file('packaging/debian/debian/{0}.install'.format(package_name), 'src/* opt/benchmark/\n'))
+                for rpm_index in xrange(rpm_packages):
+                    stream.append(_file('packaging/redhat/cfgs/{0}.cfg'.format(rpm_index),
+                                        '[main]\nname={0}-{1}\ndirs=src=opt/benchmark\nfiles=\'\'\ndepends=\nsummary=Benchmark\n'
+                                        'license=Apache\nURL=localhost\nsource=localhost\narch=noarch\ndescription=Benchmark\n'
+                                        'maintainer=Benchmark\n'.format(package_name, rpm_index)))
+                for file_index in xrange(files):
+                    stream.append(_file('src/{0}/{1}.py'.format(file_index % 16, file_index), 'x' * file_size))
+            else:
+                stream.append('from :{0}\n'.format(index))
+                file_index = index % files
+                stream.append(_file('src/{0}/{1}.py'.format(file_index % 16, file_index), '{0} {1}'.format(index, 'x' * file_size)[:max(file_size, 8)]))
+            stream.append('\n')
+        for tag_index in xrange(tags):
+            stream.append('reset refs/tags/1.0.{0}\nfrom :{1}\n\n'.format(tag_index, 1 + tag_index * tag_interval))
+        stream.append('reset refs/heads/develop\nfrom :{0}\n\n'.format(commits))
+        self._run('git init --bare -q {0}'.format(self.path_origin), '/')
+        self._run('git fast-import --quiet', self.path_origin, stdin=''.join(stream))
+
+    def _write_settings(self):
+        """
+        Writes the packaging settings which point to the synthetic repository and the local package servers
+        """
+        from packaging.sourcecollector import SourceCollector
+        settings = copy.deepcopy(SourceCollector.get_settings())
+        destination = {'ip': 'localhost',
+                       'user': getpass.getuser(),
+                       'base_path': self.path_remote,
+                       'tags': ['community']}
+        settings['base_path'] = os.path.join(self.work_directory, 'build', '{0}')
+        settings['repositories']['code'] = {self.product: self.path_origin}
+        settings['repositories']['exclude_builds'] = {}
+        settings['repositories']['packages'] = {'debian': [destination],
+                                                'redhat': [destination]}
+        settings['transport'] = {'type': self.transport,
+                                 'ssh': {'control_path': os.path.join(self.work_directory, 'ssh-{0}-%r@%h:%p')},
+                                 'local': {}}
+        if self.transfer is not None:
+            settings['transport'][self.transport]['transfer'] = self.transfer
+        settings['build_cache'] = {'directory': None}
+        settings['pool_index'] = {'cache_directory': os.path.join(self.work_directory, 'pool-index'),
+                                  'max_age': 3600}
+        settings['repository_state'] = {'cache_directory': os.path.join(self.work_directory, 'repository-state')}
+        with open(self.path_settings, 'w') as settings_file:
+            json.dump(settings, settings_file, indent=4)
+
+    def _get_environment(self):
+        environment = dict(os.environ)
+        environment.update({'PATH': '{0}{1}{2}'.format(self.path_tools, os.pathsep, os.environ.get('PATH', '')),
+                            'WORKSPACE': self.path_workspace,
+                            'FWK_BENCHMARK_PAYLOAD_SIZE': str(self.parameters['payload_size']),
+                            'PYTHONPATH': os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                            'GIT_AUTHOR_NAME': 'Benchmark', 'GIT_AUTHOR_EMAIL': 'benchmark@localhost',
+                            'GIT_COMMITTER_NAME': 'Benchmark', 'GIT_COMMITTER_EMAIL': 'benchmark@localhost'})
+        from packaging.sourcecollector import SourceCollector
+        environment[SourceCollector.SETTINGS_ENVIRONMENT_VARIABLE] = self.path_settings
+        return environment
+
+    def run_once(self):
+        """
+        Runs the packaging flow once, timing every step
+        :return: The duration of every step and the error when a step failed
+        :rtype: dict
+        """
+        from packaging.packagers.debian import DebianPackager
+        from packaging.packagers.redhat import RPMPackager
+        from packaging.sourcecollector import SourceCollector
+        from packaging.poolindex import PoolIndex
+        from packaging.transport import Transport
+
+        durations = {}
+        result = {'steps': durations, 'error': None}
+        saved_environment = dict(os.environ)
+        os.environ.update(self._get_environment())
+        try:
+            def _timed(step, function):
+                start = time.time()
+                function()
+                durations[step] = time.time() - start
+
+            with redirect_output(self.path_log):
+                source_collector = SourceCollector(product=self.product, release=self.release)
+                _timed('collect', source_collector.collect)
+                packagers = [DebianPackager(source_collector=source_collector), RPMPackager(source_collector=source_collector)]
+                for packager in packagers:
+                    if self.pipeline is True:
+                        _timed('package_upload_{0}'.format(packager.distro), lambda: packager.package_and_upload(add=True))
+                    else:
+                        _timed('package_{0}'.format(packager.distro), packager.package)
+                        _timed('upload_{0}'.format(packager.distro), lambda: packager.upload(add=True))
+
+                def _export():
+                    packagers[0].clean_artifact_folder(distros=[p.distro for p in packagers])
+                    for _packager in packagers:
+                        _packager.prepare_artifact()
+                _timed('artifact', _export)
+                Transport.close_all()
+                PoolIndex.clear()  # Every run of the packager is a new process
+            maintenance_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'repo-maintenance.py')
+            _timed('repo_maintenance', lambda: self._run('{0} {1} -f {2} -t {3} >> {4} 2>&1'.format(sys.executable, maintenance_path, source_collector.release_repo,
+                                                                                                     self.PROMOTION_RELEASE, self.path_log),
+                                                         os.path.dirname(maintenance_path)))
+        except Exception:
+            result['error'] = traceback.format_exc()
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_environment)
+        return result
+
+
+def main():
+    """
+    Runs the benchmarks and writes the results as JSON
+    """
+    parser = OptionParser(description='Open vStorage packaging benchmark')
+    parser.add_option('-s', '--scales', dest='scales', default='small', help='Comma separated list of scales: {0}'.format(', '.join(sorted(SCALES))))
+    parser.add_option('-n', '--repeat', dest='repeat', type='int', default=2, help='Amount of runs per scale. The first run is cold, the next ones are warm')
+    parser.add_option('-o', '--output', dest='output', default=None, help='Path to write the JSON results to. Defaults to stdout')
+    parser.add_option('-w', '--work-directory', dest='work_directory', default='/tmp/fwk-benchmark')
+    parser.add_option('-r', '--release', dest='release', default='master')
+    parser.add_option('-t', '--transport', dest='transport', choices=['local', 'ssh'], default='local')
+    parser.add_option('--pipeline', dest='pipeline', action='store_true', default=False, help='Upload every package as soon as it is built')
+    parser.add_option('--transfer', dest='transfer', default=None, help='How to copy the packages (scp or rsync for ssh, copy or rsync for local)')
+    for parameter in ['commits', 'tags', 'files', 'file_size', 'payload_size', 'rpm_packages']:
+        parser.add_option('--{0}'.format(parameter.replace('_', '-')), dest=parameter, type='int', default=None,
+                          help='Override the {0} of every scale'.format(parameter.replace('_', ' ')))
+    options, _ = parser.parse_args()
+
+    results = {'timestamp': int(time.time()),
+               'python': platform.python_version(),
+               'revision': Benchmark._run('git rev-parse HEAD 2>/dev/null || true', os.path.dirname(os.path.realpath(__file__))).strip() or None,
+               'transport': options.transport,
+               'pipeline': options.pipeline,
+               'transfer': options.transfer,
+               'release': options.release,
+               'scales': []}
+    exit_code = 0
+    for name in [scale.strip() for scale in options.scales.split(',') if scale.strip() != '']:
+        if name not in SCALES:
+            parser.error('Unknown scale {0}. Possible options are: {1}'.format(name, ', '.join(sorted(SCALES))))
+        parameters = dict(SCALES[name])
+        for parameter in parameters:
+            if getattr(options, parameter) is not None:
+                parameters[parameter] = getattr(options, parameter)
+        benchmark = Benchmark(name=name, parameters=parameters, work_directory=options.work_directory,
+                              release=options.release, transport=options.transport, pipeline=options.pipeline,
+                              transfer=options.transfer)
+        sys.stderr.write('Setting up scale {0}: {1}\n'.format(name, parameters))
+        start = time.time()
+        benchmark.setup()
+        scale_result = {'name': name,
+                        'parameters': parameters,
+                        'setup': time.time() - start,
+                        'log': benchmark.path_log,
+                        'runs': []}
+        for run in xrange(options.repeat):
+            run_result = benchmark.run_once()
+            scale_result['runs'].append(run_result)
+            sys.stderr.write('  Run {0}: {1}\n'.format(run + 1, ', '.join('{0} {1}'.format(step, format_duration(run_result['steps'][step]))
+                                                                        for step in Benchmark.STEPS if step in run_result['steps'])))
+            if run_result['error'] is not None:
+                sys.stderr.write('  Run {0} FAILED. See {1}\n{2}'.format(run + 1, benchmark.path_log, run_result['error']))
+                exit_code = 1
+                break
+        results['scales'].append(scale_result)
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if options.output is None:
+        print output
+    else:
+        with open(options.output, 'w') as output_file:
+            output_file.write(output)
+        sys.stderr.write('Results written to {0}\n'.format(options.output))
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Build cache module
+"""
+import os
+import time
+import errno
+import shutil
+import hashlib
+
+
+class BuildCache(object):
+    """
+    BuildCache class
+
+    Local cache of built packages, keyed on a digest of everything that influences the build:
+    * The full revision hash of the code
+    * The version string of the package, without the timestamp of dev builds (so rebuilds of the same revision hit the
+      cache and restore the packages of the earlier build, with its version)
+    * The release repository (eg: in the debian changelog)
+    * The contents of the packaging folder of the code
+    * The distro
+    The cache is bounded in size. When it grows too large, the least recently used entries are evicted
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        Initializes a build cache
+        :param directory: Local directory to store the cached packages in
+        :type directory: str
+        :param max_size: Maximum size of the cache in bytes
+        :type max_size: int
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def from_settings(settings):
+        """
+        Creates the build cache as configured in the 'build_cache' section of the settings
+        :param settings: Packaging settings
+        :type settings: dict
+        :return: The build cache or None when caching is disabled
+        :rtype: BuildCache
+        """
+        cache_settings = settings.get('build_cache', {})
+        if cache_settings.get('directory') is None:
+            return None
+        return BuildCache(directory=cache_settings['directory'],
+                          max_size=cache_settings.get('max_size', 10 * 1024 ** 3))
+
+    @staticmethod
+    def compute_key(source_collector, distro):
+        """
+        Computes the cache key of a build
+        :param source_collector: SourceCollector instance which collected the sources
+        :type source_collector: packaging.sourcecollector.SourceCollector
+        :param distro: Distro to package for
+        :type distro: str
+        :return: The cache key
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        for item in [source_collector.product, source_collector.commit_hash, source_collector.version_without_timestamp,
+                     source_collector.release_repo, distro]:
+            digest.update('{0}\0'.format(item))
+        packaging_path = os.path.join(source_collector.path_code, 'packaging')
+        for root, dirs, files in os.walk(packaging_path):
+            dirs.sort()
+            for filename in sorted(files):
+                file_path = os.path.join(root, filename)
+                digest.update('{0}\0{1:o}\0'.format(os.path.relpath(file_path, packaging_path), os.stat(file_path).st_mode))
+                with open(file_path, 'rb') as packaging_file:
+                    for chunk in iter(lambda: packaging_file.read(1024 * 1024), ''):
+                        digest.update(chunk)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def restore(self, key, destination_folder):
+        """
+        Restores the cached packages of a build
+        :param key: Cache key of the build
+        :type key: str
+        :param destination_folder: Folder to restore the packages into. Will be recreated
+        :type destination_folder: str
+        :return: Whether the build was cached (and restored)
+        :rtype: bool
+        """
+        entry_path = self._entry_path(key)
+        if not os.path.isdir(entry_path):
+            print 'Build cache miss ({0})'.format(key)
+            return False
+        try:
+            if os.path.exists(destination_folder):
+                shutil.rmtree(destination_folder)
+            os.makedirs(destination_folder)
+            for filename in sorted(os.listdir(entry_path)):
+                shutil.copy2(os.path.join(entry_path, filename), os.path.join(destination_folder, filename))
+                print 'Restored {0} from the build cache'.format(filename)
+            # Mark as recently used
+            os.utime(entry_path, None)
+        except (IOError, OSError) as ex:
+            # Entry got evicted by another build in the meantime
+            print 'Build cache entry {0} could not be restored: {1}'.format(key, ex)
+            return False
+        print 'Build cache hit ({0})'.format(key)
+        return True
+
+    def store(self, key, source_folder, package_suffix):
+        """
+        Stores the packages of a build
+        :param key: Cache key of the build
+        :type key: str
+        :param source_folder: Folder containing the built packages
+        :type source_folder: str
+        :param package_suffix: Suffix of the package files to store
+        :type package_suffix: str
+        :return: None
+        :rtype: NoneType
+        """
+        filenames = [filename for filename in os.listdir(source_folder) if filename.endswith(package_suffix)]
+        if len(filenames) == 0:
+            return
+        entry_path = self._entry_path(key)
+        temp_path = '{0}.{1}.tmp'.format(entry_path, os.getpid())
+        try:
+            os.makedirs(temp_path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        for filename in filenames:
+            shutil.copy2(os.path.join(source_folder, filename), os.path.join(temp_path, filename))
+        try:
+            os.rename(temp_path, entry_path)
+            print 'Stored {0} package(s) in the build cache ({1})'.format(len(filenames), key)
+        except OSError:
+            # Stored by another build in the meantime
+            shutil.rmtree(temp_path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits within its maximum size
+        :return: None
+        :rtype: NoneType
+        """
+        entries = []
+        total_size = 0
+        for key in os.listdir(self.directory):
+            entry_path = self._entry_path(key)
+            if key.endswith('.tmp') or not os.path.isdir(entry_path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_path, filename)) for filename in os.listdir(entry_path))
+                entries.append((os.path.getmtime(entry_path), size, entry_path))
+            except OSError:
+                continue  # Evicted concurrently
+            total_size += size
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            print 'Evicting {0} from the build cache'.format(os.path.basename(entry_path))
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
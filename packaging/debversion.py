@@ -0,0 +1,130 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Debian version module
+"""
+import re
+
+
+class DebianVersion(object):
+    """
+    DebianVersion class
+
+    Parses and compares versions the way dpkg does ([epoch:]upstream[-revision])
+    * Epochs are compared numerically, before anything else
+    * Digits are compared numerically and everything else character by character, where letters sort before other
+      characters and '~' sorts before everything, even the end of the version (1.0~rc1 < 1.0 < 1.0a < 1.0.1)
+    * Every version is parsed into a sort key once. The keys are cached, so sorting or selecting the latest out of
+      thousands of versions only compares tuples
+    """
+
+    _PART_REGEX = re.compile('(\D*)(\d*)')
+    _END = ((0,), 0)  # Key of the end of a version part
+    _keys = {}  # Version -> sort key
+
+    @staticmethod
+    def parse(version):
+        """
+        Splits a version in its epoch, upstream version and revision
+        :param version: Version (eg: 1:2.7.8-1)
+        :type version: str
+        :return: The epoch, the upstream version and the revision ('' when there is none)
+        :rtype: tuple(int, str, str)
+        """
+        epoch = 0
+        if ':' in version:
+            raw_epoch, version = version.split(':', 1)
+            if not raw_epoch.isdigit():
+                raise ValueError('Version {0}:{1} has an invalid epoch'.format(raw_epoch, version))
+            epoch = int(raw_epoch)
+        revision = ''
+        if '-' in version:
+            version, revision = version.rsplit('-', 1)
+        return epoch, version, revision
+
+    @staticmethod
+    def _weight(character):
+        if character == '~':
+            return -1
+        if character.isalpha():
+            return ord(character)
+        return ord(character) + 256
+
+    @staticmethod
+    def _part_key(part):
+        segments = []
+        for characters, digits in DebianVersion._PART_REGEX.findall(part):
+            if characters == '' and digits == '':
+                continue
+            segments.append((tuple(DebianVersion._weight(character) for character in characters) + (0,), int(digits or 0)))
+        if len(segments) == 0:
+            segments.append(DebianVersion._END)  # An empty part equals 0 (1.0-0 == 1.0)
+        segments.append(DebianVersion._END)
+        return tuple(segments)
+
+    @staticmethod
+    def key(version):
+        """
+        Retrieves the sort key of a version
+        :param version: Version
+        :type version: str
+        :return: Key which sorts like dpkg compares the versions
+        :rtype: tuple
+        """
+        key = DebianVersion._keys.get(version)
+        if key is None:
+            epoch, upstream, revision = DebianVersion.parse(version)
+            key = (epoch, DebianVersion._part_key(upstream), DebianVersion._part_key(revision))
+            DebianVersion._keys[version] = key
+        return key
+
+    @staticmethod
+    def compare(version_1, version_2):
+        """
+        Compares two versions
+        :param version_1: Version
+        :type version_1: str
+        :param version_2: Version to compare with
+        :type version_2: str
+        :return: -1, 0 or 1 when the first version is older than, equal to or newer than the second one
+        :rtype: int
+        """
+        return cmp(DebianVersion.key(version_1), DebianVersion.key(version_2))
+
+    @staticmethod
+    def sort(versions, reverse=False):
+        """
+        Sorts versions
+        :param versions: Versions to sort
+        :type versions: iterable
+        :param reverse: Sort the newest version first
+        :type reverse: bool
+        :return: The sorted versions
+        :rtype: list[str]
+        """
+        return sorted(versions, key=DebianVersion.key, reverse=reverse)
+
+    @staticmethod
+    def latest(versions):
+        """
+        Selects the newest version
+        :param versions: Versions to select from
+        :type versions: iterable
+        :return: The newest version. None when there are no versions
+        :rtype: str
+        """
+        return max(versions, key=DebianVersion.key) if versions else None
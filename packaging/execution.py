@@ -0,0 +1,297 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Execution module
+"""
+import os
+import sys
+import time
+import signal
+import threading
+from collections import deque
+from multiprocessing.util import register_after_fork
+from subprocess import Popen, PIPE, STDOUT
+from packaging.tracing import Tracer, wait_process
+
+
+class CommandError(RuntimeError):
+    """
+    Raised when a command fails or times out
+    """
+
+    def __init__(self, command, exit_code, output_tail, timed_out=False):
+        """
+        :param command: The command which failed
+        :type command: str or list[str]
+        :param exit_code: Exit code of the command (negative signal number when it was killed)
+        :type exit_code: int
+        :param output_tail: The last lines of the output
+        :type output_tail: list[str]
+        :param timed_out: Whether the command was killed because it exceeded its timeout
+        :type timed_out: bool
+        """
+        self.command = command
+        self.exit_code = exit_code
+        self.output_tail = output_tail
+        self.timed_out = timed_out
+        reason = 'timed out' if timed_out is True else 'returned non-zero exit status {0}'.format(exit_code)
+        super(CommandError, self).__init__('Command \'{0}\' {1}. \n Output (last {2} lines): \n {3} \n'.format(Command.format(command), reason,
+                                                                                                            len(output_tail), ''.join(output_tail)))
+
+
+class Command(object):
+    """
+    Command class
+
+    Executes a single command, streaming its output line by line
+    * The command is a shell string or an argv list (executed without a shell)
+    * The command runs in its own process group. When it exceeds its timeout, a watchdog kills the whole group,
+      so also the processes it spawned (eg: the ssh process of a git fetch)
+    * Commands which are still running when the process gets terminated are killed as well. See kill_all
+    * The command can not read from the terminal (stdin is /dev/null): prompts fail instead of stalling the build
+    """
+
+    _active = {}  # Process group id -> Command
+    _lock = threading.Lock()
+
+    def __init__(self, command, working_directory, env=None, timeout=None, merge_stderr=False):
+        """
+        Initializes a command
+        :param command: Shell command or argv list
+        :type command: str or list[str]
+        :param working_directory: Directory to run the command in
+        :type working_directory: str
+        :param env: Environment variables to set (or to remove, when their value is None) on top of the current environment
+        :type env: dict
+        :param timeout: Seconds after which the command gets killed. None to wait forever
+        :type timeout: float
+        :param merge_stderr: Include the error output in the output
+        :type merge_stderr: bool
+        """
+        self.command = command
+        self.working_directory = working_directory
+        self.env = env
+        self.timeout = timeout
+        self.merge_stderr = merge_stderr
+
+        self.process = None
+        self.exit_code = None
+        self.timed_out = False
+
+    @staticmethod
+    def format(command):
+        """
+        Formats a command for printing
+        :param command: Shell command or argv list
+        :type command: str or list[str]
+        :return: The printable command
+        :rtype: str
+        """
+        if isinstance(command, basestring):
+            return command
+        from pipes import quote
+        return ' '.join(quote(argument) for argument in command)
+
+    @staticmethod
+    def get_name(command):
+        """
+        Retrieves the name of the executable of a command (eg: to name its trace span)
+        :param command: Shell command or argv list
+        :type command: str or list[str]
+        :return: Name of the executable
+        :rtype: str
+        """
+        tokens = command.split() if isinstance(command, basestring) else list(command)
+        while len(tokens) > 1 and '=' in tokens[0] and not tokens[0].startswith('-'):
+            tokens.pop(0)  # Environment variable assignments
+        return os.path.basename(tokens[0]) if len(tokens) > 0 else Command.format(command)
+
+    def _get_environment(self):
+        if self.env is None:
+            return None
+        environment = dict(os.environ)
+        for key, value in self.env.iteritems():
+            if value is None:
+                environment.pop(key, None)
+            else:
+                environment[key] = str(value)
+        return environment
+
+    def _kill(self, timed_out=False):
+        self.timed_out = self.timed_out or timed_out
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass  # Already gone
+
+    def lines(self, span=None):
+        """
+        Starts the command and yields its output line by line
+        Closing the generator before the output is exhausted kills the command
+        After the generator is exhausted, exit_code and timed_out are set
+        :param span: Trace span to record the resource usage of the command on
+        :type span: dict
+        :return: Generator yielding the lines of the output (including the line endings)
+        :rtype: generator
+        """
+        return self._output(lambda stdout: iter(stdout.readline, ''), span=span)
+
+    def chunks(self, size=65536, span=None):
+        """
+        Starts the command and yields its output in chunks, as soon as it is available. Meant for binary output
+        Closing the generator before the output is exhausted kills the command
+        After the generator is exhausted, exit_code and timed_out are set
+        :param size: Maximum size of a chunk
+        :type size: int
+        :param span: Trace span to record the resource usage of the command on
+        :type span: dict
+        :return: Generator yielding the chunks of the output
+        :rtype: generator
+        """
+        return self._output(lambda stdout: iter(lambda: os.read(stdout.fileno(), size), ''), span=span)
+
+    def _output(self, reader, span):
+        with open(os.devnull, 'r') as devnull:
+            # Buffered: unbuffered pipes are read a byte at a time by readline
+            self.process = Popen(self.command,
+                                 bufsize=-1,
+                                 shell=isinstance(self.command, basestring),
+                                 cwd=self.working_directory,
+                                 env=self._get_environment(),
+                                 stdin=devnull,
+                                 stdout=PIPE,
+                                 stderr=STDOUT if self.merge_stderr is True else None,
+                                 preexec_fn=os.setpgrp)
+        with Command._lock:
+            Command._active[self.process.pid] = self
+        watchdog = None
+        if self.timeout is not None:
+            watchdog = threading.Timer(self.timeout, self._kill, kwargs={'timed_out': True})
+            watchdog.daemon = True
+            watchdog.start()
+        finished = False
+        try:
+            for data in reader(self.process.stdout):
+                yield data
+            finished = True
+        finally:
+            if finished is False:
+                self._kill()
+            if watchdog is not None:
+                watchdog.cancel()
+            self.process.stdout.close()
+            self.exit_code = wait_process(self.process, span)
+            with Command._lock:
+                Command._active.pop(self.process.pid, None)
+
+    def run(self, capture=True, on_line=None, tail_lines=100, span=None):
+        """
+        Runs the command to completion
+        :param capture: Collect and return the output. When False, the output is streamed to stdout instead
+        :type capture: bool
+        :param on_line: Function to call with every line of the output
+        :param tail_lines: Amount of trailing lines to keep for the error message
+        :type tail_lines: int
+        :param span: Trace span to record the resource usage of the command on
+        :type span: dict
+        :return: The output when capturing, None otherwise
+        :rtype: str
+        """
+        output = [] if capture is True else None
+        tail = deque(maxlen=tail_lines)
+        for line in self.lines(span=span):
+            tail.append(line)
+            if capture is True:
+                output.append(line)
+            else:
+                sys.stdout.write(line)
+            if on_line is not None:
+                on_line(line)
+        if capture is False:
+            sys.stdout.flush()
+        if self.exit_code != 0 or self.timed_out is True:
+            raise CommandError(command=self.command, exit_code=self.exit_code, output_tail=list(tail), timed_out=self.timed_out)
+        return ''.join(output) if capture is True else None
+
+    @staticmethod
+    def _reset_after_fork(_):
+        # Forked while another thread held the lock or ran commands: those belong to the parent
+        Command._lock = threading.Lock()
+        Command._active = {}
+
+    @staticmethod
+    def kill_all():
+        """
+        Kills all commands which are running in this process (eg: when the process gets terminated)
+        :return: None
+        :rtype: NoneType
+        """
+        with Command._lock:
+            commands = Command._active.values()
+        for command in commands:
+            command._kill()
+
+
+register_after_fork(Command, Command._reset_after_fork)
+
+
+def execute(command, working_directory, env=None, timeout=None, retries=0, backoff=2.0, retry_on=None,
+            capture=True, on_line=None, tail_lines=100):
+    """
+    Executes a command, retrying it when it fails
+    Every attempt is traced as a command span. See tracing.Tracer
+    :param command: Shell command or argv list
+    :type command: str or list[str]
+    :param working_directory: Directory to run the command in
+    :type working_directory: str
+    :param env: Environment variables to set (or to remove, when their value is None)
+    :type env: dict
+    :param timeout: Seconds after which an attempt gets killed. None to wait forever
+    :type timeout: float
+    :param retries: Amount of times to retry a failed attempt
+    :type retries: int
+    :param backoff: Seconds to wait before the first retry. Doubles for every next retry
+    :type backoff: float
+    :param retry_on: Exit codes which are worth a retry (eg: 255 for ssh connection failures). None to retry on any failure
+    :type retry_on: list[int]
+    :param capture: Collect and return the output. When False, the output is streamed to stdout instead
+    :type capture: bool
+    :param on_line: Function to call with every line of the output
+    :param tail_lines: Amount of trailing lines to keep for the error message
+    :type tail_lines: int
+    :return: The output when capturing, None otherwise
+    :rtype: str
+    """
+    attempt = 0
+    while True:
+        with Tracer.span(name=Command.get_name(command), category='command', command=Command.format(command),
+                         cwd=working_directory, attempt=attempt) as span:
+            try:
+                return Command(command=command,
+                               working_directory=working_directory,
+                               env=env,
+                               timeout=timeout,
+                               merge_stderr=capture is False).run(capture=capture, on_line=on_line, tail_lines=tail_lines, span=span)
+            except CommandError as ex:
+                span['args']['timed_out'] = ex.timed_out
+                retryable = ex.timed_out is True or retry_on is None or ex.exit_code in retry_on
+                if attempt >= retries or retryable is False:
+                    raise
+        delay = backoff * 2 ** attempt
+        attempt += 1
+        print 'Debug - Command {0} failed, retrying in {1:.1f}s (retry {2}/{3})'.format(Command.format(command), delay, attempt, retries)
+        time.sleep(delay)
@@ -0,0 +1,202 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Helpers module
+"""
+import os
+import sys
+import errno
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+FICLONE = 0x40049409  # ioctl to create a copy-on-write clone of a file (btrfs, xfs, ...)
+_reflink_unsupported = set()  # (Source, destination) devices for which reflinks failed before
+
+
+@contextmanager
+def redirect_output(log_path):
+    """
+    Redirects stdout and stderr (of this process and of all spawned child processes) to the given log file
+    The file descriptors are duplicated so the output of shelled out commands ends up in the log too
+    :param log_path: Path of the log file to write to
+    :type log_path: str
+    """
+    log_directory = os.path.dirname(log_path)
+    try:
+        os.makedirs(log_directory)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout = os.dup(1)
+    saved_stderr = os.dup(2)
+    with open(log_path, 'a', 0) as log_file:
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+        try:
+            yield log_file
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_stdout, 1)
+            os.dup2(saved_stderr, 2)
+            os.close(saved_stdout)
+            os.close(saved_stderr)
+
+
+def format_duration(seconds):
+    """
+    Formats a duration in seconds to a human readable string
+    :param seconds: Duration in seconds
+    :type seconds: float
+    :return: Formatted duration (eg: 1m 12.3s)
+    :rtype: str
+    """
+    minutes, seconds = divmod(seconds, 60)
+    if minutes >= 1:
+        return '{0}m {1:.1f}s'.format(int(minutes), seconds)
+    return '{0:.1f}s'.format(seconds)
+
+
+def link_file(source, destination, stats=None, hardlink=True):
+    """
+    Makes a file available at another location as cheaply as possible:
+    * A reflink (copy-on-write clone) when the filesystem supports it
+    * A hardlink when source and destination are on the same filesystem (and hardlinks are allowed)
+    * A copy otherwise
+    Hardlinked files share their contents and metadata: they should be replaced instead of modified in place
+    :param source: Path of the file
+    :type source: str
+    :param destination: Path to make the file available at. Must not exist yet
+    :type destination: str
+    :param stats: Dict to count the 'linked' and 'copied' bytes and files in
+    :type stats: dict
+    :param hardlink: Allow a hardlink. Disallow it for files which get modified in place
+    :type hardlink: bool
+    :return: How the file was made available ('reflink', 'hardlink' or 'copy')
+    :rtype: str
+    """
+    source = os.path.realpath(source)
+    size = os.path.getsize(source)
+    devices = (os.stat(source).st_dev, os.stat(os.path.dirname(os.path.abspath(destination))).st_dev)
+    method = 'copy'
+    if devices not in _reflink_unsupported:
+        try:
+            with open(source, 'rb') as source_file:
+                with open(destination, 'wb') as destination_file:
+                    fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            shutil.copystat(source, destination)
+            method = 'reflink'
+        except (IOError, OSError):
+            _reflink_unsupported.add(devices)
+            if os.path.exists(destination):
+                os.remove(destination)
+    if method == 'copy' and hardlink is True:
+        try:
+            os.link(source, destination)
+            method = 'hardlink'
+        except OSError as ex:
+            if ex.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EACCES]:
+                raise
+            shutil.copy2(source, destination)
+    elif method == 'copy':
+        shutil.copy2(source, destination)
+    if stats is not None:
+        key = 'copied' if method == 'copy' else 'linked'
+        stats['{0}_bytes'.format(key)] = stats.get('{0}_bytes'.format(key), 0) + size
+        stats['{0}_files'.format(key)] = stats.get('{0}_files'.format(key), 0) + 1
+    return method
+
+
+def link_tree(source, destination, symlinks=False, stats=None, writable=None):
+    """
+    Makes a directory tree available at another location as cheaply as possible. See link_file
+    Unlike shutil.copytree, the destination directory may already exist
+    Files which get modified in place (listed in writable) are never hardlinked, so the modifications stay within the destination
+    :param source: Path of the directory
+    :type source: str
+    :param destination: Path to make the tree available at
+    :type destination: str
+    :param symlinks: Recreate symbolic links instead of linking the files they point to
+    :type symlinks: bool
+    :param stats: Dict to count the 'linked' and 'copied' bytes and files in
+    :type stats: dict
+    :param writable: Paths (relative to source) of the files and directories which get modified in place. True for the whole tree
+    :type writable: list[str] or bool
+    :return: The stats
+    :rtype: dict
+    """
+    if stats is None:
+        stats = {}
+    if writable is None:
+        writable = []
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+    for name in os.listdir(source):
+        source_path = os.path.join(source, name)
+        destination_path = os.path.join(destination, name)
+        if symlinks is True and os.path.islink(source_path):
+            if os.path.lexists(destination_path):
+                os.remove(destination_path)
+            os.symlink(os.readlink(source_path), destination_path)
+        elif os.path.isdir(source_path):
+            if writable is True or name in writable:
+                sub_writable = True
+            else:
+                sub_writable = [path[len(name) + 1:] for path in writable if path.startswith('{0}/'.format(name))]
+            link_tree(source_path, destination_path, symlinks=symlinks, stats=stats, writable=sub_writable)
+        else:
+            if os.path.lexists(destination_path):
+                os.remove(destination_path)
+            link_file(source_path, destination_path, stats=stats, hardlink=writable is not True and name not in writable)
+    shutil.copystat(source, destination)
+    return stats
+
+
+def format_size(size):
+    """
+    Formats a size in bytes to a human readable string
+    :param size: Size in bytes
+    :type size: int
+    :return: Formatted size (eg: 12.3 MiB)
+    :rtype: str
+    """
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(size) < 1024:
+            return '{0:.1f} {1}'.format(size, unit)
+        size /= 1024.0
+    return '{0:.1f} TiB'.format(size)
+
+
+def hash_file(path, algorithm='sha256'):
+    """
+    Computes the digest of the contents of a file
+    :param path: Path of the file
+    :type path: str
+    :param algorithm: Hash algorithm to use. See hashlib
+    :type algorithm: str
+    :return: Hexadecimal digest
+    :rtype: str
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
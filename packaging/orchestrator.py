@@ -0,0 +1,370 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Orchestrator module
+"""
+import os
+import time
+import signal
+import traceback
+from Queue import Empty
+from multiprocessing import Process, Queue, cpu_count
+from packaging.execution import Command
+from packaging.helpers import format_duration, redirect_output
+from packaging.tracing import Tracer
+from packaging.transport import Transport
+
+
+def _run_isolated(key, function, log_path, result_queue):
+    """
+    Runs a function within its own process. All output is redirected to the given log file
+    :param key: Identifier of the job
+    :param function: Function to run. Receives no arguments
+    :param log_path: Path to the log file for this job
+    :param result_queue: Queue to report the result on
+    :return: None
+    :rtype: NoneType
+    """
+    # Own process group so cancelling also stops the spawned build tools
+    os.setpgrp()
+
+    def _terminate(signum, _):
+        # Commands run in process groups of their own. See execution.Command
+        Command.kill_all()
+        raise SystemExit(128 + signum)
+    signal.signal(signal.SIGTERM, _terminate)
+    Tracer.set_label(key)
+    start = time.time()
+    error = None
+    with redirect_output(log_path):
+        try:
+            with Tracer.span('job', key=key):
+                function()
+        except BaseException:
+            error = traceback.format_exc()
+            print error
+        finally:
+            Tracer.flush()
+    result_queue.put((key, error is None, time.time() - start, error))
+
+
+class ProcessGroup(object):
+    """
+    ProcessGroup class
+
+    Runs jobs in isolated processes, with at most 'workers' jobs at the same time
+    * Every job runs in its own process (and process group) and writes to its own log file
+    * The processes are not daemonic so the jobs can spawn processes of their own
+    * Failure policies:
+      - 'wait': let the other jobs finish when one fails
+      - 'cancel': stop the running jobs and skip the queued ones as soon as one fails
+    """
+
+    FAILURE_POLICIES = ['wait', 'cancel']
+    REPORT_TIMEOUT = 10  # Seconds to wait for the report of a job which exited cleanly
+
+    def __init__(self, workers=None, failure_policy='wait'):
+        """
+        Initializes a process group
+        :param workers: Maximum amount of jobs to run at the same time. Defaults to the amount of cores
+        :type workers: int
+        :param failure_policy: What to do with the other jobs when one of them fails
+        :type failure_policy: str
+        """
+        if failure_policy not in self.FAILURE_POLICIES:
+            raise ValueError('Failure policy "{0}" is not a valid option. Possible options are: {1}'.format(failure_policy, ', '.join(self.FAILURE_POLICIES)))
+        self.workers = workers or cpu_count()
+        self.failure_policy = failure_policy
+
+        self.jobs = []  # List of (key, function, log_path)
+        self.results = {}  # Key -> {'success': bool, 'duration': float, 'error': str, 'log': str}
+
+    def add(self, key, function, log_path):
+        """
+        Adds a job to the group
+        :param key: Unique identifier of the job
+        :type key: str
+        :param function: Function to run. Receives no arguments
+        :param log_path: Path to the log file of the job
+        :type log_path: str
+        :return: None
+        :rtype: NoneType
+        """
+        if any(job[0] == key for job in self.jobs):
+            raise ValueError('A job with key {0} was already added'.format(key))
+        self.jobs.append((key, function, log_path))
+
+    def _set_result(self, key, success, duration, error, log_path):
+        self.results[key] = {'success': success,
+                             'duration': duration,
+                             'error': error,
+                             'log': log_path}
+        print '  {0} {1}{2}'.format(key, 'succeeded' if success is True else 'FAILED',
+                                    '' if duration is None else ' after {0}'.format(format_duration(duration)))
+
+    @staticmethod
+    def _stop(process, grace_period=10):
+        # Terminates the process group of a job, killing it when it does not stop in time
+        for sig in [signal.SIGTERM, signal.SIGKILL]:
+            try:
+                os.killpg(process.pid, sig)
+            except OSError:
+                pass  # Already gone
+            process.join(grace_period)
+            if not process.is_alive():
+                return
+
+    def run(self, on_result=None):
+        """
+        Runs all jobs
+        When leaving early (eg: when this process gets terminated because it is a job of another group itself), the
+        running jobs are stopped. They are not daemonic, so they would otherwise be waited for when this process exits
+        :param on_result: Function to call as soon as a job finished. Receives the key and the result of the job
+        :return: The results per job
+        :rtype: dict
+        """
+        result_queue = Queue()
+        queued = list(self.jobs)
+        running = {}  # Key -> (process, log_path)
+        exited = {}  # Key -> time at which the process was found exited before it reported
+        state = {'cancelled': False}
+
+        def _handle_report(report):
+            key, success, duration, error = report
+            if key not in running:
+                return  # Late report of a cancelled job
+            process, log_path = running.pop(key)
+            exited.pop(key, None)
+            process.join()
+            if key not in self.results:
+                self._set_result(key, success, duration, error, log_path)
+                if on_result is not None:
+                    on_result(key, self.results[key])
+            if success is False and self.failure_policy == 'cancel' and state['cancelled'] is False:
+                state['cancelled'] = True
+                for other_key, (other_process, other_log_path) in running.items():
+                    print '  Cancelling {0}'.format(other_key)
+                    self._stop(other_process)
+                    running.pop(other_key)
+                    self._set_result(other_key, False, None, 'Cancelled', other_log_path)
+
+        try:
+            while len(queued) > 0 or len(running) > 0:
+                while state['cancelled'] is False and len(queued) > 0 and len(running) < self.workers:
+                    key, function, log_path = queued.pop(0)
+                    print '  Starting {0} (log: {1})'.format(key, log_path)
+                    process = Process(target=_run_isolated, args=(key, function, log_path, result_queue))
+                    process.start()
+                    running[key] = (process, log_path)
+                if state['cancelled'] is True:
+                    for key, _, log_path in queued:
+                        self._set_result(key, False, None, 'Cancelled', log_path)
+                    queued = []
+                try:
+                    _handle_report(result_queue.get(timeout=1))
+                    continue
+                except Empty:
+                    pass
+                # Detect processes which died without reporting (eg: killed by the OOM killer)
+                dead_keys = [key for key, (process, _) in running.iteritems() if not process.is_alive()]
+                if len(dead_keys) == 0:
+                    continue
+                # A job which reported right before it exited has its report in the queue by now
+                while True:
+                    try:
+                        _handle_report(result_queue.get_nowait())
+                    except Empty:
+                        break
+                for key in dead_keys:
+                    if key not in running:
+                        continue  # Reported after all
+                    process = running[key][0]
+                    if process.exitcode == 0 and time.time() - exited.setdefault(key, time.time()) < self.REPORT_TIMEOUT:
+                        continue  # A job which exits cleanly has reported: wait for the report to arrive
+                    _handle_report((key, False, None, 'Process exited with code {0} without reporting a result'.format(process.exitcode)))
+        finally:
+            for key, (process, _) in running.items():
+                self._stop(process)
+        return self.results
+
+
+class PackagerOrchestrator(object):
+    """
+    PackagerOrchestrator class
+
+    Responsible for running the packagers of the same source archive concurrently
+    * Every packager runs in its own process and writes to its own log file
+    * The failure policy determines whether the other packagers are cancelled or waited for when one fails
+    """
+
+    def __init__(self, packagers, failure_policy='wait'):
+        """
+        Initializes a packager orchestrator
+        :param packagers: Packagers to run. Every packager must target a different distro
+        :type packagers: list[packaging.packagers.packager.Packager]
+        :param failure_policy: What to do with the other packagers when one of them fails ('wait' or 'cancel')
+        :type failure_policy: str
+        """
+        if len(set(packager.distro for packager in packagers)) != len(packagers):
+            raise ValueError('Every packager should target a different distro')
+        self.packagers = packagers
+        self.process_group = ProcessGroup(workers=len(packagers), failure_policy=failure_policy)
+
+        self.results = {}  # Distro -> {'success': bool, 'duration': float, 'error': str, 'log': str}
+
+    @staticmethod
+    def get_log_path(packager):
+        """
+        Retrieves the path of the log file for the given packager
+        :param packager: Packager instance
+        :return: Path to the log file
+        :rtype: str
+        """
+        return os.path.join(packager.source_collector.path_package, '{0}.log'.format(packager.distro))
+
+    def run(self, upload_kwargs=None, pipeline=False):
+        """
+        Packages (and uploads) with all packagers concurrently
+        :param upload_kwargs: Keyword arguments to pass to the upload of every packager. None when no upload should happen
+        :type upload_kwargs: dict
+        :param pipeline: Upload every package as soon as it is built. See Packager.package_and_upload
+        :type pipeline: bool
+        :return: The results per distro
+        :rtype: dict
+        """
+        def _build(_packager):
+            def _function():
+                if pipeline is True and upload_kwargs is not None:
+                    try:
+                        with Tracer.span('package and upload', distro=_packager.distro):
+                            _packager.package_and_upload(**upload_kwargs)
+                    finally:
+                        Transport.close_all()
+                    return
+                with Tracer.span('package', distro=_packager.distro):
+                    _packager.package()
+                if upload_kwargs is not None:
+                    try:
+                        with Tracer.span('upload', distro=_packager.distro):
+                            _packager.upload(**upload_kwargs)
+                    finally:
+                        Transport.close_all()
+            return _function
+
+        print 'Running the {0} packagers concurrently'.format(', '.join(packager.distro for packager in self.packagers))
+        for packager in self.packagers:
+            self.process_group.add(key=packager.distro, function=_build(packager), log_path=self.get_log_path(packager))
+        self.results = self.process_group.run()
+        return self.results
+
+    def raise_for_failures(self):
+        """
+        Raises when any of the packagers failed
+        :return: None
+        :rtype: NoneType
+        """
+        failed = sorted(distro for distro, result in self.results.iteritems() if result['success'] is False)
+        if len(failed) > 0:
+            raise RuntimeError('Packaging failed for: {0}. See {1}'.format(', '.join(failed), ', '.join(self.results[distro]['log'] for distro in failed)))
+
+
+class ProductOrchestrator(object):
+    """
+    ProductOrchestrator class
+
+    Responsible for building multiple products on a bounded amount of worker processes
+    * Every product is built within its own process, so failures of one product do not affect the others
+    * The output of every product is written to its own log file
+    """
+
+    def __init__(self, products, build_function, workers=None, log_directory=None):
+        """
+        Initializes a product orchestrator
+        :param products: Names of the products to build
+        :type products: list[str]
+        :param build_function: Function which builds a single product. Receives the product name as argument
+        :param workers: Maximum amount of products to build at the same time. Defaults to the amount of cores
+        :type workers: int
+        :param log_directory: Directory to write the product logs to. Defaults to the working directory of the product
+        :type log_directory: str
+        """
+        if len(products) == 0:
+            raise ValueError('At least one product should be given')
+        self.products = products
+        self.build_function = build_function
+        self.log_directory = log_directory
+        self.process_group = ProcessGroup(workers=min(len(products), workers or cpu_count()))
+
+        self.results = {}  # Product name -> {'success': bool, 'duration': float, 'error': str, 'log': str}
+        self.duration = None
+
+    def get_log_path(self, product):
+        """
+        Retrieves the path of the log file for the given product
+        :param product: Name of the product
+        :type product: str
+        :return: Path to the log file
+        :rtype: str
+        """
+        if self.log_directory is not None:
+            return os.path.join(self.log_directory, '{0}.log'.format(product))
+        from packaging.sourcecollector import SourceCollector
+        return os.path.join(SourceCollector.get_settings()['base_path'].format(product), 'build.log')
+
+    def run(self):
+        """
+        Builds all products
+        :return: The results per product
+        :rtype: dict
+        """
+        def _build(_product):
+            return lambda: self.build_function(_product)
+
+        print 'Building {0} product(s) using {1} worker(s)'.format(len(self.products), self.process_group.workers)
+        start = time.time()
+        for product in self.products:
+            self.process_group.add(key=product, function=_build(product), log_path=self.get_log_path(product))
+        self.results = self.process_group.run()
+        self.duration = time.time() - start
+        return self.results
+
+    @property
+    def exit_code(self):
+        """
+        Combined exit status of all builds
+        :return: 0 when all products were built successfully, 1 otherwise
+        :rtype: int
+        """
+        if len(self.results) == 0:
+            raise RuntimeError('The products have not yet been built')
+        return 0 if all(result['success'] is True for result in self.results.itervalues()) else 1
+
+    def print_summary(self):
+        """
+        Prints the wall time and status of every product
+        :return: None
+        :rtype: NoneType
+        """
+        print 'Build summary'
+        for product in sorted(self.results, key=lambda p: self.results[p]['duration'], reverse=True):
+            result = self.results[product]
+            duration = 'n/a' if result['duration'] is None else format_duration(result['duration'])
+            print '  {0:<40} {1:<8} {2:>10}  {3}'.format(product, 'OK' if result['success'] is True else 'FAILED', duration, result['log'])
+        print '  Total wall time: {0}'.format(format_duration(self.duration))
+        failed = sorted(product for product, result in self.results.iteritems() if result['success'] is False)
+        if len(failed) > 0:
+            print '  Failed products: {0}'.format(', '.join(failed))
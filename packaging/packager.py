@@ -18,16 +18,106 @@
 Packager module
 """
 
+import os
+import sys
+from functools import partial
 from optparse import OptionParser
 from sourcecollector import SourceCollector
+from packaging.orchestrator import PackagerOrchestrator, ProcessGroup, ProductOrchestrator
 from packaging.packagers.debian import DebianPackager
 from packaging.packagers.redhat import RPMPackager
 from packaging.packagers.pip import PIPDebianPackager
+from packaging.tracing import Tracer
+from packaging.transport import Transport
+
+
+def build_product(product, options):
+    """
+    Collects the sources of a product, then packages and uploads it
+    :param product: Name of the product to build
+    :type product: str
+    :param options: Parsed command line options
+    :return: None
+    :rtype: NoneType
+    """
+    try:
+        _build_product(product, options)
+    finally:
+        Transport.close_all()
+
+
+def _build_product(product, options):
+    """
+    Builds the given product. See build_product
+    """
+    # 1. Collect sources
+    source_collector = SourceCollector(product=product,
+                                       release=options.release,
+                                       revision=options.revision,
+                                       artifact_only=options.artifact_only,
+                                       dry_run=options.dry_run,
+                                       is_pip=options.is_pip,
+                                       py2deb_path=options.py2deb_path)
+    settings = source_collector.settings
+    # Products which are built at the same time do not share their artifact folder
+    isolate_artifacts = options.products is not None or options.all_products is True
+    with Tracer.span('collect', product=product):
+        metadata = source_collector.collect()
+    print 'Package metadata: {0}'.format(metadata)
+
+    if metadata is not None:
+        add_package = options.release != 'hotfix'
+        # 2. Build & Upload packages
+        packagers = []
+        if options.is_pip is True and product in settings['pip']['modules']:
+            packagers.append(PIPDebianPackager(source_collector=source_collector, dry_run=options.dry_run, isolate_artifacts=isolate_artifacts))
+        elif any(option is True for option in [options.deb, options.rpm]):
+            if options.deb is True and 'deb' not in settings['repositories']['exclude_builds'].get(product, []):
+                packagers.append(DebianPackager(source_collector=source_collector, dry_run=options.dry_run, isolate_artifacts=isolate_artifacts))
+            if options.rpm is True and 'rpm' not in settings['repositories']['exclude_builds'].get(product, []):
+                packagers.append(RPMPackager(source_collector=source_collector, dry_run=options.dry_run, isolate_artifacts=isolate_artifacts))
+        upload_kwargs = None if options.no_upload is True else {'add': add_package, 'hotfix_release': options.hotfix_release}
+        if options.parallel_distros is True and len(packagers) > 1:
+            # Clean artifacts from an older folder
+            packagers[0].clean_artifact_folder(distros=[packager.distro for packager in packagers])
+            orchestrator = PackagerOrchestrator(packagers=packagers, failure_policy=options.failure_policy)
+            try:
+                orchestrator.run(upload_kwargs=upload_kwargs, pipeline=options.pipeline)
+            finally:
+                # Always store artifacts in jenkins too
+                for packager in packagers:
+                    if os.path.exists(packager.package_folder):
+                        with Tracer.span('artifact', distro=packager.distro):
+                            packager.prepare_artifact()
+            orchestrator.raise_for_failures()
+        else:
+            for index, packager in enumerate(packagers):
+                if index == 0:
+                    # Clean artifacts from an older folder
+                    packager.clean_artifact_folder(distros=[_packager.distro for _packager in packagers])
+                try:
+                    if options.pipeline is True and upload_kwargs is not None:
+                        with Tracer.span('package and upload', distro=packager.distro):
+                            packager.package_and_upload(**upload_kwargs)
+                    else:
+                        with Tracer.span('package', distro=packager.distro):
+                            packager.package()
+                        if upload_kwargs is not None:
+                            with Tracer.span('upload', distro=packager.distro):
+                                packager.upload(**upload_kwargs)
+                finally:
+                    # Always store artifacts in jenkins too
+                    with Tracer.span('artifact', distro=packager.distro):
+                        packager.prepare_artifact()
 
 
 if __name__ == '__main__':
     parser = OptionParser(description='Open vStorage packager')
     parser.add_option('-p', '--product', dest='product')
+    parser.add_option('-P', '--products', dest='products', default=None, help='Comma separated list of products to build in parallel')
+    parser.add_option('--all-products', dest='all_products', action='store_true', default=False, help='Build all known products in parallel')
+    parser.add_option('-w', '--workers', dest='workers', type='int', default=None, help='Maximum amount of products to build at the same time')
+    parser.add_option('--log-directory', dest='log_directory', default=None, help='Directory to store the product logs in when building multiple products')
     parser.add_option('-r', '--release', dest='release', default=None)
     parser.add_option('-e', '--revision', dest='revision', default=None)
     parser.add_option('-o', '--hotfix-release', dest='hotfix_release', default=None)
@@ -37,45 +127,42 @@ if __name__ == '__main__':
     parser.add_option('--no-rpm', dest='rpm', action='store_false', default=True)
     parser.add_option('--no-deb', dest='deb', action='store_false', default=True)
     parser.add_option('--pip', dest='is_pip', action='store_true', default=False)
+    parser.add_option('--parallel-distros', dest='parallel_distros', action='store_true', default=False, help='Build and upload the distro packages concurrently')
+    parser.add_option('--failure-policy', dest='failure_policy', choices=ProcessGroup.FAILURE_POLICIES, default='wait',
+                      help='What to do with the other distro packagers when one fails when building concurrently: wait or cancel')
     # Currently used as a workarond. The jenkins user does not have py2deb as a command wheras root does
     parser.add_option('--py2deb-path', dest='py2deb_path', default='py2deb')
+    parser.add_option('--pipeline', dest='pipeline', action='store_true', default=False, help='Upload every package as soon as it is built, while the others are still building')
+    parser.add_option('--trace', dest='trace', default=None, help='Trace the phases of the build and write them as Chrome trace JSON to the given path')
     options, args = parser.parse_args()
 
     print 'Received arguments: {0}'.format(options)
-    # 1. Collect sources
-    source_collector = SourceCollector(product=options.product,
-                                       release=options.release,
-                                       revision=options.revision,
-                                       artifact_only=options.artifact_only,
-                                       dry_run=options.dry_run,
-                                       is_pip=options.is_pip,
-                                       py2deb_path=options.py2deb_path)
     # Setting it to artifact only also means no uploading
     if options.artifact_only is True:
         options.no_upload = True
-    settings = source_collector.settings
-    metadata = source_collector.collect()
-    print 'Package metadata: {0}'.format(metadata)
 
-    if metadata is not None:
-        add_package = options.release != 'hotfix'
-        # 2. Build & Upload packages
-        packagers = []
-        if options.is_pip is True and options.product in settings['pip']['modules']:
-            packagers.append(PIPDebianPackager(source_collector=source_collector, dry_run=options.dry_run))
-        elif any(option is True for option in [options.deb, options.rpm]):
-            if options.deb is True and 'deb' not in settings['repositories']['exclude_builds'].get(options.product, []):
-                packagers.append(DebianPackager(source_collector=source_collector, dry_run=options.dry_run))
-            if options.rpm is True and 'rpm' not in settings['repositories']['exclude_builds'].get(options.product, []):
-                packagers.append(RPMPackager(source_collector=source_collector, dry_run=options.dry_run))
-        for index, packager in enumerate(packagers):
-            if index == 0:
-                # Clean artifacts from an older folder
-                packager.clean_artifact_folder()
-            packager.package()
-            try:
-                if options.no_upload is False:
-                    packager.upload(add=add_package, hotfix_release=options.hotfix_release)
-            finally:
-                # Always store artifacts in jenkins too
-                packager.prepare_artifact()
+    if options.all_products is True:
+        settings = SourceCollector.get_settings()
+        products = sorted(settings['pip']['modules'] if options.is_pip is True else settings['repositories']['code'])
+    elif options.products is not None:
+        products = [product.strip() for product in options.products.split(',') if product.strip() != '']
+    else:
+        products = None
+
+    if products is not None and options.product is not None:
+        parser.error('The product option cannot be combined with the products or all-products options')
+    if options.trace is not None:
+        Tracer.enable()
+    try:
+        if products is None:
+            build_product(options.product, options)
+        else:
+            orchestrator = ProductOrchestrator(products=products,
+                                               build_function=partial(build_product, options=options),
+                                               workers=options.workers,
+                                               log_directory=options.log_directory)
+            orchestrator.run()
+            orchestrator.print_summary()
+            sys.exit(orchestrator.exit_code)
+    finally:
+        Tracer.finish(path=options.trace)
@@ -19,6 +19,7 @@ Debian packager module
 """
 import os
 import shutil
+from packaging.helpers import link_file
 from packaging.packagers.packager import Packager
 from packaging.sourcecollector import SourceCollector
 
@@ -30,15 +31,16 @@ class DebianPackager(Packager):
     Responsible for creating debian packages from the source archive
     """
 
-    def __init__(self, source_collector, dry_run=False):
+    def __init__(self, source_collector, dry_run=False, isolate_artifacts=False):
         """
         Creates an instance of a DebianPacker
         This instance is tied to a SourceCollector instance which holds all product information
         :param source_collector: SourceCollector instance
         :param dry_run: Run the source collector in dry run mode
         * This will not do any impacting changes (like uploading/tagging)
+        :param isolate_artifacts: Export the artifacts to a folder of the product. See Packager
         """
-        super(DebianPackager, self).__init__(source_collector, dry_run, distro='debian', package_suffix='.deb')
+        super(DebianPackager, self).__init__(source_collector, dry_run, distro='debian', package_suffix='.deb', isolate_artifacts=isolate_artifacts)
 
     def package(self):
         """
@@ -53,6 +55,9 @@ class DebianPackager(Packager):
         if any(item is None for item in [product, release_repo, version_string, revision_date, package_name]):
             raise RuntimeError('The given source collector has not yet collected all of the required information')
 
+        if self.restore_from_cache() is True:
+            return
+
         path_code = self.source_collector.path_code
         path_package = self.source_collector.path_package
 
@@ -65,11 +70,11 @@ class DebianPackager(Packager):
 
         # Rename tgz
         # /<pp>/<package name>_1.2.3.tar.gz -> /<pp>/debian/<package name>_1.2.3.orig.tar.gz
-        shutil.copyfile('{0}/{1}_{2}.tar.gz'.format(path_package, package_name, version_string),
-                        '{0}/{1}_{2}.orig.tar.gz'.format(self.package_folder, package_name, version_string))
+        link_file('{0}/{1}_{2}.tar.gz'.format(path_package, package_name, version_string),
+                  '{0}/{1}_{2}.orig.tar.gz'.format(self.package_folder, package_name, version_string))
         # /<pp>/debian/<package name>-1.2.3/...
-        SourceCollector.run(command='tar -xzf {0}_{1}.orig.tar.gz'.format(package_name, version_string),
-                            working_directory=self.package_folder)
+        # The changelog is rewritten and the metadata is edited with sed below
+        self.source_collector.stage_source(self.package_folder, writable=['debian'])
 
         # Move the debian package metadata into the extracted source
         # /<pp>/debian/debian -> /<pp>/debian/<package name>-1.2.3/
@@ -93,5 +98,7 @@ class DebianPackager(Packager):
 
         # Build the package
         SourceCollector.run(command='dpkg-buildpackage',
-                            working_directory='{0}/{1}-{2}'.format(self.package_folder, package_name, version_string))
+                            working_directory='{0}/{1}-{2}'.format(self.package_folder, package_name, version_string),
+                            capture=False)
+        self.store_in_cache()
         self.packaged = True
@@ -18,9 +18,22 @@
 Packager module
 """
 import os
-import stat
+import sys
+import glob
+import json
+import time
 import shutil
-from packaging.sourcecollector import SourceCollector
+import threading
+import traceback
+from pipes import quote
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from packaging.buildcache import BuildCache
+from packaging.helpers import format_duration, hash_file, link_file
+from packaging.pipeline import UploadPipeline
+from packaging.poolindex import PoolIndex
+from packaging.tracing import Tracer
+from packaging.transport import Transport
 
 
 class Packager(object):
@@ -31,13 +44,20 @@ class Packager(object):
     DISTRO_OPTIONS = ['redhat', 'debian']
     PACKAGE_SUFFIX_OPTIONS = ['.rpm', '.deb']
 
-    def __init__(self, source_collector, dry_run=False, distro='', package_suffix=''):
+    INCLUDE_MARKER = '__fwk_include__'
+    ARTIFACT_MANIFEST_SUFFIX = '.manifest.json'
+    BUILD_MANIFEST_NAME = 'SHA256SUMS'
+
+    _print_lock = threading.Lock()
+
+    def __init__(self, source_collector, dry_run=False, distro='', package_suffix='', isolate_artifacts=False):
         """
         Creates an instance of a DebianPacker
         This instance is tied to a SourceCollector instance which holds all product information
         :param source_collector: SourceCollector instance
         :param dry_run: Run the source collector in dry run mode
         :param distro: Distro to package for. Can be 'debian' or 'redhat'
+        :param isolate_artifacts: Export the artifacts to a folder of the product (eg: when building multiple products at the same time)
         * This will not do any impacting changes (like uploading/tagging)
         """
         if distro not in self.DISTRO_OPTIONS:
@@ -48,9 +68,14 @@ class Packager(object):
         self.package_suffix = package_suffix
         self.source_collector = source_collector
         self.dry_run = dry_run
+        self.isolate_artifacts = isolate_artifacts
 
         # Milestone
         self.packaged = False
+        self._cache_key = None
+        self._package_listener = None  # Function to call with every built package. See publish_built_packages
+        self._published_packages = set()
+        self._checksums = {}  # Package path -> (size, modification time, sha256)
         self.package_folder = os.path.join(self.source_collector.path_package, self.distro)
 
     def package(self):
@@ -59,63 +84,232 @@ class Packager(object):
         """
         raise NotImplementedError('Packaging logic has to be implemented. It must set self.packaged to True when finished')
 
-    @classmethod
-    def copytree(cls, src, dst, symlinks=False, ignore=None):
-        """
-        Work around the fact that shututil.copytree will raise when a directory already exists...
-        """
-        if not os.path.exists(dst):
-            os.makedirs(dst)
-            shutil.copystat(src, dst)
-        lst = os.listdir(src)
-        if ignore:
-            excl = ignore(src, lst)
-            lst = [x for x in lst if x not in excl]
-        for item in lst:
-            s = os.path.join(src, item)
-            d = os.path.join(dst, item)
-            if symlinks and os.path.islink(s):
-                if os.path.lexists(d):
-                    os.remove(d)
-                os.symlink(os.readlink(s), d)
-                try:
-                    st = os.lstat(s)
-                    mode = stat.S_IMODE(st.st_mode)
-                    os.lchmod(d, mode)
-                except:
-                    pass  # lchmod not available
-            elif os.path.isdir(s):
-                cls.copytree(s, d, symlinks, ignore)
-            else:
-                shutil.copy2(s, d)
+    def restore_from_cache(self):
+        """
+        Restores the packages from the build cache, when the same build was done before
+        :return: Whether the packages were restored
+        :rtype: bool
+        """
+        build_cache = BuildCache.from_settings(self.source_collector.settings)
+        if build_cache is None:
+            return False
+        self._cache_key = build_cache.compute_key(self.source_collector, self.distro)
+        if build_cache.restore(self._cache_key, self.package_folder) is False:
+            return False
+        self.packaged = True
+        return True
+
+    def store_in_cache(self):
+        """
+        Stores the built packages in the build cache
+        :return: None
+        :rtype: NoneType
+        """
+        build_cache = BuildCache.from_settings(self.source_collector.settings)
+        if build_cache is None:
+            return
+        if self._cache_key is None:
+            self._cache_key = build_cache.compute_key(self.source_collector, self.distro)
+        build_cache.store(self._cache_key, self.package_folder, self.package_suffix)
+
+    @staticmethod
+    def get_artifact_folder(product=None):
+        """
+        Retrieves the folder to store the artifacts for Jenkins in
+        :param product: Product to get the own folder of. None for the shared folder
+        :type product: str
+        :return: Path to the artifact folder
+        :rtype: str
+        """
+        artifact_folder = os.path.join(os.environ['WORKSPACE'], 'artifacts')
+        return artifact_folder if product is None else os.path.join(artifact_folder, product)
+
+    def _get_artifact_folder(self):
+        return self.get_artifact_folder(self.source_collector.product if self.isolate_artifacts is True else None)
+
+    @staticmethod
+    def _load_artifact_manifest(manifest_path):
+        if not os.path.exists(manifest_path):
+            return {}
+        try:
+            with open(manifest_path, 'r') as manifest_file:
+                return json.load(manifest_file)['files']
+        except (IOError, ValueError, KeyError):
+            return {}
+
+    def get_artifact_manifest_path(self, distro=None):
+        """
+        Retrieves the path of the manifest which tracks the exported artifacts of this product for a distro
+        :param distro: Distro to get the manifest of. Defaults to the distro of this packager
+        :type distro: str
+        :return: Path to the manifest
+        :rtype: str
+        """
+        return os.path.join(self._get_artifact_folder(), '{0}-{1}{2}'.format(self.source_collector.product, distro or self.distro, self.ARTIFACT_MANIFEST_SUFFIX))
 
     def prepare_artifact(self):
         """
         Prepares the current package to be stored as an artifact on Jenkins
+        The packages are linked into the artifact folder where possible (see link_file). Packages which are already
+        present with the same contents are skipped and packages exported by a previous run which are no longer built are removed.
+        What was exported is tracked in a manifest, with the checksums of the build manifest. See write_build_manifest
+        The new packages are added to the manifest before they are exported, so they are still tracked when the export gets interrupted
         :return: None
         :rtype: NoneType
         """
-        def files_to_ignore(dir, filenames):
-            return [filename for filename in filenames if not filename.endswith(self.package_suffix)]
-        # Get the current workspace directory
-        workspace_folder = os.environ['WORKSPACE']
-        artifact_folder = os.path.join(workspace_folder, 'artifacts')
-        self.copytree(self.package_folder, artifact_folder, ignore=files_to_ignore)
+        artifact_folder = self._get_artifact_folder()
+        if not os.path.exists(artifact_folder):
+            os.makedirs(artifact_folder)
+        manifest_path = self.get_artifact_manifest_path()
+        previous_files = self._load_artifact_manifest(manifest_path)
 
-    @staticmethod
-    def clean_artifact_folder():
+        files = self.write_build_manifest()
+        exporting_files = dict(previous_files)
+        exporting_files.update(files)
+        self._write_artifact_manifest(manifest_path, exporting_files)
+        stats = {}
+        unchanged = 0
+        for filename in sorted(files):
+            source_path = os.path.join(self.package_folder, filename)
+            destination_path = os.path.join(artifact_folder, filename)
+            present = False
+            if os.path.exists(destination_path):
+                if os.path.samefile(source_path, destination_path):
+                    present = True
+                elif os.path.getsize(destination_path) == files[filename]['size']:
+                    present = hash_file(destination_path) == files[filename]['sha256']
+            if present is True:
+                unchanged += 1
+            else:
+                if os.path.lexists(destination_path):
+                    os.remove(destination_path)
+                link_file(source_path, destination_path, stats=stats)
+
+        removed = 0
+        for filename in previous_files:
+            if filename not in files and os.path.exists(os.path.join(artifact_folder, filename)):
+                os.remove(os.path.join(artifact_folder, filename))
+                removed += 1
+
+        self._write_artifact_manifest(manifest_path, files)
+        print 'Exported {0} artifact(s) to {1}: {2} linked, {3} copied, {4} unchanged, {5} stale removed'.format(len(files), artifact_folder,
+                                                                                                             stats.get('linked_files', 0),
+                                                                                                             stats.get('copied_files', 0),
+                                                                                                             unchanged, removed)
+
+    def _write_artifact_manifest(self, manifest_path, files):
+        temp_path = '{0}.{1}'.format(manifest_path, os.getpid())
+        with open(temp_path, 'w') as manifest_file:
+            json.dump({'product': self.source_collector.product,
+                       'distro': self.distro,
+                       'version': self.source_collector.version_string,
+                       'files': files}, manifest_file, indent=4, sort_keys=True)
+        os.rename(temp_path, manifest_path)
+
+    def clean_artifact_folder(self, distros=None):
         """
         Cleans the artifact folder from the previous run
+        The artifacts of the given distros are kept, so prepare_artifact only has to export what changed
+        Only what this product exported is removed: the artifacts of the distros which are not being built (listed in their
+        manifest) and manifests which were left half-written. Files of other products are never touched
+        :param distros: Distros which are being built. Defaults to the distro of this packager
+        :type distros: list[str]
+        :return: None
+        :rtype: NoneType
+        """
+        artifact_folder = self._get_artifact_folder()
+        if not os.path.exists(artifact_folder):
+            return
+        if distros is None:
+            distros = [self.distro]
+        for distro in self.DISTRO_OPTIONS:
+            manifest_path = self.get_artifact_manifest_path(distro)
+            if distro not in distros:
+                # Exported by a previous run of this product for a distro which is not being built
+                for filename in self._load_artifact_manifest(manifest_path):
+                    path = os.path.join(artifact_folder, filename)
+                    if os.path.lexists(path):
+                        os.remove(path)
+                if os.path.exists(manifest_path):
+                    os.remove(manifest_path)
+            for temp_path in glob.glob('{0}.*'.format(manifest_path)):
+                os.remove(temp_path)  # Left behind by an interrupted run. See _write_artifact_manifest
+
+    def get_destinations(self):
         """
-        workspace_folder = os.environ['WORKSPACE']
-        artifact_folder = os.path.join(workspace_folder, 'artifacts')
-        # Clear older artifacts
-        if os.path.exists(artifact_folder):
-            shutil.rmtree(artifact_folder)
+        Retrieves the package destinations of this distro which accept the tags of the package
+        :return: The destinations to upload to
+        :rtype: list[dict]
+        """
+        package_tags = self.source_collector.package_tags
+        if package_tags is None:
+            raise RuntimeError('The given source collector has not yet collected all of the required information')
+        destinations = []
+        for destination in self.source_collector.settings['repositories']['packages'].get(self.distro, []):
+            tags = destination.get('tags', [])
+            if len(set(tags).intersection(package_tags)) == 0:
+                print 'Skipping {0} ({1}). {2} requested'.format(destination['ip'], tags, package_tags)
+                continue
+            destinations.append(destination)
+        return destinations
+
+    @staticmethod
+    def log(destination, message):
+        """
+        Prints a message about a destination. Safe to use from multiple threads
+        :param destination: Destination the message is about
+        :type destination: dict
+        :param message: Message to print
+        :type message: str
+        :return: None
+        :rtype: NoneType
+        """
+        with Packager._print_lock:
+            sys.stdout.write('[{0}@{1}] {2}\n'.format(destination['user'], destination['ip'], message))
+            sys.stdout.flush()
+
+    def for_each_destination(self, destinations, function):
+        """
+        Executes a function for all given destinations concurrently
+        The amount of destinations handled at the same time is capped by the 'parallelism' of the 'upload' settings
+        Every destination is always handled: a failing destination does not stop the others and what was done for the
+        successful destinations is kept. When any destination failed, an exception is raised afterwards
+        :param destinations: Destinations to handle
+        :type destinations: list[dict]
+        :param function: Function to execute. Receives the destination as argument
+        :return: The result of the function per destination
+        :rtype: list
+        """
+        if len(destinations) == 0:
+            return []
+
+        def _handle(_destination):
+            start = time.time()
+            try:
+                with Tracer.span('destination', destination='{0}@{1}'.format(_destination['user'], _destination['ip']), distro=self.distro):
+                    result = function(_destination)
+                self.log(_destination, 'Done after {0}'.format(format_duration(time.time() - start)))
+                return True, result
+            except Exception:
+                self.log(_destination, 'FAILED after {0}:\n{1}'.format(format_duration(time.time() - start), traceback.format_exc()))
+                return False, None
+
+        parallelism = self.source_collector.settings.get('upload', {}).get('parallelism', 4)
+        pool = ThreadPool(processes=max(1, min(parallelism, len(destinations))))
+        try:
+            outcomes = pool.map(_handle, destinations)
+        finally:
+            pool.close()
+            pool.join()
+        failed = ['{0}@{1}'.format(destination['user'], destination['ip']) for destination, (success, _) in zip(destinations, outcomes) if success is False]
+        if len(failed) > 0:
+            raise RuntimeError('Handling {0} out of {1} destinations failed: {2}'.format(len(failed), len(destinations), ', '.join(failed)))
+        return [result for _, result in outcomes]
 
     def upload(self, add, hotfix_release=None):
         """
         Uploads a given set of packages
+        The destinations are handled concurrently. See for_each_destination
         :param add: Should the package be added to the repository
         :param hotfix_release: Which release to hotfix for (Add should still be True when wanting to add it to the repository)
         """
@@ -127,54 +321,276 @@ class Packager(object):
         if any(item is None for item in [release_repo, package_tags]):
             raise RuntimeError('The given source collector has not yet collected all of the required information')
 
+        self.write_build_manifest()
+        self.for_each_destination(destinations=self.get_destinations(),
+                                  function=lambda destination: self._upload_to_destination(destination, add, hotfix_release))
+
+    def package_and_upload(self, add, hotfix_release=None):
+        """
+        Packages and uploads the related product, uploading every package as soon as it is built. See UploadPipeline
+        :param add: Should the package be added to the repository
+        :param hotfix_release: Which release to hotfix for (Add should still be True when wanting to add it to the repository)
+        :return: None
+        :rtype: NoneType
+        """
+        upload_settings = self.source_collector.settings.get('upload', {})
+        pipeline = UploadPipeline(packager=self,
+                                  destinations=self.get_destinations(),
+                                  add=add,
+                                  hotfix_release=hotfix_release,
+                                  queue_size=upload_settings.get('queue_size', 4),
+                                  parallelism=upload_settings.get('parallelism', 4))
+        pipeline.start()
+        self._package_listener = pipeline.submit
+        self._published_packages = set()
+        try:
+            self.package()
+            # Packagers which do not publish their packages while building publish them all at once
+            self.publish_built_packages()
+            self.write_build_manifest()
+        except BaseException:
+            pipeline.abort()
+            raise
+        finally:
+            self._package_listener = None
+        pipeline.finish()
+
+    def get_checksum(self, package_path):
+        """
+        Retrieves the SHA256 checksum of a built package. Checksums are only computed again when the package changed
+        Safe to use from multiple threads
+        :param package_path: Local path of the package
+        :type package_path: str
+        :return: Hexadecimal SHA256 digest
+        :rtype: str
+        """
+        package_stat = os.stat(package_path)
+        checksum = self._checksums.get(package_path)
+        if checksum is None or checksum[:2] != (package_stat.st_size, package_stat.st_mtime):
+            checksum = (package_stat.st_size, package_stat.st_mtime, hash_file(package_path))
+            self._checksums[package_path] = checksum
+        return checksum[2]
+
+    def write_build_manifest(self):
+        """
+        Computes the checksums of all built packages and writes them to the SHA256SUMS manifest in the package folder
+        The packages are hashed concurrently (hashing releases the GIL), on as many threads as there are cores
+        :return: The size and checksum per package filename ({'size': int, 'sha256': str})
+        :rtype: dict
+        """
+        filenames = sorted(filename for filename in os.listdir(self.package_folder) if filename.endswith(self.package_suffix))
+        package_paths = [os.path.join(self.package_folder, filename) for filename in filenames]
+        changed_paths = [package_path for package_path in package_paths
+                         if self._checksums.get(package_path, (None, None))[:2] != (os.path.getsize(package_path), os.path.getmtime(package_path))]
+        if len(changed_paths) > 1:  # Starting and joining a pool takes longer than hashing a single package
+            pool = ThreadPool(processes=min(cpu_count(), len(changed_paths)))
+            try:
+                pool.map(self.get_checksum, changed_paths)
+            finally:
+                pool.close()
+                pool.join()
+        checksums = [self.get_checksum(package_path) for package_path in package_paths]
+        manifest_path = os.path.join(self.package_folder, self.BUILD_MANIFEST_NAME)
+        temp_path = '{0}.{1}'.format(manifest_path, os.getpid())
+        with open(temp_path, 'w') as manifest_file:
+            for filename, checksum in zip(filenames, checksums):
+                manifest_file.write('{0}  {1}\n'.format(checksum, filename))  # The format of sha256sum
+        os.rename(temp_path, manifest_path)
+        print 'Wrote the checksums of {0} package(s) to {1}'.format(len(filenames), manifest_path)
+        return dict((filename, {'size': os.path.getsize(package_path), 'sha256': checksum})
+                    for filename, package_path, checksum in zip(filenames, package_paths, checksums))
+
+    def is_present_on_destination(self, destination, transport, package_path, remote_path, remote_size):
+        """
+        Checks whether a package with the same name on a destination has the same contents as the built package
+        The sizes are compared first, so the remote file is only hashed when they match
+        A package with the same name but other contents is reported loudly, as it would hide or be overwritten by the build
+        :param destination: Destination the remote package is on
+        :type destination: dict
+        :param transport: Transport of the destination
+        :type transport: packaging.transport.Transport
+        :param package_path: Local path of the built package
+        :type package_path: str
+        :param remote_path: Remote path of the package with the same name
+        :type remote_path: str
+        :param remote_size: Size of the remote package
+        :type remote_size: int
+        :return: True when the remote package is identical
+        :rtype: bool
+        """
+        local_size = os.path.getsize(package_path)
+        if remote_size != local_size:
+            difference = 'size {0} instead of {1}'.format(remote_size, local_size)
+        else:
+            # Hashing is read-only, so it also happens in a dry run: it shows what would actually be uploaded
+            remote_checksum = transport.run(command='sha256sum {0}'.format(quote(remote_path))).split()[0]
+            if remote_checksum == self.get_checksum(package_path):
+                return True
+            difference = 'sha256 {0} instead of {1}'.format(remote_checksum, self.get_checksum(package_path))
+        self.log(destination, '*** WARNING *** {0}: {1} has the same name but other contents ({2}). The new build is uploaded'.format(os.path.basename(package_path),
+                                                                                                                                    remote_path, difference))
+        return False
+
+    def publish_built_packages(self):
+        """
+        Passes the packages which were built since the previous call to the listener, when packaging and uploading at the same time
+        Packagers can call this while building, as soon as packages are complete
+        :return: None
+        :rtype: NoneType
+        """
+        if self._package_listener is None:
+            return
+        for filename in sorted(os.listdir(self.package_folder)):
+            if filename.endswith(self.package_suffix) and filename not in self._published_packages:
+                self._published_packages.add(filename)
+                self._package_listener(os.path.join(self.package_folder, filename))
+
+    def _upload_to_destination(self, destination, add, hotfix_release):
+        """
+        Uploads the packages to a single destination
+        :param destination: Destination to upload to
+        :type destination: dict
+        :param add: Should the package be added to the repository
+        :param hotfix_release: Which release to hotfix for
+        :return: None
+        :rtype: NoneType
+        """
+        context = self._prepare_destination(destination, hotfix_release)
+        staged_paths = []
+        for package in sorted(os.listdir(self.package_folder)):
+            if package.endswith(self.package_suffix):
+                staged_paths.append(self._stage_package(destination, context, os.path.join(self.package_folder, package)))
+        self._finalize_destination(destination, context, staged_paths, add, hotfix_release)
+
+    def _prepare_destination(self, destination, hotfix_release):
+        """
+        Prepares a destination to receive packages
+        :param destination: Destination to upload to
+        :type destination: dict
+        :param hotfix_release: Which release to hotfix for
+        :return: Context to stage and finalize the packages with
+        :rtype: dict
+        """
+        release_repo = self.source_collector.release_repo
         settings = self.source_collector.settings
+        base_path = destination['base_path']
+        pool_path = os.path.join(base_path, self.distro, 'pool/main')
 
-        package_info = settings['repositories']['packages'].get(self.distro, [])
-        for destination in package_info:
-            server = destination['ip']
-            tags = destination.get('tags', [])
-            if len(set(tags).intersection(package_tags)) == 0:
-                print 'Skipping {0} ({1}). {2} requested'.format(server, tags, package_tags)
-                continue
-            user = destination['user']
-            base_path = destination['base_path']
-            pool_path = os.path.join(base_path, self.distro, 'pool/main')
+        self.log(destination, 'Publishing')
+        if hotfix_release:
+            upload_path = os.path.join(base_path, hotfix_release)
+        else:
+            upload_path = os.path.join(base_path, release_repo)
+        self.log(destination, 'Upload path is: {0}'.format(upload_path))
+        self.log(destination, 'Creating the upload directory on the server')
+        transport = Transport.get(user=destination['user'], server=destination['ip'], settings=settings)
+        transport.run(command='mkdir -p {0}'.format(upload_path))
+        return {'transport': transport,
+                'upload_path': upload_path,
+                'pool_index': PoolIndex.get(transport=transport, pool_path=pool_path, settings=settings)}
 
-            print 'Publishing to {0}@{1}'.format(user, server)
-            print 'Determining upload path'
+    def _stage_package(self, destination, context, package_path):
+        """
+        Makes a single package available on a destination, without adding it to the repository
+        :param destination: Destination to upload to
+        :type destination: dict
+        :param context: Context of the destination. See _prepare_destination
+        :type context: dict
+        :param package_path: Local path of the package
+        :type package_path: str
+        :return: Remote path of the staged package
+        :rtype: str
+        """
+        transport = context['transport']
+        deb_package = os.path.basename(package_path)
+        destination_path = os.path.join(context['upload_path'], deb_package)
+        pool_package = context['pool_index'].lookup(deb_package)
+        if pool_package is not None and self.is_present_on_destination(destination=destination,
+                                                                       transport=transport,
+                                                                       package_path=package_path,
+                                                                       remote_path=pool_package['path'],
+                                                                       remote_size=pool_package['size']):
+            self.log(destination, '{0}: identical package already present on server, using that package'.format(deb_package))
+            transport.run(command='cp {0} {1}'.format(pool_package['path'], destination_path), print_only=self.dry_run)
+        else:
+            self.log(destination, '{0}: uploading package'.format(deb_package))
+            previous_package = context['pool_index'].find_previous_build(deb_package)
+            stats = transport.put(source=package_path, destination=destination_path, print_only=self.dry_run,
+                                  basis=None if previous_package is None else previous_package['path'])
+            if stats is not None:
+                self.log(destination, '{0}: {1}{2}'.format(deb_package, Transport.format_stats(stats),
+                                                           '' if previous_package is None else ' against {0}'.format(os.path.basename(previous_package['path']))))
+        return destination_path
+
+    def _finalize_destination(self, destination, context, staged_paths, add, hotfix_release):
+        """
+        Adds the staged packages to the repository of a destination
+        :param destination: Destination to upload to
+        :type destination: dict
+        :param context: Context of the destination. See _prepare_destination
+        :type context: dict
+        :param staged_paths: Remote paths of all staged packages, in the order to add them in
+        :type staged_paths: list[str]
+        :param add: Should the package be added to the repository
+        :param hotfix_release: Which release to hotfix for
+        :return: None
+        :rtype: NoneType
+        """
+        if add is True:
             if hotfix_release:
-                upload_path = os.path.join(base_path, hotfix_release)
+                include_release = hotfix_release
             else:
-                upload_path = os.path.join(base_path, release_repo)
-            print '    Upload path is: {0}'.format(upload_path)
-            deb_packages = [filename for filename in os.listdir(self.package_folder) if filename.endswith(self.package_suffix)]
-            print 'Creating the upload directory on the server'
-            SourceCollector.run(command="ssh {0}@{1} 'mkdir -p {2}'".format(user, server, upload_path),
-                                working_directory=self.package_folder)
-            for deb_package in deb_packages:
-                print '   {0}'.format(deb_package)
-                destination_path = os.path.join(upload_path, deb_package)
-                print '   Determining if the package is already present'
-                find_pool_package_command = "ssh {0}@{1} 'find {2}/ -name \"{3}\"'".format(user, server, pool_path, deb_package)
-                pool_package = SourceCollector.run(command=find_pool_package_command,
-                                                   working_directory=self.package_folder).strip()
-                if pool_package != '':
-                    print '    Already present on server, using that package'
-                    place_command = "ssh {0}@{1} 'cp {2} {3}'".format(user, server, pool_package, destination_path)
-                else:
-                    print '    Uploading package'
-                    source_path = os.path.join(self.package_folder, deb_package)
-                    place_command = "scp {0} {1}@{2}:{3}".format(source_path, user, server, destination_path)
-                SourceCollector.run(command=place_command, print_only=self.dry_run, working_directory=self.package_folder)
-                if add is True:
-                    print '    Adding package to repo'
-                    if hotfix_release:
-                        include_release = hotfix_release
-                    else:
-                        include_release = release_repo
-                    print '    Release to include: {0}'.format(include_release)
-                    remote_command = "ssh {0}@{1} 'reprepro -Vb {2}/debian includedeb {3} {4}'".format(user, server, base_path, include_release, destination_path)
-                    SourceCollector.run(command=remote_command, print_only=self.dry_run, working_directory=self.package_folder)
+                include_release = self.source_collector.release_repo
+            self.include_packages(destination=destination,
+                                  transport=context['transport'],
+                                  release=include_release,
+                                  package_paths=staged_paths)
+        else:
+            for staged_path in staged_paths:
+                self.log(destination, '{0}: NOT adding package to repo. Package can be found at: {1}'.format(os.path.basename(staged_path), staged_path))
+
+    def include_packages(self, destination, transport, release, package_paths):
+        """
+        Adds all staged packages to the repository of a destination in a single batch
+        Every package is included without exporting, after which the indices of the release are regenerated once
+        The packages are only available once the indices are exported: when the export fails, all packages of the batch failed
+        :param destination: Destination to include the packages on
+        :type destination: dict
+        :param transport: Transport of the destination
+        :type transport: packaging.transport.Transport
+        :param release: Release to include the packages in
+        :type release: str
+        :param package_paths: Remote paths of the staged packages
+        :type package_paths: list[str]
+        :return: The result per package path (True when included)
+        :rtype: dict
+        """
+        if len(package_paths) == 0:
+            return {}
+        repository_path = '{0}/debian'.format(destination['base_path'])
+        self.log(destination, 'Adding {0} package(s) to repo {1}'.format(len(package_paths), release))
+        command = ('for package in {0}; do '
+                   'if reprepro -Vb {1} --export=never includedeb {2} "$package"; then echo "{3} ok $package"; else echo "{3} failed $package"; fi; '
+                   'done; '
+                   'if reprepro -Vb {1} export {2}; then echo "{3} exported"; else echo "{3} export_failed"; fi').format(' '.join(quote(path) for path in package_paths), repository_path, release, self.INCLUDE_MARKER)
+        output = transport.run(command=command, print_only=self.dry_run)
+        if output is None:  # Dry run
+            return dict((path, True) for path in package_paths)
+        results = {}
+        exported = False
+        for line in output.splitlines():
+            if line.startswith(self.INCLUDE_MARKER):
+                parts = line.split(' ', 2)
+                if len(parts) == 2:
+                    exported = parts[1] == 'exported'
                 else:
-                    print '    NOT adding package to repo'
-                    print '    Package can be found at: {0}'.format(destination_path)
+                    results[parts[2]] = parts[1] == 'ok'
+        if exported is False:
+            self.log(destination, 'FAILED to export repo {0}'.format(release))
+            results = dict((path, False) for path in package_paths)
+        for path in package_paths:
+            self.log(destination, '{0}: {1} repo {2}'.format(os.path.basename(path), 'added to' if results.get(path) is True else 'FAILED to add to', release))
+        failed = [os.path.basename(path) for path in package_paths if results.get(path) is not True]
+        if len(failed) > 0:
+            raise RuntimeError('Adding {0} to repo {1} failed{2}'.format(', '.join(failed), release, '' if exported is True else ' (export failed)'))
+        return results
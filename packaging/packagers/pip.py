@@ -41,8 +41,8 @@ class PIPDebianPackager(DebianPackager):
     py2deb -r /tmp/py2deb typing  # Installs the typing package under /tmp/py2deb
     """
 
-    def __init__(self, source_collector, dry_run):
-        super(PIPDebianPackager, self).__init__(source_collector, dry_run)
+    def __init__(self, source_collector, dry_run, isolate_artifacts=False):
+        super(PIPDebianPackager, self).__init__(source_collector, dry_run, isolate_artifacts=isolate_artifacts)
 
     def package(self):
         """
@@ -65,5 +65,5 @@ class PIPDebianPackager(DebianPackager):
                 raise
 
         # Convert using the tool. This will generate a package called python-PRODUCT_VERSION.deb
-        SourceCollector.run('{0} -r {1} {2}'.format(self.source_collector.py2deb_path, self.package_folder, product), working_directory=self.package_folder)
+        SourceCollector.run('{0} -r {1} {2}'.format(self.source_collector.py2deb_path, self.package_folder, product), working_directory=self.package_folder, capture=False)
         self.packaged = True
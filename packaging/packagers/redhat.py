@@ -20,8 +20,12 @@ RPM packager module
 import os
 import shutil
 from ConfigParser import RawConfigParser
+from multiprocessing import cpu_count
+from packaging.helpers import format_size, link_file, link_tree
+from packaging.orchestrator import ProcessGroup
 from packaging.packagers.packager import Packager
 from packaging.sourcecollector import SourceCollector
+from packaging.transport import Transport
 
 
 class RPMPackager(Packager):
@@ -31,15 +35,16 @@ class RPMPackager(Packager):
     Responsible for creating rpm packages from the source archive
     """
 
-    def __init__(self, source_collector, dry_run=False):
+    def __init__(self, source_collector, dry_run=False, isolate_artifacts=False):
         """
         Creates an instance of a DebianPacker
         This instance is tied to a SourceCollector instance which holds all product information
         :param source_collector: SourceCollector instance
         :param dry_run: Run the source collector in dry run mode
         * This will not do any impacting changes (like uploading/tagging)
+        :param isolate_artifacts: Export the artifacts to a folder of the product. See Packager
         """
-        super(RPMPackager, self).__init__(source_collector, dry_run, distro='redhat', package_suffix='.rpm')
+        super(RPMPackager, self).__init__(source_collector, dry_run, distro='redhat', package_suffix='.rpm', isolate_artifacts=isolate_artifacts)
 
     def package(self):
         """
@@ -55,6 +60,9 @@ class RPMPackager(Packager):
         if any(item is None for item in [product, release_repo, version_string, revision_date, package_name, package_tags]):
             raise RuntimeError('The given source collector has not yet collected all of the required information')
 
+        if self.restore_from_cache() is True:
+            return
+
         path_code = self.source_collector.path_code
         path_package = self.source_collector.path_package
 
@@ -63,99 +71,154 @@ class RPMPackager(Packager):
             shutil.rmtree(self.package_folder)
         os.mkdir(self.package_folder)
 
-        # Extract tar.gz to redhat_folder
-        shutil.copyfile('{0}/{1}_{2}.tar.gz'.format(path_package, package_name, version_string),
-                        '{0}/{1}_{2}.orig.tar.gz'.format(self.package_folder, package_name, version_string))
-        # /<pp>/debian/<packagename>-1.2.3/...
-        SourceCollector.run(command='tar -xzf {0}_{1}.orig.tar.gz'.format(package_name, version_string),
-                            working_directory=self.package_folder)
-        code_source_path = '{0}/{1}-{2}'.format(self.package_folder, package_name, version_string)
+        # Stage the extracted sources
+        # /<pp>/redhat/<packagename>-1.2.3/...
+        # The install scripts get the version filled in with sed. See _build_package
+        code_source_path = self.source_collector.stage_source(self.package_folder, writable=['packaging/redhat/scripts'])
 
-        # copy packaging
+        # link packaging
         source_packaging_path = os.path.join(path_code, 'packaging')
         dest_packaging_path = os.path.join(code_source_path, 'packaging')
         if os.path.exists(source_packaging_path):
-            shutil.copytree(source_packaging_path, dest_packaging_path)
+            link_tree(source_packaging_path, dest_packaging_path, writable=['redhat/scripts'])
 
-        # load config
+        # Build the sub-packages concurrently. They only share the (read-only) staged sources
         config_dir = '{0}/packaging/redhat/cfgs'.format(path_code)
-        packages = os.listdir(config_dir)
-        for package in packages:
-            package_filename = '{0}/{1}'.format(config_dir, package)
-            package_cfg = RawConfigParser()
-            package_cfg.read(package_filename)
-
-            package_name = package_cfg.get('main', 'name')
-            dirs = package_cfg.get('main', 'dirs')
-            files = package_cfg.get('main', 'files')
-            depends_packages = package_cfg.get('main', 'depends').replace('$Version', version_string.replace('-', '_'))
-
-            depends = ""
-            if depends_packages != '':
-                depends = []
-                for depends_package in depends_packages.split(','):
-                    depends.append('-d "{0}"'.format(depends_package.strip()))
-                depends = ' '.join(depends)
-
-            package_root_path = os.path.join(path_package, package_name)
-            if os.path.exists(package_root_path):
-                shutil.rmtree(package_root_path)
-            os.mkdir(package_root_path)
-
-            for dir_ in dirs.split(','):
-                dir_ = dir_.strip()
-                if dir_ != "''":
-                    source_dir, dest_location = dir_.split('=')
-                    # source_dir = dir to copy - from repo root
-                    # dest_location = dir under which to copy the source_dir
-                    source_full_path = os.path.join(code_source_path, source_dir.strip())
-                    dest_full_path = os.path.join(package_root_path, dest_location.strip())
-                    shutil.copytree(source_full_path, dest_full_path)
-            for file_ in files.split(','):
-                file_ = file_.strip()
-                if file_ != "''" and file_ != '':
-                    source_file, dest_location = file_.split('=')
-                    source_full_path = os.path.join(code_source_path, source_file.strip())
-                    dest_full_path = os.path.join(package_root_path, dest_location.strip())
-
-                    if not os.path.exists(dest_full_path):
-                        os.makedirs(dest_full_path)
-                    shutil.copy(source_full_path, dest_full_path)
-            before_install, after_install = ' ', ' '
-            script_root = '{0}/packaging/redhat/scripts'.format(code_source_path)
-            before_install_script = '{0}.before-install.sh'.format(package_name)
-            before_install_script_path = os.path.join(script_root, before_install_script)
-            if os.path.exists(before_install_script_path):
-                before_install = ' --before-install {0} '.format(before_install_script_path)
-            after_install_script = '{0}.after-install.sh'.format(package_name)
-            after_install_script_path = os.path.join(script_root, after_install_script)
-            if os.path.exists(after_install_script_path):
-                after_install = ' --after-install {0} '.format(after_install_script_path)
-                SourceCollector.run(command="sed -i -e 's/$Version/{0}/g' {1}".format(version_string,
-                                                                                      after_install_script_path),
-                                    working_directory='{0}'.format(script_root))
-
-            params = {'version': version_string,
-                      'package_name': package_cfg.get('main', 'name'),
-                      'summary': package_cfg.get('main', 'summary'),
-                      'license': package_cfg.get('main', 'license'),
-                      'URL': package_cfg.get('main', 'URL'),
-                      'source': package_cfg.get('main', 'source'),
-                      'arch': package_cfg.get('main', 'arch'),
-                      'description': package_cfg.get('main', 'description'),
-                      'maintainer': package_cfg.get('main', 'maintainer'),
-                      'depends': depends,
-                      'package_root': package_root_path,
-                      'before_install': before_install,
-                      'after_install': after_install,
-            }
-
-            command = """fpm -s dir -t rpm -n {package_name} -v {version} --description "{description}" --maintainer "{maintainer}" --license "{license}" --url {URL} -a {arch} --vendor "Open vStorage" {depends}{before_install}{after_install} --prefix=/ -C {package_root}""".format(**params)
-
-            SourceCollector.run(command,
-                                working_directory=self.package_folder)
-            print(os.listdir(self.package_folder))
-            self.packaged = True
+        process_group = ProcessGroup(workers=min(len(os.listdir(config_dir)), cpu_count()) or 1, failure_policy='cancel')
+        for package_cfg_name in sorted(os.listdir(config_dir)):
+            process_group.add(key=package_cfg_name,
+                              function=self._get_build_function(package_cfg_path=os.path.join(config_dir, package_cfg_name),
+                                                                code_source_path=code_source_path),
+                              log_path=os.path.join(path_package, 'redhat-{0}.log'.format(os.path.splitext(package_cfg_name)[0])))
+        print 'Building {0} rpm package(s) using {1} worker(s)'.format(len(process_group.jobs), process_group.workers)
+        # Built packages are published as soon as their job finished. See publish_built_packages
+        results = process_group.run(on_result=lambda key, result: self.publish_built_packages() if result['success'] is True else None)
+        failed = sorted(key for key, result in results.iteritems() if result['success'] is False)
+        if len(failed) > 0:
+            raise RuntimeError('Building the rpm package(s) failed for: {0}. See {1}'.format(', '.join(failed), ', '.join(results[key]['log'] for key in failed)))
+        print 'Built rpm packages:'
+        for filename in sorted(os.listdir(self.package_folder)):
+            if filename.endswith(self.package_suffix):
+                print '  {0}'.format(filename)
+        self.packaged = True
+        self.store_in_cache()
+
+    def _get_build_function(self, package_cfg_path, code_source_path):
+        """
+        Retrieves the function which builds the rpm package described by a package config
+        :param package_cfg_path: Path to the package config
+        :type package_cfg_path: str
+        :param code_source_path: Path to the staged sources
+        :type code_source_path: str
+        :return: Function which builds the package. Receives no arguments
+        :rtype: function
+        """
+        return lambda: self._build_package(package_cfg_path=package_cfg_path, code_source_path=code_source_path)
+
+    def _build_package(self, package_cfg_path, code_source_path):
+        """
+        Stages the payload of a single rpm package and builds it using fpm
+        :param package_cfg_path: Path to the package config
+        :type package_cfg_path: str
+        :param code_source_path: Path to the staged sources
+        :type code_source_path: str
+        :return: None
+        :rtype: NoneType
+        """
+        version_string = self.source_collector.version_string
+        path_package = self.source_collector.path_package
+
+        package_cfg = RawConfigParser()
+        package_cfg.read(package_cfg_path)
+
+        package_name = package_cfg.get('main', 'name')
+        dirs = package_cfg.get('main', 'dirs')
+        files = package_cfg.get('main', 'files')
+        depends_packages = package_cfg.get('main', 'depends').replace('$Version', version_string.replace('-', '_'))
+
+        depends = ""
+        if depends_packages != '':
+            depends = []
+            for depends_package in depends_packages.split(','):
+                depends.append('-d "{0}"'.format(depends_package.strip()))
+            depends = ' '.join(depends)
+
+        package_root_path = os.path.join(path_package, package_name)
+        if os.path.exists(package_root_path):
+            shutil.rmtree(package_root_path)
+        os.mkdir(package_root_path)
+        # fpm writes into a folder of its own. The package is only moved into the package folder once it is complete
+        build_path = os.path.join(self.package_folder, '.build-{0}'.format(package_name))
+        if os.path.exists(build_path):
+            shutil.rmtree(build_path)
+        os.mkdir(build_path)
+
+        # The payload is linked instead of copied where possible. See link_file
+        payload_stats = {}
+        for dir_ in dirs.split(','):
+            dir_ = dir_.strip()
+            if dir_ != "''":
+                source_dir, dest_location = dir_.split('=')
+                # source_dir = dir to copy - from repo root
+                # dest_location = dir under which to copy the source_dir
+                source_full_path = os.path.join(code_source_path, source_dir.strip())
+                dest_full_path = os.path.join(package_root_path, dest_location.strip())
+                link_tree(source_full_path, dest_full_path, stats=payload_stats)
+        for file_ in files.split(','):
+            file_ = file_.strip()
+            if file_ != "''" and file_ != '':
+                source_file, dest_location = file_.split('=')
+                source_full_path = os.path.join(code_source_path, source_file.strip())
+                dest_full_path = os.path.join(package_root_path, dest_location.strip())
+
+                if not os.path.exists(dest_full_path):
+                    os.makedirs(dest_full_path)
+                dest_file_path = os.path.join(dest_full_path, os.path.basename(source_full_path))
+                if os.path.lexists(dest_file_path):
+                    os.remove(dest_file_path)
+                link_file(source_full_path, dest_file_path, stats=payload_stats)
+        print 'Payload of {0}: {1} in {2} file(s) linked, {3} in {4} file(s) copied'.format(package_name,
+                                                                                            format_size(payload_stats.get('linked_bytes', 0)),
+                                                                                            payload_stats.get('linked_files', 0),
+                                                                                            format_size(payload_stats.get('copied_bytes', 0)),
+                                                                                            payload_stats.get('copied_files', 0))
+        before_install, after_install = ' ', ' '
+        script_root = '{0}/packaging/redhat/scripts'.format(code_source_path)
+        before_install_script = '{0}.before-install.sh'.format(package_name)
+        before_install_script_path = os.path.join(script_root, before_install_script)
+        if os.path.exists(before_install_script_path):
+            before_install = ' --before-install {0} '.format(before_install_script_path)
+        after_install_script = '{0}.after-install.sh'.format(package_name)
+        after_install_script_path = os.path.join(script_root, after_install_script)
+        if os.path.exists(after_install_script_path):
+            after_install = ' --after-install {0} '.format(after_install_script_path)
+            SourceCollector.run(command="sed -i -e 's/$Version/{0}/g' {1}".format(version_string,
+                                                                                  after_install_script_path),
+                                working_directory='{0}'.format(script_root))
+
+        params = {'version': version_string,
+                  'package_name': package_cfg.get('main', 'name'),
+                  'summary': package_cfg.get('main', 'summary'),
+                  'license': package_cfg.get('main', 'license'),
+                  'URL': package_cfg.get('main', 'URL'),
+                  'source': package_cfg.get('main', 'source'),
+                  'arch': package_cfg.get('main', 'arch'),
+                  'description': package_cfg.get('main', 'description'),
+                  'maintainer': package_cfg.get('main', 'maintainer'),
+                  'depends': depends,
+                  'package_root': package_root_path,
+                  'before_install': before_install,
+                  'after_install': after_install,
+        }
+
+        command = """fpm -s dir -t rpm -n {package_name} -v {version} --description "{description}" --maintainer "{maintainer}" --license "{license}" --url {URL} -a {arch} --vendor "Open vStorage" {depends}{before_install}{after_install} --prefix=/ -C {package_root}""".format(**params)
+
+        SourceCollector.run(command,
+                            working_directory=build_path,
+                            capture=False)
+        for filename in os.listdir(build_path):
+            os.rename(os.path.join(build_path, filename), os.path.join(self.package_folder, filename))
+        os.rmdir(build_path)
 
     def upload(self, *args, **kwargs):
         """
@@ -176,33 +239,78 @@ class RPMPackager(Packager):
         if any(item is None for item in [product, release_repo, version_string, revision_date, package_name, package_tags]):
             raise RuntimeError('The given source collector has not yet collected all of the required information')
 
-        settings = self.source_collector.settings
-        package_info = settings['repositories']['packages'].get('redhat', [])
-        for destination in package_info:
-            server = destination['ip']
-            tags = destination.get('tags', [])
-            if len(set(tags).intersection(package_tags)) == 0:
-                print 'Skipping {0} ({1}). {2} requested'.format(server, tags, package_tags)
-                continue
-            user = destination['user']
-            base_path = destination['base_path']
-
-            packages = [p for p in os.listdir(self.package_folder) if p.endswith('.rpm')]
-            for package in packages:
-                package_source_path = os.path.join(self.package_folder, package)
-
-                command = 'scp {0} {1}@{2}:{3}/pool/{4}'.format(package_source_path, user, server, base_path, release_repo)
-                print('Uploading package {0}'.format(package))
-                SourceCollector.run(command=command,
-                                    working_directory=self.package_folder,
-                                    print_only=self.dry_run)
-            if len(packages) > 0:
-                # Cleanup existing files
-                command = 'ssh {0}@{1} {2}/cleanup_repo.py {2}/pool/{3}/'.format(user, server, base_path, release_repo)
-                print(SourceCollector.run(command=command,
-                                          working_directory=self.package_folder,
-                                          print_only=self.dry_run))
-                command = 'ssh {0}@{1} createrepo --update {2}/dists/{3}'.format(user, server, base_path, release_repo)
-                SourceCollector.run(command=command,
-                                    working_directory=self.package_folder,
-                                    print_only=self.dry_run)
+        self.write_build_manifest()
+        self.for_each_destination(destinations=self.get_destinations(),
+                                  function=self._upload_to_destination)
+
+    def _upload_to_destination(self, destination):
+        """
+        Uploads the packages to a single destination
+        :param destination: Destination to upload to
+        :type destination: dict
+        :return: None
+        :rtype: NoneType
+        """
+        context = self._prepare_destination(destination, None)
+        staged_paths = []
+        for package in sorted(os.listdir(self.package_folder)):
+            if package.endswith(self.package_suffix):
+                staged_paths.append(self._stage_package(destination, context, os.path.join(self.package_folder, package)))
+        self._finalize_destination(destination, context, staged_paths, True, None)
+
+    def _prepare_destination(self, destination, hotfix_release):
+        """
+        Prepares a destination to receive packages. The hotfix release is not used for rpm packages
+        """
+        _ = hotfix_release
+        transport = Transport.get(user=destination['user'], server=destination['ip'], settings=self.source_collector.settings)
+        upload_path = '{0}/pool/{1}'.format(destination['base_path'], self.source_collector.release_repo)
+        # The packages which are already present in the pool, to only upload the ones which differ
+        # Listing is read-only, so it also happens in a dry run (see is_present_on_destination)
+        transport.run(command='mkdir -p {0}'.format(upload_path), print_only=self.dry_run)
+        listing = transport.run(command="if [ -d {0} ]; then find {0}/ -maxdepth 1 -type f -printf '%f|%s\\n'; fi".format(upload_path))
+        present = {}
+        for line in listing.splitlines():
+            if line.strip() != '':
+                name, size = line.rsplit('|', 1)
+                present[name] = int(size)
+        return {'transport': transport,
+                'upload_path': upload_path,
+                'present': present}
+
+    def _stage_package(self, destination, context, package_path):
+        """
+        Uploads a single package to the pool of a destination
+        """
+        rpm_package = os.path.basename(package_path)
+        destination_path = os.path.join(context['upload_path'], rpm_package)
+        if rpm_package in context['present'] and self.is_present_on_destination(destination=destination,
+                                                                                transport=context['transport'],
+                                                                                package_path=package_path,
+                                                                                remote_path=destination_path,
+                                                                                remote_size=context['present'][rpm_package]):
+            self.log(destination, '{0}: identical package already present on server, skipping the upload'.format(rpm_package))
+            return destination_path
+        self.log(destination, 'Uploading package {0}'.format(rpm_package))
+        # Delta transfers find the previous build in the pool folder by its similar name
+        stats = context['transport'].put(source=package_path,
+                                         destination=destination_path,
+                                         print_only=self.dry_run)
+        if stats is not None:
+            self.log(destination, '{0}: {1}'.format(rpm_package, Transport.format_stats(stats)))
+        return destination_path
+
+    def _finalize_destination(self, destination, context, staged_paths, add, hotfix_release):
+        """
+        Regenerates the repository metadata of a destination. The packages are always added for rpm packages
+        """
+        _ = add, hotfix_release
+        base_path = destination['base_path']
+        release_repo = self.source_collector.release_repo
+        transport = context['transport']
+        if len(staged_paths) > 0:
+            # Cleanup existing files
+            self.log(destination, transport.run(command='{0}/cleanup_repo.py {0}/pool/{1}/'.format(base_path, release_repo),
+                                                print_only=self.dry_run))
+            transport.run(command='createrepo --update {0}/dists/{1}'.format(base_path, release_repo),
+                          print_only=self.dry_run)
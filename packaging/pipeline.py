@@ -0,0 +1,164 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Pipeline module
+"""
+import os
+import time
+import threading
+import traceback
+from Queue import Queue
+from packaging.helpers import format_duration
+from packaging.tracing import Tracer
+
+
+class UploadPipeline(object):
+    """
+    UploadPipeline class
+
+    Uploads the packages of a packager while it is still building, so the network and the CPU are busy at the same time
+    * Every destination has its own worker thread and a bounded queue of packages to upload. When a destination falls
+      behind, submitting blocks until it catches up (back-pressure), so at most 'queue_size' packages are pending per destination
+    * At most 'parallelism' packages are transferred at the same time, over all destinations
+    * The packages are only added to the repository of a destination after the build succeeded and all packages were
+      staged on it, in one batch and in the sorted order of their names (like a regular upload)
+    * A failing destination does not stop the others. When the build fails, nothing is added to any repository
+    The packager provides the steps through _prepare_destination, _stage_package and _finalize_destination
+    """
+
+    _FINISH = 'finish'
+    _ABORT = 'abort'
+
+    def __init__(self, packager, destinations, add, hotfix_release=None, queue_size=4, parallelism=4):
+        """
+        Initializes an upload pipeline
+        :param packager: Packager which builds the packages
+        :type packager: packaging.packagers.packager.Packager
+        :param destinations: Destinations to upload to
+        :type destinations: list[dict]
+        :param add: Should the packages be added to the repository
+        :type add: bool
+        :param hotfix_release: Which release to hotfix for
+        :type hotfix_release: str
+        :param queue_size: Maximum amount of packages waiting to be uploaded per destination
+        :type queue_size: int
+        :param parallelism: Maximum amount of packages being transferred at the same time
+        :type parallelism: int
+        """
+        self.packager = packager
+        self.destinations = destinations
+        self.add = add
+        self.hotfix_release = hotfix_release
+        self.queue_size = max(1, queue_size)
+        self.parallelism = max(1, parallelism)
+
+        self._queues = []
+        self._threads = []
+        self._errors = {}  # Destination index -> formatted exception
+        self._transfer_slots = threading.BoundedSemaphore(self.parallelism)
+
+    @staticmethod
+    def _name(destination):
+        return '{0}@{1}'.format(destination['user'], destination['ip'])
+
+    def start(self):
+        """
+        Starts a worker for every destination
+        :return: None
+        :rtype: NoneType
+        """
+        for index, destination in enumerate(self.destinations):
+            queue = Queue(maxsize=self.queue_size)
+            thread = threading.Thread(target=self._work, args=(index, destination, queue), name='upload-{0}'.format(self._name(destination)))
+            thread.daemon = True
+            thread.start()
+            self._queues.append(queue)
+            self._threads.append(thread)
+
+    def submit(self, package_path):
+        """
+        Queues a built package for upload to all destinations. Blocks while a destination has too many pending packages
+        :param package_path: Local path of the package. The file must be complete
+        :type package_path: str
+        :return: None
+        :rtype: NoneType
+        """
+        print 'Queueing {0} for upload to {1} destination(s)'.format(os.path.basename(package_path), len(self._queues))
+        for queue in self._queues:
+            queue.put(package_path)
+
+    def _work(self, index, destination, queue):
+        """
+        Uploads the packages of a single destination as they are submitted
+        """
+        start = time.time()
+        staged_paths = {}
+        context = None
+        with Tracer.span('destination', destination=self._name(destination), distro=self.packager.distro, pipelined=True):
+            while True:
+                package_path = queue.get()
+                if package_path in [self._FINISH, self._ABORT]:
+                    break
+                if index in self._errors:
+                    continue  # Keep taking packages, so the build never blocks on a failed destination
+                try:
+                    with self._transfer_slots:
+                        if context is None:
+                            context = self.packager._prepare_destination(destination, self.hotfix_release)
+                        staged_paths[os.path.basename(package_path)] = self.packager._stage_package(destination, context, package_path)
+                except Exception:
+                    self._errors[index] = traceback.format_exc()
+            if package_path == self._ABORT:
+                self.packager.log(destination, 'Aborted after {0}: the build failed'.format(format_duration(time.time() - start)))
+                return
+            if index not in self._errors:
+                try:
+                    if context is None:
+                        context = self.packager._prepare_destination(destination, self.hotfix_release)
+                    self.packager._finalize_destination(destination, context, [staged_paths[name] for name in sorted(staged_paths)],
+                                                        self.add, self.hotfix_release)
+                except Exception:
+                    self._errors[index] = traceback.format_exc()
+        if index in self._errors:
+            self.packager.log(destination, 'FAILED after {0}:\n{1}'.format(format_duration(time.time() - start), self._errors[index]))
+        else:
+            self.packager.log(destination, 'Done after {0}'.format(format_duration(time.time() - start)))
+
+    def _stop(self, sentinel):
+        for queue in self._queues:
+            queue.put(sentinel)
+        for thread in self._threads:
+            thread.join()
+
+    def abort(self):
+        """
+        Stops the workers without adding anything to the repositories. Packages which were already staged are left behind
+        :return: None
+        :rtype: NoneType
+        """
+        self._stop(self._ABORT)
+
+    def finish(self):
+        """
+        Waits until all submitted packages are staged and added to the repositories
+        :return: None
+        :rtype: NoneType
+        """
+        self._stop(self._FINISH)
+        if len(self._errors) > 0:
+            failed = [self._name(self.destinations[index]) for index in sorted(self._errors)]
+            raise RuntimeError('Handling {0} out of {1} destinations failed: {2}'.format(len(failed), len(self.destinations), ', '.join(failed)))
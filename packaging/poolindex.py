@@ -0,0 +1,229 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Pool index module
+"""
+import os
+import json
+import time
+import errno
+import hashlib
+import threading
+from packaging.debversion import DebianVersion
+
+
+class PoolIndex(object):
+    """
+    PoolIndex class
+
+    In-memory index of all files within the package pool of a destination
+    The pool is listed once, after which lookups no longer require a remote tree scan
+    * The index can be persisted locally. A persisted index is re-used while it is younger than 'max_age' and
+      the repository fingerprint did not change. The pool is only changed by reprepro, which rewrites its 'db' files
+      and the 'Release' files it exports, so the fingerprint is a checksum over their modification times and sizes
+      Without a reprepro database, the fingerprint never changes and only 'max_age' applies
+    """
+
+    _indexes = {}
+    _lock = threading.Lock()
+
+    def __init__(self, transport, pool_path, cache_directory=None, max_age=None):
+        """
+        Initializes a pool index
+        :param transport: Transport of the destination
+        :type transport: packaging.transport.Transport
+        :param pool_path: Remote path of the pool
+        :type pool_path: str
+        :param cache_directory: Local directory to persist the index in. None disables persisting
+        :type cache_directory: str
+        :param max_age: Maximum age in seconds of a persisted index before it is fetched again
+        :type max_age: int
+        """
+        self.transport = transport
+        self.pool_path = pool_path.rstrip('/')
+        self.cache_directory = cache_directory
+        self.max_age = max_age
+
+        self.entries = None  # Filename -> {'path': str, 'size': int}
+        self._builds = None  # (Package name, architecture, extension) -> {version: filename}
+        self.fingerprint = None
+        self._load_lock = threading.Lock()
+
+    @staticmethod
+    def get(transport, pool_path, settings):
+        """
+        Retrieves the index of the given pool, loading it when required
+        The index is kept in memory for the whole run
+        :param transport: Transport of the destination
+        :type transport: packaging.transport.Transport
+        :param pool_path: Remote path of the pool
+        :type pool_path: str
+        :param settings: Packaging settings. The 'pool_index' section configures the persisting
+        :type settings: dict
+        :return: The loaded pool index
+        :rtype: PoolIndex
+        """
+        key = (str(transport), pool_path)
+        with PoolIndex._lock:
+            if key not in PoolIndex._indexes:
+                index_settings = settings.get('pool_index', {})
+                PoolIndex._indexes[key] = PoolIndex(transport=transport,
+                                                    pool_path=pool_path,
+                                                    cache_directory=index_settings.get('cache_directory'),
+                                                    max_age=index_settings.get('max_age'))
+            index = PoolIndex._indexes[key]
+        # Loading happens outside of the global lock so multiple destinations can be indexed at the same time
+        with index._load_lock:
+            if index.entries is None:
+                index.load()
+        return index
+
+    @staticmethod
+    def clear():
+        """
+        Forgets all indexes which are kept in memory
+        :return: None
+        :rtype: NoneType
+        """
+        with PoolIndex._lock:
+            PoolIndex._indexes.clear()
+
+    @property
+    def cache_path(self):
+        """
+        Local path of the persisted index
+        :return: The path or None when the index should not be persisted
+        :rtype: str
+        """
+        if self.cache_directory is None:
+            return None
+        return os.path.join(self.cache_directory, 'pool-{0}-{1}.json'.format(self.transport, hashlib.sha1(self.pool_path).hexdigest()[:12]))
+
+    def _fetch_fingerprint(self):
+        # The pool is located at <repository>/pool/<component>. Only stats a handful of files instead of walking the pool
+        repository_path = os.path.dirname(os.path.dirname(self.pool_path))
+        return self.transport.run(command="stat -c '%n %y %s' {0}/db/* {0}/dists/*/Release 2>/dev/null | sha256sum".format(repository_path)).split()[0]
+
+    def _load_cache(self):
+        cache_path = self.cache_path
+        if cache_path is None or self.max_age is None or not os.path.exists(cache_path):
+            return False
+        with open(cache_path, 'r') as cache_file:
+            cache = json.load(cache_file)
+        if time.time() - cache['timestamp'] > self.max_age:
+            print '    Persisted pool index is outdated'
+            return False
+        fingerprint = self._fetch_fingerprint()
+        if fingerprint != cache['fingerprint']:
+            print '    Pool changed since the index was persisted'
+            return False
+        self.entries = cache['entries']
+        self.fingerprint = fingerprint
+        self._builds = None
+        return True
+
+    def _save_cache(self):
+        cache_path = self.cache_path
+        if cache_path is None:
+            return
+        try:
+            os.makedirs(self.cache_directory)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        temp_path = '{0}.{1}'.format(cache_path, os.getpid())
+        with open(temp_path, 'w') as cache_file:
+            json.dump({'timestamp': time.time(),
+                       'fingerprint': self.fingerprint,
+                       'entries': self.entries}, cache_file)
+        os.rename(temp_path, cache_path)
+
+    def load(self, refresh=False):
+        """
+        Loads the index, from the persisted index if it is still fresh, otherwise by listing the pool
+        :param refresh: Always list the pool, ignoring the persisted index
+        :type refresh: bool
+        :return: None
+        :rtype: NoneType
+        """
+        print '    Loading the pool index of {0}:{1}'.format(self.transport, self.pool_path)
+        if refresh is False and self._load_cache() is True:
+            print '    Using the persisted pool index ({0} files)'.format(len(self.entries))
+            return
+        if self.cache_path is not None:
+            self.fingerprint = self._fetch_fingerprint()
+        listing = self.transport.run(command="find {0}/ -type f -printf '%f|%s|%p\\n'".format(self.pool_path))
+        self.entries = {}
+        for line in listing.splitlines():
+            if line.strip() == '':
+                continue
+            name, size, path = line.split('|', 2)
+            if name not in self.entries:
+                self.entries[name] = {'path': path,
+                                      'size': int(size)}
+        self._builds = None
+        print '    Indexed {0} files'.format(len(self.entries))
+        self._save_cache()
+
+    def lookup(self, name):
+        """
+        Looks up a file within the pool
+        :param name: Filename to look for
+        :type name: str
+        :return: The entry of the file ({'path': str, 'size': int}) or None when it is not present
+        :rtype: dict
+        """
+        if self.entries is None:
+            raise RuntimeError('The pool index has not yet been loaded')
+        return self.entries.get(name)
+
+    @staticmethod
+    def _split_package_name(name):
+        # Debian package filenames are <name>_<version>_<architecture>.<extension>
+        base, extension = os.path.splitext(name)
+        parts = base.split('_')
+        if len(parts) != 3:
+            return None
+        return parts[0], parts[1], parts[2], extension
+
+    def find_previous_build(self, name):
+        """
+        Looks up the newest other build of a package within the pool (eg: to transfer a new build as a delta against it)
+        :param name: Filename of the package (eg: alba_1.5.33-1_amd64.deb)
+        :type name: str
+        :return: The entry of the newest build of the same package, architecture and type with another version
+        ({'path': str, 'size': int}) or None when there is none
+        :rtype: dict
+        """
+        if self.entries is None:
+            raise RuntimeError('The pool index has not yet been loaded')
+        split_name = PoolIndex._split_package_name(name)
+        if split_name is None:
+            return None
+        if self._builds is None:
+            builds = {}
+            for filename in self.entries:
+                split_filename = PoolIndex._split_package_name(filename)
+                if split_filename is not None:
+                    package, version, architecture, extension = split_filename
+                    builds.setdefault((package, architecture, extension), {})[version] = filename
+            self._builds = builds
+        package, version, architecture, extension = split_name
+        versions = [other for other in self._builds.get((package, architecture, extension), {}) if other != version]
+        if len(versions) == 0:
+            return None
+        return self.entries[self._builds[(package, architecture, extension)][DebianVersion.latest(versions)]]
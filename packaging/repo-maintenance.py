@@ -18,18 +18,76 @@
 Repo maintenance module
 """
 
-import os
-import re
-import logging
-from distutils.version import LooseVersion
+import sys
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
+from pipes import quote
 from sourcecollector import SourceCollector
-
-
-logging.basicConfig(level=logging.DEBUG)
-_logger = logging.getLogger(__name__)
-
-PACKAGE_REGEX = re.compile('(?P<name>\D*)(?P<separator>[-|_])(?P<version>(?P<version_simple>(\d+\.)?(\d+\.)?(\d+))(\-\d)?)(_.*)')
+from packaging.debversion import DebianVersion
+from packaging.repostate import RepositoryState
+from packaging.transport import Transport
+
+_print_lock = threading.Lock()
+
+
+def promote(destination, from_release, to_release, skips, batch_size, dry_run, settings):
+    """
+    Promotes the packages of a release which are newer than those of another release on a single destination
+    The packages are copied between the releases by reprepro in batches, so they are referenced from the pool instead
+    of being included again from their .deb files. The indices of the release are exported once at the end
+    :param destination: Destination to promote on
+    :type destination: dict
+    :param from_release: Release to promote from
+    :type from_release: str
+    :param to_release: Release to promote to
+    :type to_release: str
+    :param skips: Prefixes of the package names to leave out
+    :type skips: tuple
+    :param batch_size: Maximum amount of packages to copy with a single command
+    :type batch_size: int
+    :param dry_run: Only print the commands which would change the repository
+    :type dry_run: bool
+    :param settings: The packaging settings
+    :type settings: dict
+    :return: The lines to report
+    :rtype: list[str]
+    """
+    base_path = destination['base_path']
+    lines = ['Processing {0}@{1}'.format(destination['user'], destination['ip'])]
+    transport = Transport.get(user=destination['user'], server=destination['ip'], settings=settings)
+
+    repository_state = RepositoryState.get(transport=transport, repository_path='{0}/debian'.format(base_path), settings=settings)
+
+    lines.append('  Reading releases')
+    package_maps = {}
+    for release in [from_release, to_release]:
+        lines.append('    {0} repo'.format(release))
+        package_maps[release] = dict((name, package['version']) for name, package in repository_state.read_release(release).iteritems()
+                                     if not name.startswith(skips) and not (package['filename'] or '').endswith('.ddeb'))  # We don't care about debug packages
+    source_package_map = package_maps[from_release]
+    destination_package_map = package_maps[to_release]
+
+    lines.append('  Adding packages')
+    to_copy = []
+    for package in sorted(source_package_map):
+        source_version = source_package_map[package]
+        destination_version = destination_package_map.get(package)
+        if destination_version is None or DebianVersion.compare(source_version, destination_version) > 0:
+            lines.append('    {0} need to be copied as {1} is newer than {2}'.format(
+                package, source_version, '(none)' if destination_version is None else destination_version
+            ))
+            to_copy.append(package)
+
+    if len(to_copy) > 0:
+        for index in xrange(0, len(to_copy), batch_size):
+            transport.run(command='reprepro -Vb {0}/debian --export=never copy {1} {2} {3}'.format(base_path, quote(to_release), quote(from_release),
+                                                                                                 ' '.join(quote(package) for package in to_copy[index:index + batch_size])),
+                          print_only=dry_run)
+        transport.run(command='reprepro -Vb {0}/debian export {1}'.format(base_path, quote(to_release)), print_only=dry_run)
+        lines.append('  Copied {0} package(s) from {1} to {2}'.format(len(to_copy), from_release, to_release))
+    return lines
 
 
 if __name__ == '__main__':
@@ -41,99 +99,37 @@ if __name__ == '__main__':
 
     options, args = parser.parse_args()
 
-    dry_run = options.dry_run
-    skips = tuple(options.skip.split(',')) if options.skip is not None else ()
-    settings = SourceCollector.json_loads('{0}/{1}'.format(os.path.dirname(os.path.realpath(__file__)), 'settings.json'))
-
+    settings = SourceCollector.get_settings()
+    maintenance_settings = settings.get('repo_maintenance', {})
     package_info = settings['repositories']['packages'].get('debian', [])
-    for destination in package_info:
-        server = destination['ip']
-        user = destination['user']
-        base_path = destination['base_path']
-
-        print 'Processing {0}@{1}'.format(user, server)
-
-        print '  Reading releases'
-
-        source_package_map = {}
-        destination_package_map = {}
-        for release, package_map in {options.from_release: source_package_map,
-                                     options.to_release: destination_package_map}.iteritems():
-            print '    {0} repo'.format(release)
-
-            repo_command = "ssh {0}@{1} 'reprepro -Vb {2}/debian list {3}'".format(
-                user, server, base_path, release
-            )
-            packages = SourceCollector.run(command=repo_command,
-                                           working_directory='/').strip().splitlines()
-            for package in packages:
-                _, name, version = package.split(' ')
-                if options.skip is not None:
-                    skips = tuple(options.skip.split(','))
-                    if name.startswith(skips):
-                        continue
-
-                if ':' in version:
-                    version = version.split(':', 1)[1]
-
-                if name in package_map:
-                    if LooseVersion(version) > LooseVersion(package_map[name][0]):
-                        package_map[name] = version
-                else:
-                    package_map[name] = version
-
-        package_map = {}
-        package_meta_package_map = {}
-        for release in [options.from_release, options.to_release, 'upstream']:
-            print '    package folder for {0}'.format(release)
-
-            ls_command = "ssh {0}@{1} 'ls {2}/{3}/*.*deb'".format(user, server, base_path, release)
-            packages = SourceCollector.run(command=ls_command,
-                                           working_directory='/').strip().splitlines()
-            for package in packages:
-                deb = os.path.basename(package)
-                if '_' not in deb and release == 'upstream':
-                    continue  # Unparsable upstream packages
-
-                search = PACKAGE_REGEX.search(deb)
-                if not search:
-                    _logger.info('Malformatted .deb for "{0}"'.format(deb))
-                    continue
-                groups_dict = search.groupdict()
-                name, separator, version = groups_dict['name'], groups_dict['separator'], groups_dict['version']
-                if separator == '-':
-                    _logger.info('Assuming that {0} is a versioned package'.format(deb))
-                    # Versioned .deb format: alba-ee-1.5.33-1_amd64.deb
-                if name.startswith(skips):
-                    _logger.info('Skipping {0} as requested by the user'.format(deb))
-                    continue
-
-                if name in package_map:
-                    if LooseVersion(version) > LooseVersion(package_map[name][0]):
-                        package_map[name] = (version, package)
-                else:
-                    package_map[name] = (version, package)
-
-        print '  Adding packages'
-        for package in source_package_map:
-            source_version = source_package_map[package]
-            destination_version = destination_package_map.get(package)
-            if destination_version is None or LooseVersion(source_version) > LooseVersion(destination_version):
-                deb_version, deb_location = package_map.get(package, (None, None))
-                if deb_location is not None and deb_location.endswith('.ddeb'):
-                    continue  # We don't care about debug packages
-                print '    {0} need to be copied as {1} is newer than {2}'.format(
-                    package, source_version, '(none)' if destination_version is None else destination_version
-                )
-                if deb_version is None or deb_version != source_version:
-                    print '        Warning: Could not locate the deb-file. Please update it manually.'.format(
-                        package, source_version
-                    )
-                    continue
 
-                repo_command = "ssh {0}@{1} 'reprepro -Vb {2}/debian includedeb {3} {4}'".format(
-                    user, server, base_path, options.to_release, deb_location
-                )
-                SourceCollector.run(command=repo_command,
-                                    working_directory='/',
-                                    print_only=dry_run)
+    def _promote(_destination):
+        try:
+            lines = promote(destination=_destination,
+                            from_release=options.from_release,
+                            to_release=options.to_release,
+                            skips=tuple(options.skip.split(',')) if options.skip is not None else (),
+                            batch_size=max(1, maintenance_settings.get('batch_size', 100)),
+                            dry_run=options.dry_run,
+                            settings=settings)
+            success = True
+        except Exception:
+            lines = ['Processing {0}@{1} FAILED:\n{2}'.format(_destination['user'], _destination['ip'], traceback.format_exc())]
+            success = False
+        # The output of a destination is printed at once, so it does not interleave with the others
+        with _print_lock:
+            print '\n'.join(lines)
+            sys.stdout.flush()
+        return success
+
+    # Every destination is promoted, also when another one fails
+    pool = ThreadPool(processes=max(1, min(maintenance_settings.get('parallelism', 4), len(package_info))))
+    try:
+        outcomes = pool.map(_promote, package_info)
+    finally:
+        pool.close()
+        pool.join()
+        Transport.close_all()
+    failed = ['{0}@{1}'.format(destination['user'], destination['ip']) for destination, success in zip(package_info, outcomes) if success is False]
+    if len(failed) > 0:
+        raise RuntimeError('Promoting on {0} out of {1} destinations failed: {2}'.format(len(failed), len(package_info), ', '.join(failed)))
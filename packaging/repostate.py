@@ -0,0 +1,224 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Repository state module
+"""
+import os
+import gzip
+import json
+import errno
+import base64
+import hashlib
+import posixpath
+from pipes import quote
+from StringIO import StringIO
+from packaging.debversion import DebianVersion
+
+
+class RepositoryState(object):
+    """
+    RepositoryState class
+
+    Reads which packages the releases of a debian repository contain from its published indices
+    (dists/<release>/Release and the Packages indices it lists) instead of querying reprepro
+    * All Packages indices of a release are fetched in a single request and verified against the Release file
+    * The parsed indices can be persisted locally, keyed on the checksum of the Release file. Reading an unchanged
+      release then only fetches its Release file
+    """
+
+    INDEX_MARKER = '__fwk_index__'
+
+    def __init__(self, transport, repository_path, cache_directory=None):
+        """
+        Initializes a repository state reader
+        :param transport: Transport of the destination
+        :type transport: packaging.transport.Transport
+        :param repository_path: Remote path of the repository (the folder containing 'dists' and 'pool')
+        :type repository_path: str
+        :param cache_directory: Local directory to persist the parsed indices in. None disables persisting
+        :type cache_directory: str
+        """
+        self.transport = transport
+        self.repository_path = repository_path.rstrip('/')
+        self.cache_directory = cache_directory
+
+    @staticmethod
+    def get(transport, repository_path, settings):
+        """
+        Creates a repository state reader
+        :param transport: Transport of the destination
+        :type transport: packaging.transport.Transport
+        :param repository_path: Remote path of the repository
+        :type repository_path: str
+        :param settings: Packaging settings. The 'repository_state' section configures the persisting
+        :type settings: dict
+        :return: The repository state reader
+        :rtype: RepositoryState
+        """
+        return RepositoryState(transport=transport,
+                               repository_path=repository_path,
+                               cache_directory=settings.get('repository_state', {}).get('cache_directory'))
+
+    def get_cache_path(self, release):
+        """
+        Local path of the persisted indices of a release
+        :param release: Release
+        :type release: str
+        :return: The path or None when the indices should not be persisted
+        :rtype: str
+        """
+        if self.cache_directory is None:
+            return None
+        return os.path.join(self.cache_directory, 'release-{0}-{1}.json'.format(self.transport, hashlib.sha1('{0}|{1}'.format(self.repository_path, release)).hexdigest()[:12]))
+
+    @staticmethod
+    def parse_release(contents):
+        """
+        Parses the checksums of a Release file
+        :param contents: Contents of the Release file
+        :type contents: str
+        :return: The SHA256 checksum and size per listed file
+        :rtype: dict
+        """
+        checksums = {}
+        in_section = False
+        for line in contents.splitlines():
+            if not line.startswith(' '):
+                in_section = line.strip() == 'SHA256:'
+                continue
+            if in_section is True:
+                checksum, size, path = line.split()
+                checksums[path] = (checksum, int(size))
+        return checksums
+
+    @staticmethod
+    def parse_packages(contents, packages=None):
+        """
+        Parses a Packages index
+        :param contents: Contents of the (uncompressed) Packages index
+        :type contents: str
+        :param packages: Index to add the packages to
+        :type packages: dict
+        :return: The newest version of every package ({'version': str, 'filename': str, 'size': int, 'sha256': str}) per package name
+        :rtype: dict
+        """
+        packages = {} if packages is None else packages
+        for stanza in contents.split('\n\n'):
+            fields = {}
+            for line in stanza.splitlines():
+                if line == '' or line[0] in ' \t' or ':' not in line:
+                    continue  # Continuation lines of multi-line fields
+                field, value = line.split(':', 1)
+                fields[field] = value.strip()
+            if 'Package' not in fields or 'Version' not in fields:
+                continue
+            current = packages.get(fields['Package'])
+            # Every architecture has its own index, with possibly different versions
+            if current is None or DebianVersion.compare(fields['Version'], current['version']) > 0:
+                packages[fields['Package']] = {'version': fields['Version'],
+                                               'filename': fields.get('Filename'),
+                                               'size': int(fields.get('Size', 0)),
+                                               'sha256': fields.get('SHA256')}
+        return packages
+
+    @staticmethod
+    def _select_indices(checksums):
+        # Every component/architecture lists its index in several compressions. Prefer the gzipped one
+        directories = {}
+        for path in checksums:
+            directory, name = posixpath.split(path)
+            if name in ['Packages', 'Packages.gz']:
+                directories.setdefault(directory, set()).add(name)
+        return [posixpath.join(directory, 'Packages.gz' if 'Packages.gz' in names else 'Packages') for directory, names in sorted(directories.iteritems())]
+
+    def _load_cache(self, release, release_checksum):
+        cache_path = self.get_cache_path(release)
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        with open(cache_path, 'r') as cache_file:
+            cache = json.load(cache_file)
+        if cache['release_checksum'] != release_checksum:
+            return None
+        return cache['packages']
+
+    def _save_cache(self, release, release_checksum, packages):
+        cache_path = self.get_cache_path(release)
+        if cache_path is None:
+            return
+        try:
+            os.makedirs(self.cache_directory)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        temp_path = '{0}.{1}'.format(cache_path, os.getpid())
+        with open(temp_path, 'w') as cache_file:
+            json.dump({'release_checksum': release_checksum,
+                       'packages': packages}, cache_file)
+        os.rename(temp_path, cache_path)
+
+    def _fetch_indices(self, release, paths):
+        # All indices are fetched in a single request. Every index is base64 encoded, preceded by a marker line
+        release_path = '{0}/dists/{1}'.format(self.repository_path, release)
+        output = self.transport.run(command='cd {0} && for path in {1}; do echo "{2} $path"; base64 "$path"; done'.format(quote(release_path),
+                                                                                                              ' '.join(quote(path) for path in paths),
+                                                                                                              self.INDEX_MARKER))
+        indices = {}
+        path = None
+        for line in output.splitlines():
+            if line.startswith(self.INDEX_MARKER):
+                path = line.split(' ', 1)[1]
+                indices[path] = []
+            elif path is not None:
+                indices[path].append(line)
+        return dict((path, base64.b64decode(''.join(lines))) for path, lines in indices.iteritems())
+
+    def read_release(self, release):
+        """
+        Reads the packages of a release
+        :param release: Release to read
+        :type release: str
+        :return: The newest version of every package ({'version': str, 'filename': str, 'size': int, 'sha256': str}) per package name
+        :rtype: dict
+        """
+        release_file = '{0}/dists/{1}/Release'.format(self.repository_path, release)
+        release_contents = self.transport.run(command='if [ -f {0} ]; then cat {0}; fi'.format(quote(release_file)))
+        if release_contents.strip() == '':
+            print '    Release {0} on {1} has not been published yet'.format(release, self.transport)
+            return {}
+        release_checksum = hashlib.sha256(release_contents).hexdigest()
+        packages = self._load_cache(release, release_checksum)
+        if packages is not None:
+            print '    Using the persisted index of {0} on {1} ({2} packages)'.format(release, self.transport, len(packages))
+            return packages
+
+        checksums = RepositoryState.parse_release(release_contents)
+        paths = RepositoryState._select_indices(checksums)
+        if len(paths) == 0:
+            # Reprepro lists the Packages indices of every component and architecture, also when they are empty
+            raise RuntimeError('Release {0} on {1} does not list any Packages index. Can not tell which packages it contains'.format(release, self.transport))
+        indices = self._fetch_indices(release, paths)
+        packages = {}
+        for path in paths:
+            contents = indices.get(path)
+            if contents is None or hashlib.sha256(contents).hexdigest() != checksums[path][0]:
+                raise RuntimeError('Index {0} of release {1} does not match its Release file. Is the repository being updated?'.format(path, release))
+            if path.endswith('.gz'):
+                contents = gzip.GzipFile(fileobj=StringIO(contents)).read()
+            RepositoryState.parse_packages(contents, packages)
+        print '    Indexed {0} packages from {1} index(es) of {2} on {3}'.format(len(packages), len(paths), release, self.transport)
+        self._save_cache(release, release_checksum, packages)
+        return packages
@@ -19,12 +19,18 @@ SourceCollector module
 """
 
 import os
-import re
 import time
 import json
+import shutil
 import logging
 from datetime import datetime
-from subprocess import check_output, CalledProcessError
+from collections import deque
+from packaging.archive import GitArchive
+from packaging.debversion import DebianVersion
+from packaging.execution import Command, CommandError, execute
+from packaging.helpers import format_size, link_tree
+from packaging.tagindex import TagIndex
+from packaging.tracing import Tracer
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -44,6 +50,12 @@ class SourceCollector(object):
     path_code = '{0}/code'
     path_package = '{0}/package'
     path_metadata = '{0}/metadata'
+    path_repository = '{0}/repository.git'
+    path_tag_index = '{0}/tags.json'
+    path_staging = '{0}/staging'
+
+    SETTINGS_ENVIRONMENT_VARIABLE = 'FWK_PACKAGING_SETTINGS'
+    SYNC_MODES = ['targeted', 'full']  # See _collect_sources
 
     def __init__(self, product, release=None, revision=None, artifact_only=False, dry_run=False, is_pip=False, py2deb_path='py2deb'):
         """
@@ -90,6 +102,9 @@ class SourceCollector(object):
         self.path_code = self.path_code.format(self.working_directory)
         self.path_package = self.path_package.format(self.working_directory)
         self.path_metadata = self.path_metadata.format(self.working_directory)
+        self.path_repository = self.path_repository.format(self.working_directory)
+        self.path_tag_index = self.path_tag_index.format(self.working_directory)
+        self.path_staging = self.path_staging.format(self.working_directory)
 
         ####################################
         # Set when data has been collected #
@@ -100,13 +115,15 @@ class SourceCollector(object):
         self.package_name = None  # Name of the package to build (found in settings.jon on the repository)
         self.package_tags = None  # Tags for the package to build (found in settings.json on the repository)
         self.revision_hash = None  # Revision hash of the repository
+        self.commit_hash = None  # Full revision hash of the repository
         self.revision_date = None  # Revision data of the repository
-        self.tag_data = None  # Tag data of the repository
+        self.tag_data = None  # Tag data of the repository (TagIndex)
         # Build related data
         self.changelog = None  # Contents for the changelog file
         self.increment_build = True  # Flag if the build should be incremented (building the changelog might set this to False)
 
         self.version_string = None
+        self.version_without_timestamp = None  # Identical for every build of the same revision, unlike the version string of dev builds
         self.metadata = None
 
         self._create_destination_directories()
@@ -115,10 +132,15 @@ class SourceCollector(object):
     def get_settings():
         """
         Retrieves the current settings
+        The settings.json next to this module is used, unless another file is given through the FWK_PACKAGING_SETTINGS
+        environment variable (eg: for benchmarking against local stand-ins of the package servers)
         :return: Settings dict
         :rtype: dict
         """
-        return SourceCollector.json_loads('{0}/{1}'.format(os.path.dirname(os.path.realpath(__file__)), 'settings.json'))
+        settings_path = os.environ.get(SourceCollector.SETTINGS_ENVIRONMENT_VARIABLE)
+        if settings_path is None:
+            settings_path = '{0}/{1}'.format(os.path.dirname(os.path.realpath(__file__)), 'settings.json')
+        return SourceCollector.json_loads(settings_path)
 
     def collect(self):
         """
@@ -142,17 +164,27 @@ class SourceCollector(object):
             return self.product, self.release_repo, self.version_string, self.revision_date, self.package_name, self.package_tags
 
         # Collect all information about the source
-        self._collect_sources()
+        with Tracer.span('sync', product=self.product):
+            self._collect_sources()
         # Build changelog
-        self._build_changelog()
+        with Tracer.span('changelog', product=self.product):
+            self._build_changelog()
         # Generate a version string
-        self._generate_version_string()
+        with Tracer.span('version', product=self.product):
+            self._generate_version_string()
+        # The way the archive gets built also decides where the changelog goes
+        git_archive = self._get_git_archive()
         # Save changelog
-        self._write_changelog()
+        self._write_changelog(git_archive)
         # Tag revision
-        self._tag_revision()
+        with Tracer.span('tags', product=self.product):
+            self._tag_revision()
         # Building archive
-        self._build_archive()
+        with Tracer.span('archive', product=self.product):
+            self._build_archive(git_archive)
+        # Extract the archive once for all packagers
+        with Tracer.span('extract', product=self.product):
+            self._extract_archive()
         return self.product, self.release_repo, self.version_string, self.revision_date, self.package_name, self.package_tags
 
     def _create_destination_directories(self):
@@ -186,9 +218,11 @@ class SourceCollector(object):
             self.release_repo = self.release
         return self.release_repo
 
-    def _build_archive(self):
+    def _build_archive(self, git_archive):
         """
         Build a tar archive of the repository
+        :param git_archive: The git archive to build the archive with or None to build it with tar (see _get_git_archive)
+        :type git_archive: packaging.archive.GitArchive
         :return: None
         :rtype: NoneType
         """
@@ -199,16 +233,85 @@ class SourceCollector(object):
             raise RuntimeError('Version string has not been generated')
 
         print 'Building archive'
-        SourceCollector.run(command="tar -czf {0}/{1}_{2}.tar.gz {3}".format(self.path_package,
-                                                                             self.package_name,
-                                                                             self.version_string,
-                                                                             self.code_settings['source_contents'].format(self.package_name, self.version_string)),
-                            working_directory=self.path_code)
-        SourceCollector.run(command='rm -f CHANGELOG.txt',
-                            working_directory=self.path_code)
+        source_contents = self.code_settings['source_contents'].format(self.package_name, self.version_string)
+        if git_archive is not None:
+            print 'Streaming the archive from revision {0}'.format(self.revision_hash)
+            entries = git_archive.build(repository_path=self.path_code,
+                                        revision=self.revision_hash,
+                                        archive_path='{0}/{1}_{2}.tar.gz'.format(self.path_package, self.package_name, self.version_string),
+                                        virtual_files={'CHANGELOG.txt': '\n'.join(self.changelog)},
+                                        mtime=time.mktime(self.revision_date.timetuple()),
+                                        timeout=self.settings.get('git', {}).get('timeout'),
+                                        retries=self.settings.get('git', {}).get('retries', 0))
+            print 'Archived {0} entries'.format(entries)
+        else:
+            SourceCollector.run(command="tar -czf {0}/{1}_{2}.tar.gz {3}".format(self.path_package,
+                                                                                 self.package_name,
+                                                                                 self.version_string,
+                                                                                 source_contents),
+                                working_directory=self.path_code,
+                                capture=False)
+            SourceCollector.run(command='rm -f CHANGELOG.txt',
+                                working_directory=self.path_code)
         print 'Archive: {0}/{1}_{2}.tar.gz'.format(self.path_package, self.package_name, self.version_string)
         print 'Done'
 
+    def _extract_archive(self):
+        """
+        Extracts the source archive into the staging folder
+        All packagers build from views of this single extracted tree. See stage_source
+        :return: None
+        :rtype: NoneType
+        """
+        if self.version_string is None:
+            raise RuntimeError('Version string has not been generated')
+        if os.path.exists(self.path_staging):
+            shutil.rmtree(self.path_staging)
+        os.makedirs(self.path_staging)
+        print 'Extracting archive to {0}'.format(self.path_staging)
+        SourceCollector.run(command='tar -xzf {0}/{1}_{2}.tar.gz'.format(self.path_package, self.package_name, self.version_string),
+                            working_directory=self.path_staging,
+                            capture=False)
+
+    def stage_source(self, destination_folder, writable=None):
+        """
+        Makes the extracted sources (<package name>-<version>) available within the given folder
+        Files are reflinked or hardlinked where possible and only copied otherwise. The views of the distros are built concurrently,
+        so the files a build modifies in place must be passed as writable: those are reflinked or copied, never hardlinked
+        :param destination_folder: Folder to stage the sources in
+        :type destination_folder: str
+        :param writable: Paths (relative to the sources) of the files and directories which the build modifies in place
+        :type writable: list[str]
+        :return: Path to the staged sources
+        :rtype: str
+        """
+        source_folder_name = '{0}-{1}'.format(self.package_name, self.version_string)
+        source_path = os.path.join(self.path_staging, source_folder_name)
+        if not os.path.exists(source_path):
+            raise RuntimeError('Sources have not yet been extracted')
+        destination_path = os.path.join(destination_folder, source_folder_name)
+        stats = link_tree(source_path, destination_path, symlinks=True, writable=writable)
+        print 'Staged sources at {0}: {1} linked, {2} copied'.format(destination_path,
+                                                                    format_size(stats.get('linked_bytes', 0)),
+                                                                    format_size(stats.get('copied_bytes', 0)))
+        return destination_path
+
+    def _get_git_archive(self):
+        """
+        Retrieves the git archive to build the source archive with, depending on the 'archive' settings
+        * 'git' mode: the archive is streamed from the object store, without using the checkout
+        * 'tar' mode: the archive is built with tar from the checkout
+        :return: The git archive or None when the archive should be built with tar
+        :rtype: packaging.archive.GitArchive
+        """
+        if self.settings.get('archive', {}).get('mode', 'git') != 'git':
+            return None
+        source_contents = self.code_settings['source_contents'].format(self.package_name, self.version_string)
+        git_archive = GitArchive.from_source_contents(source_contents)
+        if git_archive is None:
+            print 'Source contents "{0}" can not be streamed from git, falling back to tar'.format(source_contents)
+        return git_archive
+
     def _collect_sources(self):
         """
         Collect data about the repository
@@ -224,20 +327,50 @@ class SourceCollector(object):
 
         # Update the metadata repo
         print 'Updating metadata'
-        print 'Checking out master at {0}'.format(self.path_metadata)
-        SourceCollector._git_checkout_to(path=self.path_metadata,
-                                         revision='master',
-                                         repo=self.repository)
-        print 'Checking out {0} at {1}'.format(self.release if self.revision is None else self.revision, self.path_code)
-        SourceCollector._git_checkout_to(path=self.path_code,
-                                         revision=self.release if self.revision is None else self.revision,
-                                         repo=self.repository)
+        code_revision = self.release if self.revision is None else self.revision
+        git_settings = self.settings.get('git', {})
+        sync_mode = git_settings.get('sync_mode', 'targeted')
+        if sync_mode not in SourceCollector.SYNC_MODES:
+            raise ValueError('Sync mode {0} is invalid. Should be in {1}'.format(sync_mode, SourceCollector.SYNC_MODES))
+        timeout = git_settings.get('timeout')
+        retries = git_settings.get('retries', 0)
+        if sync_mode == 'full':
+            print 'Checking out master at {0}'.format(self.path_metadata)
+            SourceCollector._git_checkout_to(path=self.path_metadata,
+                                             revision='master',
+                                             repo=self.repository,
+                                             timeout=timeout,
+                                             retries=retries)
+            print 'Checking out {0} at {1}'.format(code_revision, self.path_code)
+            SourceCollector._git_checkout_to(path=self.path_code,
+                                             revision=code_revision,
+                                             repo=self.repository,
+                                             timeout=timeout,
+                                             retries=retries)
+        else:
+            # Both checkouts are worktrees of a single object store, so all objects are only fetched once
+            print 'Synchronizing the object store at {0}'.format(self.path_repository)
+            SourceCollector._git_init_store(path=self.path_repository,
+                                            repo=self.repository)
+            SourceCollector._git_fetch(path=self.path_repository,
+                                       revisions=['master', code_revision],
+                                       timeout=timeout,
+                                       retries=retries)
+            print 'Checking out master at {0}'.format(self.path_metadata)
+            SourceCollector._git_worktree_to(store=self.path_repository,
+                                             path=self.path_metadata,
+                                             revision='master')
+            print 'Checking out {0} at {1}'.format(code_revision, self.path_code)
+            SourceCollector._git_worktree_to(store=self.path_repository,
+                                             path=self.path_code,
+                                             revision=code_revision)
         self.checked_out = True
         # Get current revision and date
         print 'Fetch current revision'
-        revision_hash, revision_date = SourceCollector.run(command='git show HEAD --pretty --format="%h|%at" -s',
-                                                           working_directory=self.path_code).strip().split('|')
+        revision_hash, commit_hash, revision_date = SourceCollector.run(command='git show HEAD --pretty --format="%h|%H|%at" -s',
+                                                                        working_directory=self.path_code).strip().split('|')
         self.revision_hash = revision_hash
+        self.commit_hash = commit_hash
         self.revision_date = datetime.fromtimestamp(float(revision_date))
         print 'Revision hash: {0}'.format(self.revision_hash)
         print 'Revision date: {0}'.format(self.revision_date)
@@ -250,25 +383,21 @@ class SourceCollector(object):
         print 'Version: {0}'.format(self.version)
 
         # Load tag information
-        self.tag_data = []
         print 'Loading tags'
         try:
-            for raw_tag in SourceCollector.run(command='git show-ref --tags',
-                                               working_directory=self.path_metadata).splitlines():
-                parts = raw_tag.strip().split(' ')
-                rev_hash = parts[0]
-                tag = parts[1].replace('refs/tags/', '')
-                match = re.search('^(?P<version>[0-9]+?\.[0-9]+?)\.(?P<build>[0-9]+?)([-.](.+))?$', tag)
-                if match:
-                    match_dict = match.groupdict()
-                    tag_version = match_dict['version']
-                    tag_build = match_dict['build']
-                    self.tag_data.append({'version': tag_version,  # 2.7  \__ 2.7.8
-                                          'build': int(tag_build),  # 8   /
-                                          'rev_hash': rev_hash})
+            try:
+                self.tag_data = TagIndex.load(self.path_tag_index)
+            except ValueError as ex:
+                # The index is only a cache of the tags: rebuild it from all refs
+                print 'Warning: {0}. Rebuilding it'.format(ex)
+                self.tag_data = TagIndex(path=self.path_tag_index)
+            changed, removed = self.tag_data.update(SourceCollector.run(command='git show-ref --tags -d',
+                                                                        working_directory=self.path_metadata))
+            self.tag_data.save()
         except Exception:
             _logger.exception("Failed to fetch the tags. Can't assume that there are none as it can have consequences. Aborting")
             raise
+        print 'Loaded {0} version tags ({1} new or changed refs, {2} removed refs)'.format(len(self.tag_data), changed, removed)
         return self.revision_hash, self.revision_date, self.version, self.tag_data
 
     def _tag_revision(self):
@@ -291,9 +420,12 @@ class SourceCollector(object):
             SourceCollector.run(command='git tag -a {0} {1} -m "Added tag {0} for changeset {1}"'.format(self.version_string, self.revision_hash),
                                 print_only=self.dry_run,
                                 working_directory=self.path_metadata)
+            git_settings = self.settings.get('git', {})
             SourceCollector.run(command='git push origin --tags',
                                 print_only=self.dry_run,
-                                working_directory=self.path_metadata)
+                                working_directory=self.path_metadata,
+                                timeout=git_settings.get('timeout'),
+                                retries=git_settings.get('retries', 0))
 
     def _build_changelog(self):
         """
@@ -315,35 +447,39 @@ class SourceCollector(object):
             changelog.append('For the full changelog, see https://github.com/openvstorage')
             changelog.append('')
             log_target = 'master' if self.release == 'master' else self.revision
-            log = SourceCollector.run(command='git --no-pager log origin/{0} --date-order --pretty --format="%at|%H|%s"'.format(log_target),
-                                      working_directory=self.path_code)
-            for log_line in log.strip().splitlines():
-                if 'Added tag ' in log_line and ' for changeset ' in log_line:
-                    continue
-
-                timestamp, log_hash, description = log_line.split('|', 2)
-                try:
-                    description.encode('ascii')
-                except UnicodeDecodeError:
-                    continue
-                active_tag = None
-                for tag in self.tag_data:
-                    if tag['rev_hash'] == log_hash:
-                        active_tag = tag
-                if active_tag is not None:
-                    if changes_found is False:
+            # The log is streamed: only the most recent change determines whether the build should be incremented,
+            # so the rest of the history does not have to be read
+            log = SourceCollector.stream(command='git --no-pager log origin/{0} --date-order --pretty --format="%at|%H|%s"'.format(log_target),
+                                         working_directory=self.path_code)
+            try:
+                for log_line in log:
+                    log_line = log_line.rstrip('\n')
+                    if 'Added tag ' in log_line and ' for changeset ' in log_line:
+                        continue
+
+                    timestamp, log_hash, description = log_line.split('|', 2)
+                    try:
+                        description.encode('ascii')
+                    except UnicodeDecodeError:
+                        continue
+                    if self.tag_data.is_tagged(log_hash):
                         increment_build = False
-                changes_found = True
+                    changes_found = True
+                    break
+            finally:
+                log.close()
 
         self.changelog = changelog
         self.increment_build = increment_build
 
         return changelog, changes_found, increment_build
 
-    def _write_changelog(self):
+    def _write_changelog(self, git_archive):
         """
         Writes away the changelog
         - Will add an extra line when the build should have been incremented
+        :param git_archive: The git archive the archive will be built with or None when it will be built with tar (see _get_git_archive)
+        :type git_archive: packaging.archive.GitArchive
         :return:
         """
         # Validation
@@ -352,10 +488,13 @@ class SourceCollector(object):
         if self.version_string is None:
             raise RuntimeError('No version string has been generated')
 
-        print 'Writing CHANGELOG file'
         if len(self.changelog) > 0:
             if self.increment_build is True:
                 self.changelog.append('\n{0}\n'.format(self.version_string))
+        if git_archive is not None:
+            # Injected into the archive directly
+            return
+        print 'Writing CHANGELOG file'
         with open('{0}/CHANGELOG.txt'.format(self.path_code), 'w') as changelog_file:
             changelog_file.write('\n'.join(self.changelog))
 
@@ -371,9 +510,9 @@ class SourceCollector(object):
             raise RuntimeError('No sources have been collected')
 
         print 'Generating build'
-        builds = sorted(tag['build'] for tag in self.tag_data if tag['version'] == self.version)
-        if len(builds) > 0:
-            build = builds[-1]
+        latest_tag = self.tag_data.latest_tag(self.version)
+        build = self.tag_data.latest_build(self.version)
+        if build is not None:
             if (self.revision is None or self.release == 'hotfix') and self.increment_build is True:
                 build += 1
             else:
@@ -383,43 +522,242 @@ class SourceCollector(object):
         print 'Build: {0}'.format(build)
 
         suffix = ''
+        stable_suffix = ''
         # Generate a suffix for artifact-only builds or develop/experimental builds to distinguish them from release builds
         if self.release in ['develop', 'experimental'] or (self.artifact_only is True and self.release != 'hotfix'):
             print 'Generating a suffix'
             suffix = '-dev.{0}.{1}'.format(int(time.time()), self.revision_hash)
+            stable_suffix = '-dev.{0}'.format(self.revision_hash)
 
         self.version_string = '{0}.{1}{2}'.format(self.version, build, '{0}'.format(suffix))
+        self.version_without_timestamp = '{0}.{1}{2}'.format(self.version, build, stable_suffix)
         print 'Full version: {0}'.format(self.version_string)
+        if latest_tag is not None and DebianVersion.compare(self.version_string, latest_tag) < 0:
+            print 'Warning: Version {0} is older than the latest tag {1}. Package managers will not upgrade to it'.format(self.version_string, latest_tag)
 
         return self.version_string
 
     @staticmethod
-    def _git_checkout_to(path, revision, repo):
+    def _git_checkout_to(path, revision, repo, timeout=None, retries=0):
         """
         Updates a given repo to a certain revision, cloning if it does not exist yet
+        All branches are pulled. Used by the 'full' sync mode
+        :param path: Path of the repository
+        :type path: str
+        :param revision: Revision (branch name or commit hash) to update to
+        :type revision: str
+        :param repo: Url of the repository
+        :type repo: str
+        :param timeout: Seconds after which a command which talks to the remote gets killed
+        :type timeout: float
+        :param retries: Amount of times to retry a failing command which talks to the remote
+        :type retries: int
+        :return: None
+        :rtype: NoneType
         """
         if not os.path.exists('{0}/.git'.format(path)):
-            SourceCollector.run('git clone {0} {1}'.format(repo, path), path)
-        SourceCollector.run('git pull --all --prune || true', path)
+            SourceCollector.run('git clone {0} {1}'.format(repo, path), path, timeout=timeout, retries=retries)
+        SourceCollector.run('git pull --all --prune || true', path, timeout=timeout)
         SourceCollector.run('git checkout {0}'.format(revision), path)
-        SourceCollector.run('git pull --prune', path)
-        SourceCollector.run('git fetch --tags', path)
+        SourceCollector.run('git pull --prune', path, timeout=timeout, retries=retries)
+        SourceCollector.run('git fetch --tags', path, timeout=timeout, retries=retries)
+
+    @staticmethod
+    def _git_init_store(path, repo):
+        """
+        Initializes a bare object store with the given repository as origin
+        :param path: Path of the object store
+        :type path: str
+        :param repo: Url of the repository
+        :type repo: str
+        :return: None
+        :rtype: NoneType
+        """
+        if not os.path.exists(os.path.join(path, 'HEAD')):
+            if not os.path.exists(path):
+                os.makedirs(path)
+            SourceCollector.run('git init --bare', path)
+            SourceCollector.run('git remote add origin {0}'.format(repo), path)
+        else:
+            SourceCollector.run('git remote set-url origin {0}'.format(repo), path)
+
+    @staticmethod
+    def _git_fetch(path, revisions, timeout=None, retries=0):
+        """
+        Fetches the given branches and all tags in a single fetch
+        When any of the revisions is not a branch (eg: a commit hash), all branches are fetched instead
+        Other failures (eg: the connection failed) are retried and raised
+        :param path: Path of the repository or object store
+        :type path: str
+        :param revisions: Revisions which should be available locally
+        :type revisions: list[str]
+        :param timeout: Seconds after which a fetch gets killed
+        :type timeout: float
+        :param retries: Amount of times to retry a failing fetch
+        :type retries: int
+        :return: None
+        :rtype: NoneType
+        """
+        start = time.time()
+        size_before = SourceCollector._git_object_size(path)
+        refspecs = ' '.join('+refs/heads/{0}:refs/remotes/origin/{0}'.format(revision) for revision in revisions)
+        command = 'git fetch --tags --prune origin {0}'.format(refspecs)
+        try:
+            # Not capturing, so the error output of git ends up in the tail of the error. Not translated, so it can be matched
+            SourceCollector.run(command, path, timeout=timeout, capture=False, env={'LC_ALL': 'C'})
+        except CommandError as ex:
+            if any("couldn't find remote ref" in line for line in ex.output_tail):
+                # One of the revisions is not a branch. Fall back to fetching all branches
+                SourceCollector.run('git fetch --tags --prune origin +refs/heads/*:refs/remotes/origin/*', path, timeout=timeout, retries=retries)
+            elif retries > 0:
+                SourceCollector.run(command, path, timeout=timeout, retries=retries - 1, capture=False, env={'LC_ALL': 'C'})
+            else:
+                raise
+        fetched = SourceCollector._git_object_size(path) - size_before
+        print 'Fetched {0} from {1}: {2} KiB in {3:.1f}s'.format(', '.join(revisions), path, fetched, time.time() - start)
+
+    @staticmethod
+    def _git_resolve_target(path, revision):
+        """
+        Resolves the revision to check out
+        :param path: Path of the repository or object store
+        :type path: str
+        :param revision: Branch name or commit hash
+        :type revision: str
+        :return: The remote tracking branch for branches, the revision itself otherwise
+        :rtype: str
+        """
+        try:
+            SourceCollector.run('git rev-parse --verify --quiet refs/remotes/origin/{0}'.format(revision), path)
+            return 'refs/remotes/origin/{0}'.format(revision)
+        except RuntimeError:
+            return revision
+
+    @staticmethod
+    def _git_worktree_to(store, path, revision):
+        """
+        Updates a worktree of the object store to a certain revision, creating it if it does not exist yet
+        The worktree is checked out detached, so multiple worktrees can point to the same branch
+        :param store: Path of the object store
+        :type store: str
+        :param path: Path of the worktree
+        :type path: str
+        :param revision: Revision (branch name or commit hash) to update to
+        :type revision: str
+        :return: None
+        :rtype: NoneType
+        """
+        target = SourceCollector._git_resolve_target(store, revision)
+        git_path = os.path.join(path, '.git')
+        if os.path.isdir(git_path):
+            # Standalone clone from the 'full' sync mode
+            print 'Replacing the standalone clone at {0} with a worktree'.format(path)
+            shutil.rmtree(path)
+        elif os.path.isfile(git_path):
+            common_dir = SourceCollector.run('git rev-parse --git-common-dir', path).strip()
+            if os.path.realpath(os.path.join(path, common_dir)) != os.path.realpath(store):
+                print 'Replacing the worktree of another object store at {0}'.format(path)
+                shutil.rmtree(path)
+        if not os.path.exists(git_path):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            # Forget about worktrees which have been removed
+            SourceCollector.run('git worktree prune', store)
+            SourceCollector.run('git worktree add --detach {0} {1}'.format(path, target), store)
+        else:
+            SourceCollector.run('git checkout -f --detach {0}'.format(target), path)
+            SourceCollector.run('git reset --hard {0}'.format(target), path)
 
     @staticmethod
-    def run(command, working_directory, print_only=False, debug=True):
+    def _git_object_size(path):
         """
-        Runs a comment, returning the output
+        Retrieves the size of the object store of a repository
+        :param path: Path of the repository
+        :type path: str
+        :return: Size of all loose and packed objects in KiB
+        :rtype: int
+        """
+        sizes = {}
+        for line in SourceCollector.run('git count-objects -v', path, debug=False).splitlines():
+            key, value = line.split(':', 1)
+            sizes[key.strip()] = value.strip()
+        return int(sizes.get('size', 0)) + int(sizes.get('size-pack', 0))
+
+    @staticmethod
+    def run(command, working_directory, print_only=False, debug=True, env=None, timeout=None, retries=0, retry_on=None, capture=True, on_line=None):
+        """
+        Runs a command, returning the output
+        The output is streamed line by line. See packaging.execution
+        :param command: Shell command or argv list (executed without a shell)
+        :type command: str or list[str]
+        :param working_directory: Directory to run the command in
+        :type working_directory: str
+        :param print_only: Only print the command instead of executing it
+        :type print_only: bool
+        :param debug: Print the command
+        :type debug: bool
+        :param env: Environment variables to set (or to remove, when their value is None)
+        :type env: dict
+        :param timeout: Seconds after which the command (and all processes it spawned) gets killed
+        :type timeout: float
+        :param retries: Amount of times to retry the command when it fails, with an exponential backoff
+        :type retries: int
+        :param retry_on: Exit codes which are worth a retry. None to retry on any failure
+        :type retry_on: list[int]
+        :param capture: Return the output. When False, the output (including the error output) is streamed to stdout
+        while the command runs and only its tail is kept in memory for the error message
+        :type capture: bool
+        :param on_line: Function to call with every line of the output
+        :return: The output of the command when capturing
+        :rtype: str
         """
         if debug is True or print_only is True:
-            print 'Debug - {0} command: {1} on path {2}'.format('Running' if print_only is False else 'Would be running', command, working_directory)
+            print 'Debug - {0} command: {1} on path {2}'.format('Running' if print_only is False else 'Would be running', Command.format(command), working_directory)
         if print_only is True:
             return
-        try:
-            return check_output(command, shell=True, cwd=working_directory)
-        except CalledProcessError as cpe:
-            # CalledProcessError doesn't include the output in its __str__
-            #  making debug harder
-            raise RuntimeError('{0}. \n Output: \n {1} \n'.format(cpe, cpe.output))
+        return execute(command=command,
+                       working_directory=working_directory,
+                       env=env,
+                       timeout=timeout,
+                       retries=retries,
+                       retry_on=retry_on,
+                       capture=capture,
+                       on_line=on_line)
+
+    @staticmethod
+    def stream(command, working_directory, debug=True, env=None, timeout=None, chunk_size=None):
+        """
+        Runs a command, yielding its output line by line
+        Closing the generator before the output is exhausted stops the command
+        :param command: Shell command or argv list (executed without a shell)
+        :type command: str or list[str]
+        :param working_directory: Directory to run the command in
+        :type working_directory: str
+        :param debug: Print the command
+        :type debug: bool
+        :param env: Environment variables to set (or to remove, when their value is None)
+        :type env: dict
+        :param timeout: Seconds after which the command gets killed
+        :type timeout: float
+        :param chunk_size: Yield the output in chunks of at most this size instead of line by line (eg: for binary output)
+        :type chunk_size: int
+        :return: Generator yielding the lines of the output (including the line endings) or its chunks
+        :rtype: generator
+        """
+        if debug is True:
+            print 'Debug - Streaming command: {0} on path {1}'.format(Command.format(command), working_directory)
+        streamed_command = Command(command=command, working_directory=working_directory, env=env, timeout=timeout)
+        tail = deque(maxlen=100 if chunk_size is None else 0)  # The tail of binary output is of no use in an error
+        with Tracer.span(name=Command.get_name(command), category='command', command=Command.format(command), cwd=working_directory) as span:
+            if chunk_size is None:
+                output = streamed_command.lines(span=span)
+            else:
+                output = streamed_command.chunks(size=chunk_size, span=span)
+            for data in output:
+                tail.append(data)
+                yield data
+        if streamed_command.exit_code != 0 or streamed_command.timed_out is True:
+            raise CommandError(command=command, exit_code=streamed_command.exit_code, output_tail=list(tail), timed_out=streamed_command.timed_out)
 
     @staticmethod
     def json_loads(path):
@@ -0,0 +1,186 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Tag index module
+"""
+import os
+import re
+import json
+from packaging.debversion import DebianVersion
+
+
+class TagIndex(object):
+    """
+    TagIndex class
+
+    Index of the version tags of a repository (eg: 2.7.8 -> version 2.7, build 8)
+    * Lookups by revision hash and by version are constant time
+    * Tags are ordered like dpkg orders versions (eg: 2.7.8 < 2.7.10). See DebianVersion
+    * The index can be persisted. When updating, only the refs which were added or changed since are parsed
+    """
+
+    TAG_REGEX = re.compile('^(?P<version>[0-9]+?\.[0-9]+?)\.(?P<build>[0-9]+?)([-.](.+))?$')
+
+    def __init__(self, path=None):
+        """
+        Initializes an empty tag index
+        :param path: Path to persist the index to. None disables persisting
+        :type path: str
+        """
+        self.path = path
+
+        self.refs = {}  # Tag name -> revision hash, for all tags (including the ones which are not a version)
+        self.tags = {}  # Tag name -> {'version': str, 'build': int, 'rev_hash': str}
+        self.by_hash = {}  # Revision hash -> set of tag names
+        self.by_version = {}  # Version -> set of tag names
+        self.latest_tags = {}  # Version -> newest tag name
+
+    def __len__(self):
+        return len(self.tags)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a persisted tag index
+        :param path: Path of the persisted index
+        :type path: str
+        :return: The loaded index. Empty when nothing was persisted yet
+        :rtype: TagIndex
+        :raises ValueError: When the persisted index is corrupt
+        """
+        index = TagIndex(path=path)
+        if os.path.exists(path):
+            with open(path, 'r') as index_file:
+                contents = index_file.read()
+            try:
+                data = json.loads(contents)
+                index.refs = dict((str(name), str(rev_hash)) for name, rev_hash in data['refs'].iteritems())
+                for name, (version, build) in data['tags'].iteritems():
+                    index._add(str(name), str(version), build, index.refs[name])
+            except (ValueError, KeyError, TypeError, AttributeError) as ex:
+                raise ValueError('Tag index {0} is corrupt: {1!r}'.format(path, ex))
+        return index
+
+    def save(self):
+        """
+        Persists the index
+        :return: None
+        :rtype: NoneType
+        """
+        if self.path is None:
+            return
+        temp_path = '{0}.{1}'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as index_file:
+            json.dump({'refs': self.refs,
+                       'tags': dict((name, [tag['version'], tag['build']]) for name, tag in self.tags.iteritems())}, index_file)
+        os.rename(temp_path, self.path)
+
+    def _add(self, name, version, build, rev_hash):
+        self.tags[name] = {'version': version,
+                           'build': build,
+                           'rev_hash': rev_hash}
+        self.by_hash.setdefault(rev_hash, set()).add(name)
+        self.by_version.setdefault(version, set()).add(name)
+        latest_tag = self.latest_tags.get(version)
+        if latest_tag is None or DebianVersion.compare(name, latest_tag) > 0:
+            self.latest_tags[version] = name
+
+    def _remove(self, name):
+        tag = self.tags.pop(name, None)
+        if tag is None:
+            return
+        self.by_hash[tag['rev_hash']].discard(name)
+        if len(self.by_hash[tag['rev_hash']]) == 0:
+            del self.by_hash[tag['rev_hash']]
+        version = tag['version']
+        self.by_version[version].discard(name)
+        if len(self.by_version[version]) == 0:
+            del self.by_version[version]
+            del self.latest_tags[version]
+        elif self.latest_tags[version] == name:
+            self.latest_tags[version] = DebianVersion.latest(self.by_version[version])
+
+    def update(self, show_ref_output):
+        """
+        Updates the index with the output of 'git show-ref --tags -d'
+        Annotated tags are indexed on the commit they point to (their dereferenced '^{}' entry), not on the tag object
+        Only refs which are new or point to another revision are parsed. Refs which are gone are removed
+        :param show_ref_output: Output of 'git show-ref --tags -d'
+        :type show_ref_output: str
+        :return: The amount of added/changed and removed refs
+        :rtype: tuple(int, int)
+        """
+        current_refs = {}
+        dereferenced_refs = {}
+        for raw_tag in show_ref_output.splitlines():
+            raw_tag = raw_tag.strip()
+            if raw_tag == '':
+                continue
+            rev_hash, ref = raw_tag.split(' ', 1)
+            name = ref.replace('refs/tags/', '', 1)
+            if name.endswith('^{}'):
+                dereferenced_refs[name[:-3]] = rev_hash
+            else:
+                current_refs[name] = rev_hash
+        current_refs.update(dereferenced_refs)
+
+        removed = [name for name in self.refs if name not in current_refs]
+        for name in removed:
+            self._remove(name)
+            del self.refs[name]
+        changed = 0
+        for name, rev_hash in current_refs.iteritems():
+            if self.refs.get(name) == rev_hash:
+                continue
+            changed += 1
+            self._remove(name)
+            self.refs[name] = rev_hash
+            match = self.TAG_REGEX.search(name)
+            if match:
+                self._add(name, match.group('version'), int(match.group('build')), rev_hash)
+        return changed, len(removed)
+
+    def is_tagged(self, rev_hash):
+        """
+        Checks whether a revision has a version tag
+        :param rev_hash: Revision hash
+        :type rev_hash: str
+        :return: True when the revision is tagged
+        :rtype: bool
+        """
+        return rev_hash in self.by_hash
+
+    def latest_build(self, version):
+        """
+        Retrieves the highest build of a version
+        :param version: Version (eg: 2.7)
+        :type version: str
+        :return: The highest build or None when the version was never built
+        :rtype: int
+        """
+        latest_tag = self.latest_tags.get(version)
+        return None if latest_tag is None else self.tags[latest_tag]['build']
+
+    def latest_tag(self, version):
+        """
+        Retrieves the newest tag of a version
+        :param version: Version (eg: 2.7)
+        :type version: str
+        :return: The newest tag (eg: 2.7.8) or None when the version was never built
+        :rtype: str
+        """
+        return self.latest_tags.get(version)
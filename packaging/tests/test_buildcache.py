@@ -0,0 +1,114 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Build cache test module
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from packaging.buildcache import BuildCache
+from packaging.sourcecollector import SourceCollector
+from packaging.tagindex import TagIndex
+
+
+class BuildCacheTest(unittest.TestCase):
+    """
+    Tests the keys and the hits of the build cache
+    """
+
+    COMMIT_HASH = '2795b7b5c8a1f2d3e4f5a6b7c8d9e0f1a2b3c4d5'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path_code = os.path.join(self.directory, 'code')
+        os.makedirs(os.path.join(self.path_code, 'packaging', 'debian'))
+        with open(os.path.join(self.path_code, 'packaging', 'debian', 'control'), 'w') as control_file:
+            control_file.write('Package: alba\n')
+        self.build_cache = BuildCache(directory=os.path.join(self.directory, 'cache'), max_size=1024 ** 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _collect(self, timestamp, commit_hash=COMMIT_HASH, artifact_only=True):
+        """
+        Mimics the source collection of a build started at the given time
+        """
+        source_collector = SourceCollector.__new__(SourceCollector)
+        source_collector.product = 'alba'
+        source_collector.release = 'master'
+        source_collector.release_repo = 'unstable'
+        source_collector.revision = None
+        source_collector.artifact_only = artifact_only
+        source_collector.path_code = self.path_code
+        source_collector.version = '1.5'
+        source_collector.commit_hash = commit_hash
+        source_collector.revision_hash = commit_hash[:7]
+        source_collector.increment_build = True
+        source_collector.tag_data = TagIndex()
+        source_collector.tag_data.update('{0} refs/tags/1.5.3\n'.format(commit_hash))
+        original_time = time.time
+        time.time = lambda: timestamp
+        try:
+            source_collector._generate_version_string()
+        finally:
+            time.time = original_time
+        return source_collector
+
+    def _build(self, source_collector):
+        package_folder = os.path.join(self.directory, 'package-{0}'.format(source_collector.version_string))
+        os.makedirs(package_folder)
+        with open(os.path.join(package_folder, 'alba_{0}_amd64.deb'.format(source_collector.version_string)), 'w') as package_file:
+            package_file.write('package')
+        return package_folder
+
+    def test_artifact_only_rebuild_hits(self):
+        """
+        Artifact-only builds of the same revision get another version string (timestamp), but the same cache key
+        """
+        first = self._collect(timestamp=1500000000)
+        second = self._collect(timestamp=1500000600)
+        self.assertNotEqual(first.version_string, second.version_string)
+        key = BuildCache.compute_key(first, 'debian')
+        self.assertEqual(key, BuildCache.compute_key(second, 'debian'))
+
+        self.build_cache.store(key, self._build(first), '.deb')
+        destination_folder = os.path.join(self.directory, 'restored')
+        self.assertTrue(self.build_cache.restore(BuildCache.compute_key(second, 'debian'), destination_folder))
+        self.assertEqual(os.listdir(destination_folder), ['alba_{0}_amd64.deb'.format(first.version_string)])
+
+    def test_other_revision_misses(self):
+        """
+        Revisions of which the short hash is the same still get another key
+        """
+        first = self._collect(timestamp=1500000000)
+        other = self._collect(timestamp=1500000000, commit_hash=self.COMMIT_HASH[:7] + '0' * 33)
+        self.assertEqual(first.revision_hash, other.revision_hash)
+        self.assertNotEqual(BuildCache.compute_key(first, 'debian'), BuildCache.compute_key(other, 'debian'))
+
+    def test_release_build_differs_from_dev_build(self):
+        """
+        A release build of a revision does not restore the dev build of it
+        """
+        dev = self._collect(timestamp=1500000000)
+        release = self._collect(timestamp=1500000000, artifact_only=False)
+        self.assertNotEqual(BuildCache.compute_key(dev, 'debian'), BuildCache.compute_key(release, 'debian'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Helpers test module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from packaging.helpers import link_tree
+
+
+class LinkTreeTest(unittest.TestCase):
+    """
+    Tests the staging of trees which are built from concurrently
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'source')
+        for relative_path in ['setup.py', 'debian/changelog', 'debian/control', 'packaging/redhat/scripts/after-install.sh']:
+            path = os.path.join(self.source, relative_path)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as source_file:
+                source_file.write('__NEW_VERSION__\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _read(self, root, relative_path):
+        with open(os.path.join(root, relative_path)) as read_file:
+            return read_file.read()
+
+    def test_in_place_edits_stay_within_the_view(self):
+        """
+        Writable files of one view can be modified in place without changing the source or another view
+        """
+        writable = ['debian', 'packaging/redhat/scripts']
+        views = [os.path.join(self.directory, distro) for distro in ['debian', 'redhat']]
+        for view in views:
+            link_tree(self.source, view, writable=writable)
+        for relative_path in ['debian/changelog', 'debian/control', 'packaging/redhat/scripts/after-install.sh']:
+            with open(os.path.join(views[0], relative_path), 'r+') as view_file:  # Truncates in place, like a changelog rewrite
+                view_file.truncate(0)
+                view_file.write('1.5.3\n')
+            self.assertEqual(self._read(views[0], relative_path), '1.5.3\n')
+            self.assertEqual(self._read(self.source, relative_path), '__NEW_VERSION__\n')
+            self.assertEqual(self._read(views[1], relative_path), '__NEW_VERSION__\n')
+            self.assertNotEqual(os.stat(os.path.join(views[0], relative_path)).st_ino,
+                                os.stat(os.path.join(self.source, relative_path)).st_ino)
+
+    def test_whole_tree_writable(self):
+        """
+        No file of a tree which is writable as a whole is hardlinked
+        """
+        view = os.path.join(self.directory, 'view')
+        link_tree(self.source, view, writable=True)
+        for root, _, filenames in os.walk(view):
+            for filename in filenames:
+                self.assertEqual(os.stat(os.path.join(root, filename)).st_nlink, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
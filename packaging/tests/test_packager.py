@@ -0,0 +1,104 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Packager test module
+"""
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+from packaging.packagers.packager import Packager
+from packaging.transport import LocalTransport
+
+
+class _SourceCollector(object):
+    """
+    Holds the only information of a source collector a packager needs to include packages
+    """
+    def __init__(self, path_package):
+        self.path_package = path_package
+
+
+class IncludePackagesTest(unittest.TestCase):
+    """
+    Tests the batched inclusion of packages in a repository, using a reprepro stand-in
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        bin_path = os.path.join(self.directory, 'bin')
+        os.mkdir(bin_path)
+        self.failing_path = os.path.join(self.directory, 'failing')
+        os.mkdir(self.failing_path)
+        reprepro_path = os.path.join(bin_path, 'reprepro')
+        with open(reprepro_path, 'w') as reprepro_file:
+            # Fails the commands (includedeb or export) of which the action or the package is listed in the failing folder
+            reprepro_file.write('#!/bin/sh\n'
+                                'for argument in "$@"; do\n'
+                                '    if [ -e "{0}/$(basename -- "$argument")" ]; then echo "Failed $argument" >&2; exit 1; fi\n'
+                                'done\n'.format(self.failing_path))
+        os.chmod(reprepro_path, stat.S_IRWXU)
+        self.original_path = os.environ['PATH']
+        os.environ['PATH'] = '{0}:{1}'.format(bin_path, self.original_path)
+        self.packager = Packager(source_collector=_SourceCollector(os.path.join(self.directory, 'package')),
+                                 distro='debian',
+                                 package_suffix='.deb')
+        self.destination = {'ip': '127.0.0.1', 'user': 'upload', 'base_path': os.path.join(self.directory, 'repo')}
+        self.transport = LocalTransport(user='upload', server='127.0.0.1')
+        self.package_paths = [os.path.join(self.directory, 'upload', name) for name in ['alba_1.5.3_amd64.deb', 'alba-ee_1.5.3_amd64.deb']]
+
+    def tearDown(self):
+        os.environ['PATH'] = self.original_path
+        shutil.rmtree(self.directory)
+
+    def _fail(self, name):
+        open(os.path.join(self.failing_path, name), 'w').close()
+
+    def _include(self):
+        return self.packager.include_packages(destination=self.destination,
+                                              transport=self.transport,
+                                              release='unstable',
+                                              package_paths=self.package_paths)
+
+    def test_all_included(self):
+        """
+        Every package is included when reprepro succeeds
+        """
+        self.assertEqual(self._include(), dict((path, True) for path in self.package_paths))
+
+    def test_failed_package(self):
+        """
+        A package which could not be included fails on its own
+        """
+        self._fail('alba-ee_1.5.3_amd64.deb')
+        with self.assertRaises(RuntimeError) as context:
+            self._include()
+        self.assertEqual(str(context.exception), 'Adding alba-ee_1.5.3_amd64.deb to repo unstable failed')
+
+    def test_failed_export_fails_every_package(self):
+        """
+        Packages which were included are not available when the indices could not be exported
+        """
+        self._fail('export')
+        with self.assertRaises(RuntimeError) as context:
+            self._include()
+        self.assertEqual(str(context.exception), 'Adding alba_1.5.3_amd64.deb, alba-ee_1.5.3_amd64.deb to repo unstable failed (export failed)')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Tag index test module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from subprocess import check_output
+from packaging.tagindex import TagIndex
+
+
+class TagIndexTest(unittest.TestCase):
+    """
+    Tests the tag index against the refs of a real repository
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environment = dict(os.environ, GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='test@localhost',
+                                GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='test@localhost')
+        self._git('init -q')
+        self._git('commit -q --allow-empty -m first')
+        self.first_commit = self._git('rev-parse HEAD').strip()
+        self._git('tag 1.5.2')  # Lightweight
+        self._git('commit -q --allow-empty -m second')
+        self.second_commit = self._git('rev-parse HEAD').strip()
+        self._git('tag -a 1.5.3 -m "Added tag 1.5.3 for changeset {0}"'.format(self.second_commit))  # Annotated, like _tag_revision
+        self.tag_object = self._git('rev-parse refs/tags/1.5.3').strip()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _git(self, arguments):
+        return check_output('git {0}'.format(arguments), shell=True, cwd=self.directory, env=self.environment)
+
+    def test_annotated_tag_is_indexed_on_its_commit(self):
+        """
+        An annotated tag is found by the commit it points to, not by its tag object
+        """
+        self.assertNotEqual(self.tag_object, self.second_commit)
+        index = TagIndex()
+        index.update(self._git('show-ref --tags -d'))
+        self.assertTrue(index.is_tagged(self.second_commit))
+        self.assertFalse(index.is_tagged(self.tag_object))
+        self.assertTrue(index.is_tagged(self.first_commit))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.latest_tag('1.5'), '1.5.3')
+        self.assertEqual(index.latest_build('1.5'), 3)
+
+    def test_index_of_tag_objects_gets_updated(self):
+        """
+        An index which was persisted with the tag object of an annotated tag moves the tag to its commit
+        """
+        path = os.path.join(self.directory, 'tags.json')
+        index = TagIndex(path=path)
+        index.update(self._git('show-ref --tags'))
+        self.assertTrue(index.is_tagged(self.tag_object))
+        index.save()
+
+        index = TagIndex.load(path)
+        self.assertEqual(index.update(self._git('show-ref --tags -d')), (1, 0))
+        self.assertTrue(index.is_tagged(self.second_commit))
+        self.assertFalse(index.is_tagged(self.tag_object))
+        self.assertEqual(index.update(self._git('show-ref --tags -d')), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Tracing module
+"""
+import os
+import json
+import time
+import errno
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from multiprocessing.util import register_after_fork
+from packaging.helpers import format_duration, format_size
+
+
+def wait_process(process, span=None):
+    """
+    Waits for a process started with subprocess.Popen while collecting its resource usage
+    :param process: The process to wait for
+    :type process: subprocess.Popen
+    :param span: Span to record the exit code and resource usage of the process on. See Tracer.span
+    :type span: dict
+    :return: The exit code of the process (negative signal number when it was killed by a signal)
+    :rtype: int
+    """
+    while True:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+            break
+        except OSError as ex:
+            if ex.errno == errno.EINTR:
+                continue
+            if ex.errno == errno.ECHILD:  # Reaped elsewhere already
+                return process.wait()
+            raise
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    if span is not None:
+        span['args'].update({'exit_code': process.returncode,
+                             'cpu_user': rusage.ru_utime,
+                             'cpu_system': rusage.ru_stime,
+                             'max_rss': rusage.ru_maxrss * 1024})  # Reported in KiB on Linux
+    return process.returncode
+
+
+class Tracer(object):
+    """
+    Tracer class
+
+    Records spans (named, timed sections) of a run. Disabled unless enabled explicitly
+    * Spans of processes forked after enabling (see orchestrator.ProcessGroup) are collected through a shared directory
+    * The spans can be exported as Chrome trace JSON (chrome://tracing, ui.perfetto.dev) and summarized as text
+    * Spans of commands also hold the CPU time, maximum RSS and exit code of the command. See wait_process
+    """
+
+    _enabled = False
+    _directory = None  # Directory in which every traced process stores its spans
+    _owner_pid = None  # Process which enabled the tracing
+    _pid = None
+    _label = None
+    _spans = []
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _reset_after_fork(_):
+        # Forked while another thread held the lock. The spans of the parent are flushed by the parent
+        Tracer._lock = threading.Lock()
+        Tracer._pid = os.getpid()
+        Tracer._spans = []
+
+    @staticmethod
+    def enable():
+        """
+        Enables tracing for this process and for the processes forked from now on
+        :return: None
+        :rtype: NoneType
+        """
+        Tracer._enabled = True
+        Tracer._directory = tempfile.mkdtemp(prefix='fwk-trace-')
+        Tracer._owner_pid = os.getpid()
+        Tracer._pid = os.getpid()
+        Tracer._label = 'main'
+        Tracer._spans = []
+
+    @staticmethod
+    def is_enabled():
+        """
+        Checks whether tracing is enabled
+        :return: True when tracing is enabled
+        :rtype: bool
+        """
+        return Tracer._enabled
+
+    @staticmethod
+    def set_label(label):
+        """
+        Names the current process in the trace
+        :param label: Name of the process (eg: the product or distro it builds)
+        :type label: str
+        :return: None
+        :rtype: NoneType
+        """
+        Tracer._label = label
+
+    @staticmethod
+    @contextmanager
+    def span(name, category='phase', **args):
+        """
+        Records a span around the wrapped code
+        :param name: Name of the span (eg: 'sync')
+        :type name: str
+        :param category: Category of the span ('phase', 'command', 'remote', ...)
+        :type category: str
+        :param args: Additional information to store with the span
+        :return: The span. Its 'args' can be extended while it is open
+        :rtype: dict
+        """
+        span = {'name': name,
+                'category': category,
+                'args': args}
+        if Tracer._enabled is False:
+            yield span
+            return
+        start = time.time()
+        try:
+            yield span
+        except BaseException:
+            span['args']['failed'] = True
+            raise
+        finally:
+            span.update({'start': start,
+                         'duration': time.time() - start,
+                         'tid': threading.current_thread().ident})
+            with Tracer._lock:
+                if Tracer._pid != os.getpid():
+                    # Forked: the spans of the parent are flushed by the parent
+                    Tracer._pid = os.getpid()
+                    Tracer._spans = []
+                Tracer._spans.append(span)
+
+    @staticmethod
+    def flush():
+        """
+        Stores the spans of this process in the shared trace directory
+        :return: None
+        :rtype: NoneType
+        """
+        if Tracer._enabled is False:
+            return
+        with Tracer._lock:
+            if Tracer._pid != os.getpid():
+                return
+            spans = list(Tracer._spans)
+        temp_path = os.path.join(Tracer._directory, '{0}.tmp'.format(os.getpid()))
+        with open(temp_path, 'w') as trace_file:
+            json.dump({'pid': os.getpid(),
+                       'label': Tracer._label,
+                       'spans': spans}, trace_file)
+        os.rename(temp_path, os.path.join(Tracer._directory, '{0}.json'.format(os.getpid())))
+
+    @staticmethod
+    def collect():
+        """
+        Collects the spans of this process and of all traced processes which were forked from it
+        :return: The spans and the label per process id
+        :rtype: tuple(list[dict], dict)
+        """
+        Tracer.flush()
+        spans = []
+        labels = {}
+        for filename in sorted(os.listdir(Tracer._directory)):
+            if not filename.endswith('.json'):
+                continue
+            with open(os.path.join(Tracer._directory, filename), 'r') as trace_file:
+                data = json.load(trace_file)
+            labels[data['pid']] = data['label']
+            for span in data['spans']:
+                span['pid'] = data['pid']
+                spans.append(span)
+        return sorted(spans, key=lambda s: s['start']), labels
+
+    @staticmethod
+    def export_chrome_trace(path):
+        """
+        Writes all spans in the Chrome trace event format
+        :param path: Path of the JSON file to write
+        :type path: str
+        :return: None
+        :rtype: NoneType
+        """
+        spans, labels = Tracer.collect()
+        events = [{'name': 'process_name',
+                   'ph': 'M',
+                   'pid': pid,
+                   'args': {'name': '{0} ({1})'.format(label, pid)}} for pid, label in sorted(labels.iteritems())]
+        for span in spans:
+            events.append({'name': span['name'],
+                           'cat': span['category'],
+                           'ph': 'X',
+                           'ts': int(span['start'] * 1000000),
+                           'dur': int(span['duration'] * 1000000),
+                           'pid': span['pid'],
+                           'tid': span['tid'],
+                           'args': span['args']})
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events,
+                       'displayTimeUnit': 'ms'}, trace_file)
+        print 'Trace written to {0}'.format(path)
+
+    @staticmethod
+    def summarize():
+        """
+        Summarizes all spans per category and name: the amount, wall time, CPU time of the commands and maximum RSS
+        :return: The summary
+        :rtype: str
+        """
+        spans, _ = Tracer.collect()
+        totals = {}
+        for span in spans:
+            total = totals.setdefault((span['category'], span['name']), {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'max_rss': 0, 'failed': 0})
+            args = span['args']
+            total['count'] += 1
+            total['wall'] += span['duration']
+            total['cpu'] += args.get('cpu_user', 0) + args.get('cpu_system', 0)
+            total['max_rss'] = max(total['max_rss'], args.get('max_rss', 0))
+            if args.get('failed') is True or args.get('exit_code', 0) != 0:
+                total['failed'] += 1
+        lines = ['Trace summary',
+                 '  {0:<10} {1:<40} {2:>6} {3:>12} {4:>12} {5:>12} {6:>7}'.format('Category', 'Name', 'Count', 'Wall', 'Child CPU', 'Max RSS', 'Failed')]
+        for (category, name), total in sorted(totals.iteritems(), key=lambda item: item[1]['wall'], reverse=True):
+            lines.append('  {0:<10} {1:<40} {2:>6} {3:>12} {4:>12} {5:>12} {6:>7}'.format(category, name[:40], total['count'],
+                                                                                           format_duration(total['wall']),
+                                                                                           format_duration(total['cpu']) if total['cpu'] > 0 else '-',
+                                                                                           format_size(total['max_rss']) if total['max_rss'] > 0 else '-',
+                                                                                           total['failed']))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def finish(path=None):
+        """
+        Exports the trace, prints the summary and cleans up. Only has effect in the process which enabled the tracing
+        :param path: Path of the Chrome trace JSON file to write. None to only print the summary
+        :type path: str
+        :return: None
+        :rtype: NoneType
+        """
+        if Tracer._enabled is False or Tracer._owner_pid != os.getpid():
+            return
+        if path is not None:
+            Tracer.export_chrome_trace(path)
+        print Tracer.summarize()
+        shutil.rmtree(Tracer._directory, ignore_errors=True)
+        Tracer._enabled = False
+
+
+register_after_fork(Tracer, Tracer._reset_after_fork)
@@ -0,0 +1,327 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Transport module
+"""
+import os
+import re
+import threading
+from pipes import quote
+from packaging.helpers import format_size
+from packaging.sourcecollector import SourceCollector
+from packaging.tracing import Tracer
+
+
+class Transport(object):
+    """
+    Base class for transports
+    A transport executes commands on and copies files to a package destination
+    Transports are cached per process and destination, so a single connection can be re-used for the whole run
+    """
+
+    _pid = None
+    _transports = {}
+    _lock = threading.Lock()
+
+    # Partial files are kept (and resumed) when a transfer gets interrupted and only changed blocks are sent against the
+    # file which is already present at the destination. With --fuzzy, a similarly named file in the destination folder
+    # (eg: the previous build) is used as basis when the file itself is not present yet
+    RSYNC_OPTIONS = '--partial --no-whole-file --fuzzy --stats'
+    RSYNC_STAT_REGEX = re.compile('^(?P<name>Total file size|Total bytes sent|Literal data|Matched data): (?P<value>[0-9,.]+)', re.MULTILINE)
+    RSYNC_STAT_KEYS = {'Total file size': 'size',
+                       'Total bytes sent': 'sent',
+                       'Literal data': 'literal',
+                       'Matched data': 'matched'}
+
+    def __init__(self, user, server):
+        """
+        Initializes a transport
+        :param user: User to connect with
+        :type user: str
+        :param server: Server to connect to
+        :type server: str
+        """
+        self.user = user
+        self.server = server
+
+    def __str__(self):
+        return '{0}@{1}'.format(self.user, self.server)
+
+    @staticmethod
+    def get(user, server, settings=None):
+        """
+        Retrieves the transport for the given destination, creating it when required
+        The type of transport is read from the 'transport' section of the settings
+        :param user: User to connect with
+        :type user: str
+        :param server: Server to connect to
+        :type server: str
+        :param settings: Packaging settings. Defaults to the settings of the SourceCollector
+        :type settings: dict
+        :return: The transport for the destination
+        :rtype: Transport
+        """
+        if settings is None:
+            settings = SourceCollector.get_settings()
+        transport_settings = settings.get('transport', {})
+        transport_type = transport_settings.get('type', 'ssh')
+        if transport_type not in TRANSPORT_TYPES:
+            raise ValueError('Transport "{0}" is not a valid option. Possible options are: {1}'.format(transport_type, ', '.join(sorted(TRANSPORT_TYPES))))
+        key = (transport_type, user, server)
+        with Transport._lock:
+            if Transport._pid != os.getpid():
+                # Forked processes should not re-use (and close) the connections of their parent
+                Transport._pid = os.getpid()
+                Transport._transports = {}
+            if key not in Transport._transports:
+                Transport._transports[key] = TRANSPORT_TYPES[transport_type](user=user, server=server, **transport_settings.get(transport_type, {}))
+            return Transport._transports[key]
+
+    @staticmethod
+    def close_all():
+        """
+        Closes all cached transports
+        :return: None
+        :rtype: NoneType
+        """
+        with Transport._lock:
+            if Transport._pid != os.getpid():
+                return
+            for transport in Transport._transports.itervalues():
+                transport.close()
+            Transport._transports.clear()
+
+    def run(self, command, print_only=False):
+        """
+        Executes a command on the destination
+        :param command: Command to execute. Will be interpreted by the shell of the destination
+        :type command: str
+        :param print_only: Only print the command instead of executing it
+        :type print_only: bool
+        :return: The output of the command
+        :rtype: str
+        """
+        raise NotImplementedError()
+
+    def put(self, source, destination, print_only=False, basis=None):
+        """
+        Copies a local file to the destination
+        :param source: Local path of the file
+        :type source: str
+        :param destination: Remote path to copy the file to
+        :type destination: str
+        :param print_only: Only print the command instead of executing it
+        :type print_only: bool
+        :param basis: Remote path of a similar file (eg: the previous build of a package). When transferring deltas, the
+        destination is seeded with it so only the blocks which differ are sent
+        :type basis: str
+        :return: The transfer statistics when transferring deltas (see parse_rsync_stats), None otherwise
+        :rtype: dict
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def parse_rsync_stats(output):
+        """
+        Parses the output of rsync --stats
+        :param output: Output of rsync
+        :type output: str
+        :return: The total file size, the bytes sent, the literal (changed) data and the matched data
+        :rtype: dict
+        """
+        stats = dict((key, 0) for key in Transport.RSYNC_STAT_KEYS.itervalues())
+        for match in Transport.RSYNC_STAT_REGEX.finditer(output):
+            stats[Transport.RSYNC_STAT_KEYS[match.group('name')]] = int(match.group('value').replace(',', '').replace('.', ''))
+        return stats
+
+    @staticmethod
+    def format_stats(stats):
+        """
+        Formats transfer statistics
+        :param stats: Transfer statistics. See parse_rsync_stats
+        :type stats: dict
+        :return: The formatted statistics (eg: sent 1.2 MiB of 300.0 MiB (0.4%), 310.0 KiB changed)
+        :rtype: str
+        """
+        return 'sent {0} of {1} ({2:.1f}%), {3} changed'.format(format_size(stats['sent']), format_size(stats['size']),
+                                                                 100.0 * stats['sent'] / stats['size'] if stats['size'] > 0 else 100.0,
+                                                                 format_size(stats['literal']))
+
+    def _rsync(self, source, destination, remote_shell=None, print_only=False, basis=None, timeout=None, retries=0):
+        """
+        Transfers a file with rsync, seeding the destination with a basis file when it does not exist yet
+        Retried attempts resume from the partial file of the previous attempt
+        """
+        if basis is not None:
+            self.run(command='[ -e {1} ] || cp {0} {1}'.format(quote(basis), quote(destination)), print_only=print_only)
+        output = SourceCollector.run(command='rsync {0} {1}{2} {3}'.format(self.RSYNC_OPTIONS,
+                                                                          '' if remote_shell is None else '-e {0} '.format(quote(remote_shell)),
+                                                                          quote(source),
+                                                                          quote(destination) if remote_shell is None else '{0}:{1}'.format(self, quote(destination))),
+                                     working_directory='/',
+                                     print_only=print_only,
+                                     timeout=timeout,
+                                     retries=retries)
+        if output is None:  # Dry run
+            return None
+        return Transport.parse_rsync_stats(output)
+
+    def close(self):
+        """
+        Closes the connection to the destination, if any
+        :return: None
+        :rtype: NoneType
+        """
+        pass
+
+
+class SSHTransport(Transport):
+    """
+    SSHTransport class
+
+    Executes all commands and copies over a single, multiplexed SSH connection per destination
+    The master connection is started on first use and closed when the transport is closed
+    Files are copied with scp, or with rsync to resume interrupted transfers and to only send the changed blocks
+    """
+
+    TRANSFER_MODES = ['scp', 'rsync']
+
+    def __init__(self, user, server, control_path='/tmp/fwk-ssh-{0}-%r@%h:%p', control_persist=600, options=None, timeout=None, retries=0, transfer='scp'):
+        """
+        Initializes a SSH transport
+        :param user: User to connect with
+        :type user: str
+        :param server: Server to connect to
+        :type server: str
+        :param control_path: Path of the control socket. Supports the ssh_config tokens. {0} is replaced by the process id
+        :type control_path: str
+        :param control_persist: Seconds the master connection stays open after the last use
+        :type control_persist: int
+        :param options: Additional ssh options (eg: {'StrictHostKeyChecking': 'no'})
+        :type options: dict
+        :param timeout: Seconds after which a command or copy gets killed. None to wait forever
+        :type timeout: float
+        :param retries: Amount of times to retry a copy, or a command of which the connection failed (exit status 255)
+        :type retries: int
+        :param transfer: How to copy files: 'scp' or 'rsync' (resumable delta transfers, requires rsync on both ends)
+        :type transfer: str
+        """
+        super(SSHTransport, self).__init__(user, server)
+        if transfer not in self.TRANSFER_MODES:
+            raise ValueError('Transfer "{0}" is not a valid option. Possible options are: {1}'.format(transfer, ', '.join(self.TRANSFER_MODES)))
+        options = dict(options or {})
+        options.update({'ControlMaster': 'auto',
+                        'ControlPath': control_path.format(os.getpid()),
+                        'ControlPersist': control_persist})
+        self.timeout = timeout
+        self.retries = retries
+        self.transfer = transfer
+        self.ssh_options = ' '.join('-o {0}'.format(quote('{0}={1}'.format(key, value))) for key, value in sorted(options.iteritems()))
+
+    def run(self, command, print_only=False):
+        """
+        Executes a command on the destination over the multiplexed connection
+        """
+        with Tracer.span('remote run', category='remote', destination=str(self), command=command):
+            return SourceCollector.run(command='ssh {0} {1} {2}'.format(self.ssh_options, self, quote(command)),
+                                       working_directory='/',
+                                       print_only=print_only,
+                                       timeout=self.timeout,
+                                       retries=self.retries,
+                                       retry_on=[255])
+
+    def put(self, source, destination, print_only=False, basis=None):
+        """
+        Copies a local file to the destination over the multiplexed connection
+        """
+        with Tracer.span('remote put', category='remote', destination=str(self), source=source, size=os.path.getsize(source), transfer=self.transfer) as span:
+            if self.transfer == 'rsync':
+                stats = self._rsync(source=source,
+                                    destination=destination,
+                                    remote_shell='ssh {0}'.format(self.ssh_options),
+                                    print_only=print_only,
+                                    basis=basis,
+                                    timeout=self.timeout,
+                                    retries=self.retries)
+                if stats is not None:
+                    span['args'].update(stats)
+                return stats
+            SourceCollector.run(command='scp {0} {1} {2}:{3}'.format(self.ssh_options, quote(source), self, quote(destination)),
+                                working_directory='/',
+                                print_only=print_only,
+                                timeout=self.timeout,
+                                retries=self.retries)
+
+    def close(self):
+        """
+        Stops the master connection
+        """
+        SourceCollector.run(command='ssh {0} -O exit {1} 2>/dev/null || true'.format(self.ssh_options, self),
+                            working_directory='/')
+
+
+class LocalTransport(Transport):
+    """
+    LocalTransport class
+
+    Stand-in for a remote destination which executes everything on the local machine
+    Meant for testing and benchmarking without package servers: point the base_path of the destination to a local directory
+    """
+
+    TRANSFER_MODES = ['copy', 'rsync']
+
+    def __init__(self, user, server, transfer='copy'):
+        """
+        Initializes a local transport
+        :param user: User of the destination (informative)
+        :type user: str
+        :param server: Server of the destination (informative)
+        :type server: str
+        :param transfer: How to copy files: 'copy' or 'rsync' (delta transfers, to measure them without a remote)
+        :type transfer: str
+        """
+        super(LocalTransport, self).__init__(user, server)
+        if transfer not in self.TRANSFER_MODES:
+            raise ValueError('Transfer "{0}" is not a valid option. Possible options are: {1}'.format(transfer, ', '.join(self.TRANSFER_MODES)))
+        self.transfer = transfer
+
+    def run(self, command, print_only=False):
+        """
+        Executes a command locally
+        """
+        with Tracer.span('remote run', category='remote', destination=str(self), command=command):
+            return SourceCollector.run(command=command,
+                                       working_directory='/',
+                                       print_only=print_only)
+
+    def put(self, source, destination, print_only=False, basis=None):
+        """
+        Copies a file locally
+        """
+        with Tracer.span('remote put', category='remote', destination=str(self), source=source, size=os.path.getsize(source), transfer=self.transfer) as span:
+            if self.transfer == 'rsync':
+                stats = self._rsync(source=source, destination=destination, print_only=print_only, basis=basis)
+                if stats is not None:
+                    span['args'].update(stats)
+                return stats
+            SourceCollector.run(command='cp {0} {1}'.format(quote(source), quote(destination)),
+                                working_directory='/',
+                                print_only=print_only)
+
+
+TRANSPORT_TYPES = {'ssh': SSHTransport,
+                   'local': LocalTransport}